@@ -0,0 +1,329 @@
+"""
+Benchmark of the L1B stages over synthetic ASIRAS and ALS files
+
+The files of `synthetic` are decoded, their waveforms processed and the ALS
+elevations aggregated to the ASIRAS footprints with the implementations that
+run on the client. Given a config.ini, the files are also inserted,
+processed and aggregated by a `Process` on its database, into `bench_`
+tables that are dropped before each stage and after the run.
+
+Each run appends its results to a CSV file so throughput can be compared
+between changes to the loaders and retrackers.
+
+Run from the project folder with:
+
+    python -m src.benchmark.l1b [num_blocks] [num_lines] [config.ini]
+"""
+
+from typing import Optional, Callable, Any, List, Dict, Tuple
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import csv
+import os
+import sys
+import numpy as np
+
+from ..config import read_config, COL, COLCONFIG, SRID, PARAM
+from ..load.l1b import AsirasLoader, AlsLoader, asiras_config
+from ..postgis import new_session
+from ..process import new_process, Process, queries, kernels, aggregate
+from ..process.aggregate import AggregationEngine, aggregate_to_radii
+from ..process.tools import calc_waveform_outputs
+from .synthetic import write_asiras_dbl, write_als, track_metres
+
+# columns of the results file in order
+results_columns = [
+    'recorded_at', 'stage', 'engine', 'rows', 'seconds', 'rows_per_second',
+    'asiras_blocks', 'als_lines', 'points_per_line', 'compiled'
+]
+
+# ASIRAS columns read by the client stages
+asiras_cols = [
+    COL.linear_scale_factor, COL.power2_scale_factor, COL.window_delay,
+    COL.altitude, COL.ml_power_echo, COL.latitude, COL.longitude
+]
+
+# tables of the database stages
+bench_tables = dict(
+    asr='bench_asr_src', als='bench_als_src', tfmra='bench_asr_tfmra',
+    wshape='bench_asr_wshape', wscaled='bench_asr_wscaled',
+    fp='bench_asr_fp', aggr='bench_asr_aggr_als'
+)
+
+
+def best_time(
+        func: Callable[[], Any],
+        repeat=1,
+        setup: Optional[Callable[[], Any]] = None
+) -> Tuple[float, Any]:
+    """
+    Return the best time in seconds of `repeat` calls of `func`, each after
+    calling `setup` if given, and the result of the last call
+    """
+    best = result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        result = func()
+        seconds = perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def _record(stage: str, engine: str, rows: int, seconds: float) -> Dict:
+    return dict(
+        stage=stage, engine=engine, rows=rows, seconds=seconds,
+        rows_per_second=rows / seconds if seconds else None
+    )
+
+
+def _decode_als(file_path: str) -> np.ndarray:
+    loader = AlsLoader()
+    with loader.open_lines(file_path) as lines:
+        return loader._filter_points(loader._stack_points(lines.records()))
+
+
+def run_client(asiras_path: str, als_path: str, repeat=3) -> List[Dict]:
+    """
+    Return the records of the client stages over the files at `asiras_path`
+    and `als_path`, each the best of `repeat` runs. Aggregation is skipped if
+    scipy is not installed.
+    """
+    seconds, columns = best_time(
+        lambda: AsirasLoader().read_columns(asiras_path, asiras_cols), repeat
+    )
+    num_rows = len(columns[COL.altitude])
+    records = [_record('decode_asiras', 'client', num_rows, seconds)]
+
+    seconds, points = best_time(lambda: _decode_als(als_path), repeat)
+    records.append(_record('decode_als', 'client', len(points), seconds))
+
+    read_cols = [
+        np.asarray(columns[name], dtype=float) for name in asiras_cols[:5]
+    ]
+    seconds, _ = best_time(
+        lambda: calc_waveform_outputs(
+            *read_cols,
+            bin_size=PARAM.bin_size,
+            retracker_thresholds=PARAM.retracker_thresholds,
+            ppeak_indices_left=PARAM.ppeak_indices_left,
+            ppeak_indices_right=PARAM.ppeak_indices_right,
+            signal_threshold=PARAM.signal_threshold
+        ),
+        repeat
+    )
+    records.append(_record('waveform_processing', 'client', num_rows, seconds))
+
+    if aggregate.cKDTree is None:
+        print("scipy is not installed, skipping the client aggregation")
+        return records
+
+    # points are (elevation, longitude, latitude)
+    nadir_xy = track_metres(columns[COL.latitude], columns[COL.longitude])
+    observation_xy = track_metres(points[:, 2], points[:, 1])
+    seconds, _ = best_time(
+        lambda: aggregate_to_radii(
+            nadir_xy, observation_xy, points[:, 0], PARAM.fp_radii,
+            PARAM.rough_margin
+        ),
+        repeat
+    )
+    records.append(_record('aggregation', 'client', num_rows, seconds))
+
+    return records
+
+
+def _drop_tables(process: Process, *names: str):
+    for name in names:
+        process.session.drop_table(bench_tables[name])
+    process.session.commit()
+
+
+def run_database(
+        process: Process,
+        asiras_path: str,
+        als_path: str,
+        num_rows: int,
+        num_points: int,
+        repeat=1
+) -> List[Dict]:
+    """
+    Return the records of the stages run by `process` over the files at
+    `asiras_path` and `als_path`, with `num_rows` rows and `num_points` valid
+    points, each the best of `repeat` runs. Footprints are aggregated with
+    the engine of `PARAM.fp_aggregation`.
+    """
+    engine = AggregationEngine(PARAM.fp_aggregation)
+
+    stages = [
+        (
+            'insert_asiras', num_rows, ['asr'], lambda: process.load_asiras(
+                asiras_path, bench_tables['asr'], COL.id_asr,
+                COL.longitude, COL.latitude, SRID.source, SRID.eureka
+            )
+        ),
+        (
+            'insert_als', num_points, ['als'], lambda: process.load_als(
+                als_path, bench_tables['als'], COL.id_als, COL.snow_elvtn,
+                SRID.eureka
+            )
+        ),
+        (
+            'waveform_processing', num_rows, ['tfmra', 'wshape', 'wscaled'],
+            lambda: process.waveform_processing(
+                bench_tables['tfmra'], COLCONFIG.asr_tfmra,
+                bench_tables['wshape'], COLCONFIG.asr_wshape,
+                bench_tables['wscaled'], COLCONFIG.asr_wscaled,
+                bench_tables['asr'], source_file=asiras_path
+            )
+        ),
+        (
+            'footprints', num_rows, ['fp'],
+            lambda: process.create_asiras_footprints(
+                bench_tables['fp'], bench_tables['asr'], bench_tables['asr']
+            )
+        ),
+        (
+            'aggregation', num_rows, ['aggr'],
+            lambda: process.aggregate_observations(
+                "Benchmark Aggr.", bench_tables['aggr'], kwargs=dict(
+                    ftpr=bench_tables['fp'], nadir=bench_tables['asr'],
+                    obsv=bench_tables['als'],
+                    val=COL.snow_elvtn,
+                    val_min=COL.snow_elvtn_min,
+                    val_max=COL.snow_elvtn_max,
+                    val_mean=COL.snow_elvtn_mean,
+                    val_stddev=COL.snow_elvtn_stddev,
+                    val_count=COL.snow_elvtn_count,
+                    val_rough=COL.snow_elvtn_rough
+                ),
+                engine=engine
+            )
+        )
+    ]
+
+    records = []
+    for stage, rows, outputs, run_stage in stages:
+        seconds, _ = best_time(
+            run_stage, repeat, lambda: _drop_tables(process, *outputs)
+        )
+        # the engine is a name of `AggregationEngine` for aggregation
+        stage_engine = engine.value if stage == 'aggregation' else 'postgis'
+        records.append(_record(stage, stage_engine, rows, seconds))
+
+    return records
+
+
+def write_results(
+        records: List[Dict],
+        results_path: str,
+        **run_values
+) -> str:
+    """
+    Append `records` with the `run_values` of their run to the CSV file at
+    `results_path`, which is created with a header if it does not exist
+    """
+    folder = os.path.dirname(results_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    write_header = not os.path.isfile(results_path)
+
+    recorded_at = datetime.now().isoformat(timespec='seconds')
+
+    with open(results_path, 'a', newline='') as file:
+        writer = csv.writer(file)
+        if write_header:
+            writer.writerow(results_columns)
+        writer.writerows(
+            [
+                dict(recorded_at=recorded_at, **run_values, **record)
+                .get(col) for col in results_columns
+            ]
+            for record in records
+        )
+
+    return results_path
+
+
+def run(
+        num_blocks=500,
+        num_lines=2000,
+        points_per_line=200,
+        config_path: Optional[str] = None,
+        results_path=os.path.join('.', 'logs', 'benchmark', 'l1b.csv'),
+        repeat=3
+) -> List[Dict]:
+    """
+    Return the records of every stage over synthetic files of `num_blocks`
+    ASIRAS blocks and `num_lines` ALS lines of `points_per_line` points
+    along a track of a metre per ASIRAS row, and append them to
+    `results_path`.
+
+    The database stages run once each on the database of the config.ini at
+    `config_path` if given.
+    """
+    track_length = float(num_blocks * asiras_config.rows_per_block)
+
+    with TemporaryDirectory() as data_dir:
+        asiras_path = os.path.join(data_dir, 'asiras.DBL')
+        als_path = os.path.join(data_dir, 'als.bin')
+        write_asiras_dbl(asiras_path, num_blocks, track_length)
+        write_als(als_path, num_lines, points_per_line, track_length)
+
+        records = run_client(asiras_path, als_path, repeat)
+
+        if config_path is not None:
+            _, new_session_kwargs, new_process_kwargs = \
+                read_config(config_path)
+            new_process_kwargs['name'] = 'benchmark'
+            num_rows, num_points = [
+                next(r['rows'] for r in records if r['stage'] == stage)
+                for stage in ['decode_asiras', 'decode_als']
+            ]
+
+            with new_session(**new_session_kwargs) as session, \
+                    new_process(session=session, **new_process_kwargs) \
+                    as process:
+                process.execute_query("Setup", queries.setup)
+                try:
+                    records += run_database(
+                        process, asiras_path, als_path, num_rows, num_points
+                    )
+                finally:
+                    _drop_tables(process, *bench_tables)
+
+    write_results(
+        records, results_path, asiras_blocks=num_blocks, als_lines=num_lines,
+        points_per_line=points_per_line, compiled=kernels.compiled
+    )
+
+    return records
+
+
+def main():
+    num_blocks, num_lines = [int(arg) for arg in sys.argv[1:3]] + \
+        [500, 2000][len(sys.argv[1:3]):]
+    config_path = sys.argv[3] if len(sys.argv) > 3 else None
+
+    if config_path is None:
+        print("no config.ini path argument, skipping the database stages")
+
+    records = run(num_blocks, num_lines, config_path=config_path)
+
+    print(
+        f"{num_blocks} ASIRAS blocks "
+        f"({num_blocks * asiras_config.rows_per_block} rows), "
+        f"{num_lines} ALS lines"
+    )
+    for record in records:
+        print(
+            f"{record['stage']:>20} {record['engine']:>8}: "
+            f"{record['seconds']:8.4f} s {record['rows_per_second']:12.0f} "
+            f"rows/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
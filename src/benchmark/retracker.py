@@ -0,0 +1,117 @@
+"""
+Benchmark of the implementations of `lin_interp_from_first_max` over the
+rows of a waveform array
+
+Run from the project folder with:
+
+    python -m src.benchmark.retracker [num_rows] [num_bins]
+"""
+
+from typing import Callable, Dict, List
+import sys
+import timeit
+import numpy as np
+
+from ..process import kernels
+from ..process.tools import InterpolateDirection, lin_interp_from_first_max, \
+    lin_interp_from_first_max_2d
+
+
+def random_waveforms(num_rows: int, num_bins: int, seed=0) -> np.ndarray:
+    """
+    Return `num_rows` random waveforms of `num_bins` bins with a single peak
+    """
+    rng = np.random.RandomState(seed)
+    bins = np.arange(num_bins)
+    peaks = rng.randint(num_bins // 4, 3 * num_bins // 4, (num_rows, 1))
+    widths = rng.uniform(2, num_bins / 8, (num_rows, 1))
+    noise = rng.uniform(0, 0.05, (num_rows, num_bins))
+    return np.exp(-((bins - peaks) / widths) ** 2) + noise
+
+
+def apply_along_axis_interp(
+        arrays: np.ndarray,
+        thresholds: List[float],
+        direction: InterpolateDirection
+) -> np.ndarray:
+    """
+    `lin_interp_from_first_max` of every row and threshold with
+    `np.apply_along_axis`, how TFMRA was originally calculated
+    """
+    return np.column_stack([
+        np.apply_along_axis(
+            lin_interp_from_first_max, 1, arrays, threshold, direction
+        ).astype(float)
+        for threshold in thresholds
+    ])
+
+
+def implementations() -> Dict[str, Callable]:
+    """
+    Return a `dict` of the name of each available implementation to a
+    function of (`arrays`, `thresholds`, `direction`)
+    """
+    funcs = dict(
+        apply_along_axis=apply_along_axis_interp,
+        numpy=lambda arrays, thresholds, direction:
+        lin_interp_from_first_max_2d(
+            arrays, thresholds, direction, use_compiled=False
+        )
+    )
+    if kernels.compiled:
+        funcs['compiled'] = lin_interp_from_first_max_2d
+    return funcs
+
+
+def run(
+        num_rows=10000,
+        num_bins=256,
+        thresholds=(0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1),
+        direction=InterpolateDirection.LEFT,
+        repeat=3
+) -> Dict[str, float]:
+    """
+    Return a `dict` of implementation name to its best time in seconds of
+    `repeat` runs over `num_rows` random waveforms. Raises a `ValueError` if
+    any implementation gives different results.
+    """
+    arrays = random_waveforms(num_rows, num_bins)
+    thresholds = list(thresholds)
+    funcs = implementations()
+
+    # also compiles the kernel before it is timed
+    expected = funcs['apply_along_axis'](arrays, thresholds, direction)
+    for name, func in funcs.items():
+        # exact comparison that counts NaNs as equal
+        if not np.allclose(
+                func(arrays, thresholds, direction), expected,
+                rtol=0, atol=0, equal_nan=True
+        ):
+            raise ValueError(f"{name} results differ from apply_along_axis")
+
+    return {
+        name: min(timeit.repeat(
+            lambda: func(arrays, thresholds, direction),
+            number=1, repeat=repeat
+        ))
+        for name, func in funcs.items()
+    }
+
+
+def main():
+    num_rows, num_bins = [int(arg) for arg in sys.argv[1:3]] + \
+        [10000, 256][len(sys.argv[1:3]):]
+
+    if not kernels.compiled:
+        print("numba is not installed, skipping the compiled kernel")
+
+    timings = run(num_rows, num_bins)
+    baseline = timings['apply_along_axis']
+
+    print(f"{num_rows} rows of {num_bins} bins")
+    for name, seconds in timings.items():
+        print(f"{name:>20}: {seconds:8.4f} s {baseline / seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
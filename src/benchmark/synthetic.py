@@ -0,0 +1,197 @@
+"""
+Synthetic ASIRAS and ALS L1B files for benchmarks
+
+Files follow the layouts read by `AsirasLoader` and `AlsLoader`, with the
+ASIRAS nadirs along a straight track north from `track_start` and the ALS
+scan lines across the same track, so every footprint has observations.
+Values are plausible for the Eureka campaign but are not real measurements.
+"""
+
+from struct import pack
+import numpy as np
+
+from ..config import CONST
+from ..load.l1b import asiras_config
+from ..load.l1b.asiras import AsirasLoader
+from ..load.l1b.als import line_fields
+
+# latitude and longitude of the start of the track
+track_start = (80.0, -86.0)
+# metres per degree of latitude
+metres_per_degree = 111320.
+
+
+def track_degrees(
+        north: np.ndarray, east: np.ndarray, lat: float = track_start[0]
+):
+    """
+    Return the (latitude, longitude) offsets in degrees of `north` and `east`
+    metres from the track start, with longitudes scaled for `lat`
+    """
+    return (
+        north / metres_per_degree,
+        east / (metres_per_degree * np.cos(np.radians(lat)))
+    )
+
+
+def track_metres(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Return the (x, y) metres east and north of the track start of the
+    `latitude` and `longitude` arrays as a 2d array with a row per point
+    """
+    lat, lon = track_start
+    return np.column_stack([
+        (longitude - lon) * metres_per_degree * np.cos(np.radians(lat)),
+        (latitude - lat) * metres_per_degree
+    ])
+
+
+def _product_headers(num_blocks: int, config=asiras_config) -> bytes:
+    """
+    Return the main, specific and ASIRAS dataset headers of a file with
+    `num_blocks` blocks, each padded to its size in `config`
+    """
+    encoding = config.header_encoding
+    start_bytes = config.mph_bytes + config.sph_bytes + config.dsh_bytes
+
+    mph = f'{config.dsh_count_key}=+0000000001\n'
+    dsh = (
+        f'{config.dsh_name_key}="{config.dsh_asiras_prefix}_MEASUREMENTS"\n'
+        f'{config.dsh_offset_key}=+{start_bytes:020d}<bytes>\n'
+        f'{config.dsh_blocks_key}=+{num_blocks:010d}\n'
+    )
+
+    return (
+        mph.ljust(config.mph_bytes).encode(encoding)
+        + b' ' * config.sph_bytes
+        + dsh.ljust(config.dsh_bytes).encode(encoding)
+    )
+
+
+def write_asiras_dbl(
+        file_path: str,
+        num_blocks: int,
+        track_length=10000.,
+        altitude=300.,
+        surface_elvtn=0.3,
+        seed=0
+):
+    """
+    Write an ASIRAS DBL file of `num_blocks` blocks to `file_path` with the
+    nadirs evenly spaced over `track_length` metres at `altitude` metres.
+
+    Each multilooked waveform has a single peak near the middle of the range
+    window, which is centred on `surface_elvtn`, over low noise.
+    """
+    rng = np.random.RandomState(seed)
+    blocks = np.zeros(
+        num_blocks, AsirasLoader()._build_block_dtype(asiras_config.byte_order)
+    )
+    shape = (num_blocks, asiras_config.rows_per_block)
+    num_rows = num_blocks * asiras_config.rows_per_block
+
+    # scaled values are written as the integers read by the loader
+    def scaled(name: str, values: np.ndarray) -> np.ndarray:
+        scale = next(
+            field[3] for group in asiras_config.fields_format.values()
+            for field in group if field[0] == name
+        )
+        return np.round(np.asarray(values) / scale).astype(np.int64)
+
+    north = np.linspace(0, track_length, num_rows).reshape(shape)
+    lat_offset, lon_offset = track_degrees(
+        north, rng.normal(0, 0.5, shape)
+    )
+    sensor_elvtn = altitude + rng.normal(0, 1, shape)
+    speed = 70.
+    seconds = north / speed
+
+    tog = blocks['tog']
+    tog['days'] = 7389
+    tog['seconds'] = 61200 + seconds.astype(int)
+    tog['microseconds'] = (seconds % 1 * 1e6).astype(int)
+    tog['latitude'] = scaled('latitude', track_start[0] + lat_offset)
+    tog['longitude'] = scaled('longitude', track_start[1] + lon_offset)
+    tog['altitude'] = scaled('altitude', sensor_elvtn)
+    tog['velocity_xyz'] = scaled(
+        'velocity_xyz',
+        np.stack([np.zeros(shape), np.full(shape, speed), np.zeros(shape)],
+                 axis=-1)
+    )
+
+    mg = blocks['mg']
+    # two-way travel time to the surface at the range window centre
+    mg['window_delay'] = scaled(
+        'window_delay', 2 * (sensor_elvtn - surface_elvtn) / CONST.c
+    )
+    mg['retracker_range'] = scaled(
+        'retracker_range', sensor_elvtn - surface_elvtn
+    )
+    mg['surface_elvtn'] = scaled(
+        'surface_elvtn', np.full(shape, surface_elvtn)
+    )
+    mg['roll'] = scaled('roll', rng.normal(0, 0.5, shape))
+    mg['pitch'] = scaled('pitch', rng.normal(0, 0.5, shape))
+
+    mwg = blocks['mwg']
+    num_bins = mwg['ml_power_echo'].shape[-1]
+    bins = np.arange(num_bins)
+    peaks = rng.normal(num_bins / 2, 4, shape + (1,))
+    widths = rng.uniform(1.5, 6, shape + (1,))
+    echoes = 60000 * np.exp(-((bins - peaks) / widths) ** 2)
+    echoes += rng.uniform(0, 300, shape + (num_bins,))
+    mwg['ml_power_echo'] = echoes.astype(np.uint16)
+    mwg['linear_scale_factor'] = rng.randint(1000, 2000, shape)
+    mwg['power2_scale_factor'] = -20
+    mwg['num_ml_power_echoes'] = 1
+
+    with open(file_path, 'wb') as file:
+        file.write(_product_headers(num_blocks))
+        file.write(blocks.tobytes())
+
+
+def write_als(
+        file_path: str,
+        num_lines: int,
+        points_per_line=200,
+        track_length=10000.,
+        swath_width=300.,
+        nan_fraction=0.02,
+        header_bytes=40,
+        theader_line_bytes=4,
+        seed=0
+):
+    """
+    Write an ALS file of `num_lines` scan lines of `points_per_line` points to
+    `file_path`. Lines are evenly spaced over `track_length` metres and each
+    spans `swath_width` metres across the track.
+
+    Elevations are a rough snow surface and a `nan_fraction` of the points
+    have NaN values like the gaps of the real scans.
+    """
+    rng = np.random.RandomState(seed)
+    shape = (num_lines, points_per_line)
+
+    north = np.repeat(
+        np.linspace(0, track_length, num_lines)[:, None], points_per_line, 1
+    ) + rng.normal(0, 0.2, shape)
+    east = np.linspace(-swath_width / 2, swath_width / 2, points_per_line) \
+        + rng.normal(0, 0.2, shape)
+    lat_offset, lon_offset = track_degrees(north, east)
+
+    fields = dict(
+        time=61200 + north / 70.,
+        latitude=track_start[0] + lat_offset,
+        longitude=track_start[1] + lon_offset,
+        elevation=0.3 + 0.1 * np.sin(north / 50.) + rng.gamma(2, 0.05, shape)
+    )
+    lines = np.stack([fields[name] for name in line_fields], axis=1)
+    lines[rng.uniform(size=lines.shape) < nan_fraction] = np.nan
+
+    header = pack('>BLB', header_bytes, num_lines, points_per_line)
+
+    with open(file_path, 'wb') as file:
+        file.write(header.ljust(header_bytes, b'\0'))
+        # timestamp header of each line, which is not read
+        file.write(b'\0' * theader_line_bytes * num_lines)
+        file.write(lines.astype('>f8').tobytes())
@@ -85,6 +85,13 @@ class TABLE(EchoContainer):
     # summarized snow pits
     pit_summary = ...
 
+    # how each table above was built, to rebuild only changed tables
+    table_lineage = ...
+    # timing and size of each step of every run
+    run_history = ...
+    # EXPLAIN ANALYZE plans of the queries of each step
+    query_plans = ...
+
 
 # !!!! WARNING !!!!
 # Class containers consumed to build DEFAULT.base_query_kwargs will have their
@@ -216,6 +223,11 @@ class COL(EchoContainer):
     rwidth_left = ...
     rwidth_right = ...
     waveform_scaled = ...
+    # compact scaled waveform windows
+    waveform_start = ...
+    waveform_bins = ...
+    waveform_offset = ...
+    waveform_scale = ...
 
     # ALS-ASIRAS sensor offset
     sensor_offset = ...
@@ -325,6 +337,21 @@ class COLCONFIG:
         COL.waveform_scaled: '_' + _num
     }
 
+    # compact scaled waveforms, see process.tools.WaveformStorage
+    asr_wscaled_float32 = {
+        COL.id_asr: _id,
+        COL.waveform_start: 'int4',
+        COL.waveform_bins: 'int4',
+        COL.waveform_offset: _num,
+        COL.waveform_scale: _num,
+        COL.waveform_scaled: '_float4'
+    }
+
+    asr_wscaled_uint16 = {
+        **asr_wscaled_float32,
+        COL.waveform_scaled: '_int2'
+    }
+
     asr_wshape = {
         COL.id_asr: _id,
         COL.rwidth: _num,
@@ -343,6 +370,8 @@ class FUNC(EchoContainer):
     # adjust dominant scattering interface (TFMRA retracked ice surface
     # elevation) based on snow density
     adjust_dsi_by_snow_dens = ...
+    # expand compact scaled waveforms to every bin
+    expand_waveform = ...
 
 
 class PARAM:
@@ -368,6 +397,19 @@ class PARAM:
     # will also consider circular footprints with these radii
     # max radius is ~40m to capture all observation data
     fp_radii = list(range(6, 41, 2))
+    # how observations are aggregated to footprints
+    # see process.aggregate.AggregationEngine
+    # 'polygon' joins observations to each footprint polygon
+    # 'kdtree' aggregates circular footprints by distance from the nadir on
+    # the client, with true circles instead of `st_buffer` polygons so
+    # observations at the edges can differ from 'polygon', and requires scipy
+    # radar footprints are aggregated in PostGIS by every engine
+    fp_aggregation = 'polygon'
+
+    # PARALLEL STEPS
+    # number of database connections used to run independent steps, such as
+    # the loaders and footprint aggregations, at the same time
+    concurrent_connections = 4
 
     # OBSERVATION AGGREGATION
     # percentile margin to use for calculating measurement roughness
@@ -394,6 +436,11 @@ class PARAM:
     ppeak_indices_right = [1, 2, 3]
     # minimum proportion of peak considered to be signal
     signal_threshold = 0.01
+    # number of bins around the peak kept by compact scaled waveforms
+    wscaled_window_bins = 64
+    # decode the waveform processing inputs from the ASIRAS file instead of
+    # selecting them from its table, which must hold every row of the file
+    waveforms_from_file = False
 
     # SENSOR OFFSET SAMPLING
     # offset sampling WHERE statements
@@ -464,14 +511,25 @@ def read_config(
         password=db['password'],
         session_kwargs=dict(
             default_schema=db['default_schema'],
-            default_geom_col=db['default_geom_col']
+            default_geom_col=db['default_geom_col'],
+            capture_plans=config_parser.getboolean(
+                'Process', 'explain_queries', fallback=False
+            )
         ),
         logger_hub=logger_hub
     )
 
+    # optional for config files without the section
     new_process_kwargs = dict(
         name='methods',
-        logger_hub=logger_hub
+        logger_hub=logger_hub,
+        track_lineage=config_parser.getboolean(
+            'Process', 'track_lineage', fallback=False
+        ),
+        profile=config_parser.getboolean(
+            'Process', 'profile', fallback=False
+        ),
+        profile_dir=config_parser.get('Process', 'profile_dir', fallback=None)
     )
 
     return filepath, new_session_kwargs, new_process_kwargs
@@ -8,23 +8,287 @@ full binary format specification in PDF document:
     Section: 3.2.12 (page 72)
 """
 
+from typing import Tuple, Optional, List
+from contextlib import nullcontext
 from struct import unpack, calcsize
-from math import isnan
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from psycopg2 import sql as pgs
 
+from ...xtypes import KwargsDict
 from ...logger import empty_logger
 from ...postgis.session import Table, Session
 from ...postgis.template_query import TemplateQuery
 
+from .mapped import MappedRecords, struct_to_numpy, split_record_range
+from .cache import ColumnCache, open_cache
+
 insert_template = \
     "(%s,ST_Transform(ST_SetSRID(" \
     "ST_MakePoint(%s, %s), {L@srid_input}),{L@srid_output}))"
 
+# builds the geometry of all staged points in a single statement
+staging_insert_query = \
+"""\
+INSERT INTO {T@output_table} ({I@col_elvtn}, {I@col_geom})
+SELECT {I@col_elvtn},
+    ST_Transform(ST_SetSRID(
+        ST_MakePoint({I@col_lon}, {I@col_lat}), {L@srid_input}),{L@srid_output}
+    )
+FROM {T@staging_table}
+ORDER BY {I@col_row}\
+"""
+
+# single cache column holding the points from `AlsLoader._stack_points`
+cache_col_points = "points"
+
+staging_suffix = "_staging"
+staging_col_row = "staging_row"
+staging_col_lon = "longitude"
+staging_col_lat = "latitude"
+
+# arrays of `points_per_line` values in each line, in file order
+line_fields = ['time', 'latitude', 'longitude', 'elevation']
+# fields written for each point, in the order of the target columns
+point_fields = ['elevation', 'longitude', 'latitude']
+
 
 class AlsLoader:
 
     def __init__(self, logger=empty_logger()):
         self.logger = logger
 
+    @staticmethod
+    def _read_file_header(
+            file, header_format="BLB", byte_order=">"
+    ) -> Tuple[int, int, int]:
+        """
+        Read the file header from the start of `file` and return the
+        (`header_bytes`, `num_lines`, `points_per_line`)
+        """
+        header = unpack(
+            byte_order + header_format,
+            file.read(calcsize(byte_order + header_format))
+        )
+
+        # read relevant parameters from file header
+        header_bytes, num_lines, points_per_line = header
+
+        return header_bytes, num_lines, points_per_line
+
+    def open_lines(
+            self,
+            file_path: str,
+            header_format="BLB",
+            field_type="d",
+            theader_line_bytes=4,
+            byte_order=">"
+    ) -> MappedRecords:
+        """
+        Return a memory map of the data lines of the ALS file at `file_path`
+        using the `header_bytes` and `num_lines` of its file header.
+
+        Each line has a `points_per_line` array for each of the fields in
+        `line_fields`.
+        """
+        with open(file_path, 'rb') as file:
+            header_bytes, num_lines, points_per_line = \
+                self._read_file_header(file, header_format, byte_order)
+
+        # calculate space for timestamp header array that appears
+        # before main data
+        # it shows a timestamp for each line
+        theader_bytes = theader_line_bytes * num_lines
+
+        # data grouped by field in arrays of size n = point_per_line
+        # one block:
+        # array of n timestamp seconds (4 * n bytes)
+        # array of n microseconds (4 * n bytes)
+        # array of n latitudes (4 * n bytes)
+        # array of n longitudes (4 * n bytes)
+        # array of n elevations (4 * n bytes)
+        #
+        # there are `num_lines` blocks in total
+        field_dtype = (
+            byte_order + struct_to_numpy[field_type], (points_per_line,)
+        )
+        line_dtype = np.dtype([(name, field_dtype) for name in line_fields])
+
+        # data starts at end of header
+        return MappedRecords(
+            file_path, line_dtype, header_bytes + theader_bytes, num_lines
+        )
+
+    @staticmethod
+    def _stack_points(lines: np.ndarray) -> np.ndarray:
+        """
+        Return a contiguous 2d float array of all points in `lines`, an array
+        of `open_lines` records, with a row per point and a column for each
+        of `point_fields`.
+        """
+        return np.stack(
+            [lines[name] for name in point_fields], axis=-1
+        ).reshape(-1, len(point_fields)).astype(float)
+
+    @staticmethod
+    def _filter_points(
+            points: np.ndarray, first_point_id: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Return `points` from `_stack_points` without the points that have a
+        NaN value in any field.
+
+        If `first_point_id` is given, a 1d structured array is returned
+        instead, with an integer id field counted from `first_point_id`
+        before NaN points are removed, followed by a float field for each
+        column of `points`.
+        """
+        valid = ~np.isnan(points).any(axis=1)
+
+        if first_point_id is None:
+            return points[valid]
+
+        ids = np.arange(
+            first_point_id, first_point_id + points.shape[0], dtype=np.int64
+        )
+        return np.rec.fromarrays([ids[valid]] + list(points[valid].T))
+
+    def _stream_lines(
+            self,
+            session: Session,
+            mapped_lines: MappedRecords,
+            write_table: Table,
+            target_cols: List[str],
+            template: Optional[pgs.Composable],
+            line_start: int,
+            line_stop: int,
+            lines_to_buffer: int,
+            write_ids=False,
+            cached_points: Optional[np.ndarray] = None
+    ) -> int:
+        """
+        Insert the points of lines `line_start` up to `line_stop` of
+        `mapped_lines` into `write_table`, `lines_to_buffer` lines at a time.
+        Points are copied unless a `template` is given. Returns the number
+        of points written.
+
+        If `write_ids` is `True` the first target column is an integer id
+        derived from the line and point number. Points are sliced from
+        `cached_points`, all points of the file from `_stack_points`, instead
+        of decoded if given.
+        """
+        points_per_line = mapped_lines.dtype[line_fields[0]].shape[0]
+        num_lines = line_stop - line_start
+
+        lines_written = 0
+        points_written = 0
+
+        while lines_written < num_lines:
+            # view of the next `lines_to_buffer` lines
+            start = line_start + lines_written
+            stop = min(start + lines_to_buffer, line_stop)
+
+            if cached_points is None:
+                points = self._stack_points(mapped_lines.records(start, stop))
+            else:
+                points = cached_points[
+                    start * points_per_line:stop * points_per_line
+                ]
+
+            points = self._filter_points(
+                points, start * points_per_line + 1 if write_ids else None
+            )
+            num_filtered = (stop - start) * points_per_line - points.shape[0]
+
+            session.insert(
+                write_table,
+                points if template is None else points.tolist(),
+                target_cols, template,
+                use_copy=template is None
+            )
+
+            lines_written += stop - start
+            points_written += points.shape[0]
+
+            self.logger.info(
+                f"{lines_written}/{num_lines} lines written, "
+                f"{num_filtered} points filtered out of lines "
+                f"{start}-{stop - 1}"
+            )
+
+        return points_written
+
+    def _stream_lines_parallel(
+            self,
+            session: Session,
+            file_path: str,
+            staging_table: Table,
+            target_cols: List[str],
+            line_start: int,
+            line_stop: int,
+            lines_to_buffer: int,
+            open_lines_kwargs: KwargsDict,
+            workers: int,
+            cache: Optional[ColumnCache] = None
+    ) -> int:
+        """
+        Split lines `line_start` up to `line_stop` across a pool of `workers`
+        processes which each decode their range and copy it into
+        `staging_table` over their own connection. Returns the number of
+        points written.
+        """
+        line_ranges = split_record_range(line_start, line_stop, workers)
+        self.logger.info(
+            f"streaming line ranges {line_ranges} with {workers} workers"
+        )
+
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    _copy_line_range,
+                    session.connection_config(), file_path, staging_table,
+                    target_cols, line_range, lines_to_buffer,
+                    open_lines_kwargs, cache
+                )
+                for line_range in line_ranges
+            ]
+
+            points_written = 0
+            for line_range, future in zip(line_ranges, futures):
+                points_written += future.result()
+                self.logger.info(f"line range {line_range} written")
+
+        return points_written
+
+    def _cached_points(
+            self,
+            cache: ColumnCache,
+            mapped_lines: MappedRecords,
+            lines_to_buffer: int
+    ) -> np.ndarray:
+        """
+        Return all points of `mapped_lines` from `_stack_points` out of
+        `cache`, stacking them into the cache first if it has no entry yet.
+        """
+        if cache.exists():
+            self.logger.info(f"reading decoded lines from cache {cache.path}")
+        else:
+            self.logger.info(f"writing decoded lines to cache {cache.path}")
+            num_lines = len(mapped_lines)
+            points_per_line = mapped_lines.dtype[line_fields[0]].shape[0]
+            cache.write(
+                num_lines * points_per_line,
+                (
+                    {cache_col_points: self._stack_points(
+                        mapped_lines.records(start, start + lines_to_buffer)
+                    )}
+                    # a file without lines still gives the empty column
+                    for start in range(0, max(num_lines, 1), lines_to_buffer)
+                )
+            )
+
+        return cache.load()[cache_col_points]
+
     def extract_to_database(
             self,
             session: Session,
@@ -39,13 +303,46 @@ class AlsLoader:
             header_format="BLB",  # all parameters: "BLBHQHBBLL8B"
             field_type="d",
             theader_line_bytes=4,
-            byte_order=">"
+            byte_order=">",
+            line_range: Optional[Tuple[int, int]] = None,
+            staging=True,
+            workers=1,
+            cache_dir: Optional[str] = None
     ):
+        """
+        Stream the ALS points of the file at `file_path` into a new table
+        `output_table`. Only lines `start` up to `stop` are read if
+        `line_range` is given as (`start`, `stop`).
+
+        If `staging` is `True` the raw longitude, latitude and elevation are
+        copied into an unlogged staging table and the geometry of all points
+        is built afterwards with a single `INSERT ... SELECT`. Otherwise
+        each point is projected by its insert template.
+
+        If `workers` is more than 1, the lines are split across that many
+        processes which each copy into the staging table over their own
+        connection. The tables are committed before they start and staged
+        points are numbered from their line and point number, so the ids of
+        `output_table` are assigned in the same order as a single process.
+
+        If `cache_dir` is given, the decoded points of the whole file are
+        kept there keyed by the file contents and line format, and later
+        loads read them from the cache instead of decoding the file.
+        """
+        if workers > 1 and not staging:
+            raise ValueError("`staging` is required when `workers` > 1")
+
         self.logger.info(
             f"opening source file at {file_path}"
         )
 
-        with open(file_path, 'rb') as file:
+        open_lines_kwargs = dict(
+            header_format=header_format, field_type=field_type,
+            theader_line_bytes=theader_line_bytes, byte_order=byte_order
+        )
+        mapped_lines = self.open_lines(file_path, **open_lines_kwargs)
+
+        with mapped_lines:
             # CREATE TABLE ----
             # hold file while creating table
             self.logger.info(
@@ -62,94 +359,130 @@ class AlsLoader:
             # geometry type and dimensions would require external configuration
             session.add_geom_col(output_table, srid_output, "POINT", 2, col_geom)
 
-            # format insertion template with correct spatial reference IDs
-            target_cols = [col_elvtn, col_geom]
-            template = TemplateQuery(insert_template).format(
-                srid_input=srid_input, srid_output=srid_output
-            )
-
-            # READ ALS FILE HEADER ----
-            header = unpack(
-                byte_order + header_format,
-                file.read(calcsize(byte_order + header_format))
-            )
-
-            # read relevant parameters from file header
-            header_bytes, num_lines, points_per_line = header
-
-            # calculate space for timestamp header array that appears
-            # before main data
-            # it shows a timestamp for each line
+            if staging:
+                # raw points are copied here and projected in one statement
+                staging_table = output_table + staging_suffix
+                # left over if a previous load failed
+                session.drop_table(staging_table)
+                session.create_table(
+                    staging_table, [
+                        (staging_col_row, "bigserial"),
+                        (col_elvtn, format_elvtn),
+                        (staging_col_lon, format_elvtn),
+                        (staging_col_lat, format_elvtn)
+                    ],
+                    unlogged=True
+                )
+                write_table = staging_table
+                target_cols = [col_elvtn, staging_col_lon, staging_col_lat]
+                template = None
+            else:
+                # format insertion template with correct spatial reference IDs
+                write_table = output_table
+                target_cols = [col_elvtn, col_geom]
+                template = TemplateQuery(insert_template).format(
+                    srid_input=srid_input, srid_output=srid_output
+                )
 
-            theader_bytes = theader_line_bytes * num_lines
-
-            # data grouped by field in arrays of size n = point_per_line
-            # one block:
-            # array of n timestamp seconds (4 * n bytes)
-            # array of n microseconds (4 * n bytes)
-            # array of n latitudes (4 * n bytes)
-            # array of n longitudes (4 * n bytes)
-            # array of n elevations (4 * n bytes)
-            #
-            # there are `num_lines` blocks in total
-
-            field_format = f"{byte_order}{points_per_line}{field_type}"
-            field_bytes = calcsize(field_format)
+            line_start, line_stop, _ = slice(
+                *(line_range or (None, None))
+            ).indices(len(mapped_lines))
+            num_lines = max(line_stop - line_start, 0)
+            points_per_line = mapped_lines.dtype[line_fields[0]].shape[0]
+            expected_points = num_lines * points_per_line
 
-            # jump to end of header/start of data
-            file.seek(header_bytes + theader_bytes)
+            cache = open_cache(
+                cache_dir, file_path, header_format, field_type,
+                theader_line_bytes, byte_order, line_fields, point_fields
+            )
+            cached_points = None
+            if cache is not None:
+                cached_points = self._cached_points(
+                    cache, mapped_lines, lines_to_buffer
+                )
 
             # STREAM FILE TO OUTPUT TABLE ----
             self.logger.info("streaming file to output table")
 
-            buffer = []
-            lines_buffered = 0
-            lines_written = 0
-            points_buffered = 0
-            points_written = 0
-            expected_points = num_lines * points_per_line
-
-
-            for line_num in range(num_lines):
-                # read a single line
-                # each variable `points_per_line` times
-
-                # skip time variable
-                # line_time = unpack(field_format, file.read(field_bytes))
-                file.seek(field_bytes, 1)
+            if workers > 1:
+                # workers can only write to committed tables, which are
+                # dropped if loading fails so they do not look loaded
+                session.commit()
+                on_error = session.drop_tables_on_error(
+                    output_table, staging_table
+                )
+            else:
+                on_error = nullcontext()
 
-                line_lat = unpack(field_format, file.read(field_bytes))
-                line_lon = unpack(field_format, file.read(field_bytes))
-                line_elv = unpack(field_format, file.read(field_bytes))
-
-                # package variable lines into per-point tuples
-                for row in zip(line_elv, line_lon, line_lat):
-                    # filter out rows with any NaN values
-                    if not any(map(isnan, row)):
-                        buffer.append(row)
-                        points_buffered += 1
-
-                lines_buffered += 1
-
-                if lines_buffered >= lines_to_buffer \
-                        or line_num >= num_lines - 1:
-                    # once the buffer is full or reached end of the file
-                    session.insert(output_table, buffer, target_cols, template)
-
-                    buffer = []
-                    points_written += points_buffered
-                    points_buffered = 0
-                    lines_written += lines_buffered
-                    lines_buffered = 0
+            with on_error:
+                if workers > 1:
+                    points_written = self._stream_lines_parallel(
+                        session, file_path, staging_table,
+                        [staging_col_row] + target_cols,
+                        line_start, line_start + num_lines, lines_to_buffer,
+                        open_lines_kwargs, workers, cache
+                    )
+                else:
+                    points_written = self._stream_lines(
+                        session, mapped_lines, write_table, target_cols,
+                        template, line_start, line_start + num_lines,
+                        lines_to_buffer, cached_points=cached_points
+                    )
 
+                if staging:
                     self.logger.info(
-                        f"{lines_written}/{num_lines} lines written"
+                        f"building geometry from staging table "
+                        f"{staging_table}"
                     )
+                    session.execute_query(session.format_query(
+                        staging_insert_query, None, dict(
+                            output_table=output_table,
+                            staging_table=staging_table,
+                            col_elvtn=col_elvtn, col_geom=col_geom,
+                            col_lon=staging_col_lon, col_lat=staging_col_lat,
+                            col_row=staging_col_row,
+                            srid_input=srid_input, srid_output=srid_output
+                        )
+                    ), log_query_string=True)
+                    session.drop_table(staging_table)
 
             self.logger.info(
                 f"finished streaming\n"
-                f"\tlines written: {lines_written}/{num_lines}\n"
+                f"\tlines written: {num_lines}/{num_lines}\n"
                 f"\tpoints written: {points_written}/{expected_points}\n"
                 f"\t{expected_points - points_written} filtered out due to"
                 "NaN values in a field"
             )
+
+
+def _copy_line_range(
+        session_config: KwargsDict,
+        file_path: str,
+        staging_table: Table,
+        target_cols: List[str],
+        line_range: Tuple[int, int],
+        lines_to_buffer: int,
+        open_lines_kwargs: KwargsDict,
+        cache: Optional[ColumnCache]
+) -> int:
+    """
+    Worker process task of `AlsLoader._stream_lines_parallel`. Copies the
+    points of the lines in `line_range` with their staging row numbers over
+    a new connection and commits. Returns the number of points written.
+    """
+    loader = AlsLoader()
+    session = Session(**session_config)
+
+    try:
+        with loader.open_lines(file_path, **open_lines_kwargs) as mapped_lines:
+            points_written = loader._stream_lines(
+                session, mapped_lines, staging_table, target_cols, None,
+                *line_range, lines_to_buffer, write_ids=True,
+                cached_points=cache.load()[cache_col_points]
+                if cache is not None else None
+            )
+        session.commit()
+    finally:
+        session.close()
+
+    return points_written
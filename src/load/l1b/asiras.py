@@ -1,15 +1,23 @@
-from typing import Tuple, Dict, List, Union
-from struct import unpack, calcsize
-from itertools import chain
+from typing import Tuple, Dict, List, Optional
+from struct import calcsize
+from importlib import import_module
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
+from ...xtypes import KwargsDict
 from ...logger import empty_logger
 from ...postgis.session import Session
 from ...postgis.xtypes import Table
 
 from . import asiras_config as default_config
+from .mapped import MappedRecords, struct_to_numpy, split_record_range
+from .cache import ColumnCache, open_cache
 
 FieldsFormat = Dict[str, List[List]]
 
+# the corrections and average waveform groups follow this group in a block
+empty_groups_after = 'mg'
+
 
 class AsirasLoader:
 
@@ -52,23 +60,100 @@ class AsirasLoader:
 
         return col_config
 
-    # Excluded since negligible performance boost reading full block at once
-    # def _build_struct_formats(self) -> Dict[str, str]:
-    #     """
-    #     Return the struct string used to read the binary data for each
-    #     measurement group.
-    #     """
-    #
-    #     fields_format = self.config.fields_format
-    #     byte_order = self.config.byte_order
-    #
-    #     return {
-    #         group: byte_order + "".join([
-    #             row[1] + (str(row[4]) if row[4] > 1 else "")
-    #             for row in rows
-    #         ])
-    #         for group, rows in fields_format.items()
-    #     }
+    def _build_group_dtype(self, group: List[List], byte_order) -> np.dtype:
+        """
+        Return the numpy structured dtype of a single row of a block group.
+
+        Skipped fields are not named in the dtype but their bytes are kept
+        as gaps between the offsets of the named fields.
+        """
+
+        skip_field = self.config.skip_field
+
+        names, formats, offsets = [], [], []
+        offset = 0
+
+        for name, read_type, write_type, scale, count in group:
+            read_format = byte_order + (
+                str(count) + read_type if count > 1 else read_type)
+            if name != skip_field:
+                numpy_type = byte_order + struct_to_numpy[read_type]
+                names.append(name)
+                formats.append(
+                    (numpy_type, (count,)) if count > 1 else numpy_type
+                )
+                offsets.append(offset)
+            offset += calcsize(read_format)
+
+        return np.dtype(dict(
+            names=names, formats=formats, offsets=offsets, itemsize=offset
+        ))
+
+    def _build_block_dtype(self, byte_order) -> np.dtype:
+        """
+        Return the numpy structured dtype of a single DSR block.
+
+        Each group field holds `rows_per_block` rows of that group. The
+        corrections and average waveform groups are kept as a gap between
+        the measurements and multilooked waveform groups.
+        """
+
+        rows_per_block = self.config.rows_per_block
+        empty_group_bytes = self.config.cg_bytes + self.config.awg_bytes
+
+        names, formats, offsets = [], [], []
+        offset = 0
+
+        for group_name, group in self.config.fields_format.items():
+            group_dtype = self._build_group_dtype(group, byte_order)
+            names.append(group_name)
+            formats.append((group_dtype, (rows_per_block,)))
+            offsets.append(offset)
+            offset += group_dtype.itemsize * rows_per_block
+
+            # corrections and average waveform groups are not read
+            if group_name == empty_groups_after:
+                offset += empty_group_bytes
+
+        return np.dtype(dict(
+            names=names, formats=formats, offsets=offsets, itemsize=offset
+        ))
+
+    def _decode_blocks(self, blocks: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Return a `dict` of column name to array of values for all rows in
+        `blocks`, an array of `_build_block_dtype` items.
+
+        Data groups are flattened and the scale of each field is applied.
+        Multi-value fields are 2d arrays with one row per ASIRAS row.
+        """
+
+        fields_format = self.config.fields_format
+        skip_field = self.config.skip_field
+        num_rows = blocks.shape[0] * self.config.rows_per_block
+
+        columns = {}
+
+        for group_name, group in fields_format.items():
+            group_values = blocks[group_name]
+            for name, read_type, write_type, scale, count in group:
+                if name != skip_field:
+                    values = group_values[name].reshape(
+                        (num_rows, count) if count > 1 else (num_rows,)
+                    )
+                    if scale != 1:
+                        values = values * scale
+                    columns[name] = values
+
+        return columns
+
+    @staticmethod
+    def _columns_to_rows(columns: Dict[str, np.ndarray]) -> List[Tuple]:
+        """
+        Return `columns` as a list of row tuples of python values.
+        Multi-value fields are lists so psycopg2 recognizes them as arrays.
+        """
+        return list(zip(*(values.tolist() for values in columns.values())))
 
     def _parse_product_header(self, string: str) -> Dict[str, str]:
         """
@@ -81,57 +166,266 @@ class AsirasLoader:
             for match in header_regex.finditer(string)
         }
 
-    def _get_group_read_rules(self, byte_order) \
-            -> List[List[Tuple[int, bool, str, bool, Union[int, float]]]]:
+    def _read_dataset_header(self, file) -> Tuple[int, int]:
         """
-        Return instructions for reading a block group of variables
+        Read the product headers from the start of `file` and return the
+        (`start_bytes`, `num_blocks`) of the ASIRAS dataset.
         """
+        header_encoding = self.config.header_encoding
+        # read main product header
+        mph = self._parse_product_header(
+            file.read(self.config.mph_bytes).decode(header_encoding)
+        )
+        # read specific product header
+        # sph = self._parse_product_header(
+        #     file.read(self.config.sph_bytes).decode(header_encoding)
+        # )
+        # skip since it is not needed
+        file.seek(self.config.sph_bytes, 1)
+
+        # number of datasets in dataset header
+        dsh_count = int(mph[self.config.dsh_count_key])
+        # read data set header
+        dsh = [
+            self._parse_product_header(
+                file.read(self.config.dsh_bytes).decode(header_encoding)
+            )
+            for _ in range(dsh_count)
+        ]
+
+        # find first dataset header where the name attribute starts with
+        # the expected ASIRAS name
+        name_key = self.config.dsh_name_key
+        name_prefix = self.config.dsh_asiras_prefix
+        asiras_dsh = next(
+            (d for d in dsh
+             if d[name_key].startswith(name_prefix)),
+            None
+        )
+        if asiras_dsh is None:
+            raise ValueError(
+                f"No dataset header where attribute {name_key} has "
+                f"prefix {name_prefix}"
+            )
 
-        fields_format = self.config.fields_format
-        skip_field = self.config.skip_field
+        # parameters from header
+        num_blocks = int(asiras_dsh[self.config.dsh_blocks_key])
+        start_bytes = int(asiras_dsh[self.config.dsh_offset_key])
 
-        groups = []
+        return start_bytes, num_blocks
 
-        for group in fields_format.values():
-            rules = []
-            for name, read_type, write_type, scale, count in group:
-                read_format = byte_order + (
-                    str(count) + read_type if count > 1 else read_type)
-                save_output = name != skip_field
-                size = calcsize(read_format)
-                multi = count > 1
-                rules.append((size, save_output, read_format, multi, scale))
-            groups.append(rules)
+    def open_blocks(self, file_path: str, byte_order=">") -> MappedRecords:
+        """
+        Return a memory map of the DSR blocks of the ASIRAS file at
+        `file_path` using the `DS_OFFSET` and `NUM_DSR` of its dataset header.
+        """
+        with open(file_path, 'rb') as file:
+            start_bytes, num_blocks = self._read_dataset_header(file)
 
-        return groups
+        return MappedRecords(
+            file_path, self._build_block_dtype(byte_order),
+            start_bytes, num_blocks
+        )
 
-    def _read_block_group(self, file, rules) -> List:
+    def _stream_blocks(
+            self,
+            session: Session,
+            mapped_blocks: MappedRecords,
+            output_table: Table,
+            target_cols: List[str],
+            block_start: int,
+            block_stop: int,
+            blocks_to_buffer: int,
+            use_copy=True,
+            col_id_name: Optional[str] = None,
+            cached_columns: Optional[Dict[str, np.ndarray]] = None
+    ) -> int:
         """
-        Read a single group of `rows_per_block` rows
-        Convert single item lists to values and apply scaling if necessary.
+        Insert the rows of blocks `block_start` up to `block_stop` of
+        `mapped_blocks` into `output_table`, `blocks_to_buffer` blocks at a
+        time. Returns the number of rows written.
+
+        Rows are sliced from `cached_columns` instead of decoded if given.
+
+        If `col_id_name` is given, it is written as the first column with an
+        id derived from the block and row number, which matches the order of
+        a `bigserial` id for a full sequential load.
         """
-        buffer = []
-        for i in range(self.config.rows_per_block):
-            row = []
-            for size, save_output, read_format, multi, scale in rules:
-                if save_output:
-                    value = unpack(read_format, file.read(size))
-                    if multi:
-                        if scale != 1:
-                            row.append([v * scale for v in value])
-                        else:
-                            # values have to be a list for psycopg2
-                            # to recognize them as an array
-                            row.append(list(value))
-                    else:
-                        if scale != 1:
-                            row.append(value[0] * scale)
-                        else:
-                            row.append(value[0])
-                else:
-                    file.read(size)
-            buffer.append(row)
-        return buffer
+        rows_per_block = self.config.rows_per_block
+        num_blocks = block_stop - block_start
+
+        if col_id_name is not None:
+            target_cols = [col_id_name] + list(target_cols)
+
+        blocks_written = 0
+        rows_written = 0
+
+        while blocks_written < num_blocks:
+            # view of the next `blocks_to_buffer` blocks
+            start = block_start + blocks_written
+            stop = min(start + blocks_to_buffer, block_stop)
+
+            if cached_columns is None:
+                columns = self._decode_blocks(
+                    mapped_blocks.records(start, stop)
+                )
+            else:
+                columns = {
+                    name: values[start * rows_per_block:stop * rows_per_block]
+                    for name, values in cached_columns.items()
+                }
+
+            if col_id_name is not None:
+                ids = np.arange(
+                    start * rows_per_block, stop * rows_per_block
+                ) + 1
+                columns = {col_id_name: ids, **columns}
+
+            # interleave rows of each group and insert into output table
+            buffer = self._columns_to_rows(columns)
+            session.insert(
+                output_table, buffer, target_cols, use_copy=use_copy
+            )
+
+            blocks_written += stop - start
+            rows_written += len(buffer)
+
+            self.logger.info(
+                f"{blocks_written}/{num_blocks} blocks written"
+            )
+
+        return rows_written
+
+    def _stream_blocks_parallel(
+            self,
+            session: Session,
+            file_path: str,
+            output_table: Table,
+            target_cols: List[str],
+            col_id_name: str,
+            block_start: int,
+            block_stop: int,
+            blocks_to_buffer: int,
+            byte_order: str,
+            workers: int,
+            cache: Optional[ColumnCache] = None
+    ) -> int:
+        """
+        Split blocks `block_start` up to `block_stop` across a pool of
+        `workers` processes which each decode their range and copy it into
+        `output_table` over their own connection. Returns the number of rows
+        written.
+        """
+        block_ranges = split_record_range(block_start, block_stop, workers)
+        self.logger.info(
+            f"streaming block ranges {block_ranges} with {workers} workers"
+        )
+
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    _copy_block_range,
+                    session.connection_config(), self.config.__name__,
+                    file_path, output_table, target_cols, col_id_name,
+                    block_range, blocks_to_buffer, byte_order, cache
+                )
+                for block_range in block_ranges
+            ]
+
+            rows_written = 0
+            for block_range, future in zip(block_ranges, futures):
+                rows_written += future.result()
+                self.logger.info(f"block range {block_range} written")
+
+        return rows_written
+
+    def _cached_columns(
+            self,
+            cache: ColumnCache,
+            mapped_blocks: MappedRecords,
+            blocks_to_buffer: int
+    ) -> Dict[str, np.ndarray]:
+        """
+        Return the decoded columns of all of `mapped_blocks` from `cache`,
+        decoding them into the cache first if it has no entry yet.
+        """
+        if cache.exists():
+            self.logger.info(f"reading decoded blocks from cache {cache.path}")
+        else:
+            self.logger.info(f"writing decoded blocks to cache {cache.path}")
+            num_blocks = len(mapped_blocks)
+            cache.write(
+                num_blocks * self.config.rows_per_block,
+                (
+                    self._decode_blocks(
+                        mapped_blocks.records(start, start + blocks_to_buffer)
+                    )
+                    # a file without blocks still gives the empty columns
+                    for start in range(
+                        0, max(num_blocks, 1), blocks_to_buffer
+                    )
+                )
+            )
+
+        return cache.load()
+
+    def read_columns(
+            self,
+            file_path: str,
+            col_names: List[str],
+            blocks_to_buffer=100,
+            byte_order=">",
+            cache_dir: Optional[str] = None,
+            block_range: Optional[Tuple[int, int]] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Return a `dict` of the names in `col_names` to arrays of their decoded
+        values for every row of the ASIRAS file at `file_path`, in the same
+        row order as `extract_to_database`. Only the rows of blocks `start` up
+        to `stop` are read if `block_range` is given as (`start`, `stop`).
+        Rows are read from the cache in `cache_dir` if given.
+        """
+        with self.open_blocks(file_path, byte_order) as mapped_blocks:
+            block_start, block_stop, _ = slice(
+                *(block_range or (None, None))
+            ).indices(len(mapped_blocks))
+            row_start, row_stop = [
+                block * self.config.rows_per_block
+                for block in (block_start, block_stop)
+            ]
+
+            cache = open_cache(
+                cache_dir, file_path, self.config.fields_format,
+                self.config.skip_field, self.config.rows_per_block,
+                self.config.cg_bytes, self.config.awg_bytes, byte_order
+            )
+            if cache is not None:
+                cached_columns = self._cached_columns(
+                    cache, mapped_blocks, blocks_to_buffer
+                )
+                return {
+                    name: np.array(cached_columns[name][row_start:row_stop])
+                    for name in col_names
+                }
+
+            self.logger.info(
+                f"decoding columns {col_names} of blocks {block_start} to "
+                f"{block_stop} from {file_path}"
+            )
+            chunks = []
+            for start in range(block_start, block_stop, blocks_to_buffer):
+                columns = self._decode_blocks(mapped_blocks.records(
+                    start, min(start + blocks_to_buffer, block_stop)
+                ))
+                # copy so the memory map can be released
+                chunks.append({
+                    name: np.array(columns[name]) for name in col_names
+                })
+
+        return {
+            name: np.concatenate([chunk[name] for chunk in chunks])
+            for name in col_names
+        }
 
     def extract_to_database(
             self,
@@ -141,13 +435,39 @@ class AsirasLoader:
             col_id_name: str,
             col_id_format="bigserial PRIMARY KEY",
             blocks_to_buffer=100,
-            byte_order=">"
+            byte_order=">",
+            block_range: Optional[Tuple[int, int]] = None,
+            use_copy=True,
+            workers=1,
+            cache_dir: Optional[str] = None
     ):
+        """
+        Stream the ASIRAS blocks of the file at `file_path` into a new table
+        `output_table`. Only blocks `start` up to `stop` are read if
+        `block_range` is given as (`start`, `stop`).
+
+        Rows are written with `COPY` unless `use_copy` is `False`.
+
+        If `workers` is more than 1, the blocks are split across that many
+        processes which each write over their own connection. The table is
+        committed before they start and ids are derived from the block and
+        row number instead of the `bigserial` order, after which the
+        sequence of `col_id_name` is advanced past them.
+
+        If `cache_dir` is given, the decoded columns of the whole file are
+        kept there keyed by the file contents and `fields_format`, and later
+        loads read them from the cache instead of decoding the file.
+        """
         self.logger.info(
             f"opening source file at {file_path}"
         )
 
-        with open(file_path, 'rb') as file:
+        # READ PRODUCT HEADERS ----
+        self.logger.info(
+            f"reader product headers"
+        )
+
+        with self.open_blocks(file_path, byte_order) as mapped_blocks:
             # CREATE TABLE ----
             # hold file while creating table
             self.logger.info(
@@ -161,112 +481,83 @@ class AsirasLoader:
             # column names for writing to sql table
             target_cols = [name for name, fmt in column_config[1:]]
 
-            # READ PRODUCT HEADERS ----
-            self.logger.info(
-                f"reader product headers"
-            )
-            header_encoding = self.config.header_encoding
-            # read main product header
-            mph = self._parse_product_header(
-                file.read(self.config.mph_bytes).decode(header_encoding)
-            )
-            # read specific product header
-            # sph = self._parse_product_header(
-            #     file.read(self.config.sph_bytes).decode(header_encoding)
-            # )
-            # skip since it is not needed
-            file.seek(self.config.sph_bytes, 1)
-
-            # number of datasets in dataset header
-            dsh_count = int(mph[self.config.dsh_count_key])
-            # read data set header
-            dsh = [
-                self._parse_product_header(
-                    file.read(self.config.dsh_bytes).decode(header_encoding)
-                )
-                for _ in range(dsh_count)
-            ]
-
-            # find first dataset header where the name attribute starts with
-            # the expected ASIRAS name
-            name_key = self.config.dsh_name_key
-            name_prefix = self.config.dsh_asiras_prefix
-            try:
-                asiras_dsh = next(
-                    (d for d in dsh
-                     if d[name_key].startswith(name_prefix)),
-                    None
-                )
-            except StopIteration:
-                raise ValueError(
-                    f"No dataset header where attribute f{name_key} has"
-                    f"prefix {name_prefix}"
-                )
-
-            # parameters from header
-            num_blocks = int(asiras_dsh[self.config.dsh_blocks_key])
-            start_bytes = int(asiras_dsh[self.config.dsh_offset_key])
-
-            # jump to end of header/start of file
-            file.seek(start_bytes)
-
             # STREAM FILE TO OUTPUT TABLE ----
             self.logger.info("streaming file to output table")
 
-            # build rules for reading and unpacking each data group
-            tog_rules, mg_rules, mwg_rules = \
-                self._get_group_read_rules(byte_order)
+            block_start, block_stop, _ = slice(
+                *(block_range or (None, None))
+            ).indices(len(mapped_blocks))
+            num_blocks = max(block_stop - block_start, 0)
+            expected_rows = num_blocks * self.config.rows_per_block
 
-            # bytes needed to skip corrections and average waveform groups
-            empty_group_bytes = self.config.cg_bytes + self.config.awg_bytes
-
-            buffer = []
-            blocks_buffered = 0
-            blocks_written = 0
-            rows_buffered = 0
-            rows_written = 0
-
-            for block_num in range(1, num_blocks + 1):
-                # read a single block
-                # `rows_per_block` rows per block
-
-                # time-orbit and measurement groups
-                tog = self._read_block_group(file, tog_rules)
-                mg = self._read_block_group(file, mg_rules)
-
-                # skip empty groups
-                file.seek(empty_group_bytes, 1)
-
-                # multilooked waveform group
-                mwg = self._read_block_group(file, mwg_rules)
-
-                # interleave rows of each group and save to buffer
-                buffer.extend([
-                    tuple(chain(*rows)) for rows in zip(tog, mg, mwg)
-                ])
-
-                blocks_buffered += 1
-                rows_buffered += self.config.rows_per_block
-                expected_rows = num_blocks * self.config.rows_per_block
-
-                # insert buffer into output table, flush if buffer filled
-                # or reached end
-                if blocks_buffered >= blocks_to_buffer \
-                        or block_num >= num_blocks:
-                    session.insert(output_table, buffer, target_cols)
-
-                    buffer = []
-                    blocks_written += blocks_buffered
-                    blocks_buffered = 0
-                    rows_written += rows_buffered
-                    rows_buffered = 0
+            cache = open_cache(
+                cache_dir, file_path, self.config.fields_format,
+                self.config.skip_field, self.config.rows_per_block,
+                self.config.cg_bytes, self.config.awg_bytes, byte_order
+            )
+            cached_columns = None
+            if cache is not None:
+                cached_columns = self._cached_columns(
+                    cache, mapped_blocks, blocks_to_buffer
+                )
 
-                    self.logger.info(
-                        f"{blocks_written}/{num_blocks} blocks written"
+            if workers > 1:
+                # workers can only write to a committed table, which is
+                # dropped if any of them fails
+                session.commit()
+                with session.drop_tables_on_error(output_table):
+                    rows_written = self._stream_blocks_parallel(
+                        session, file_path, output_table, target_cols,
+                        col_id_name, block_start, block_start + num_blocks,
+                        blocks_to_buffer, byte_order, workers, cache
                     )
+                    # later inserts without an id continue after the
+                    # derived ids
+                    session.sync_serial_sequence(output_table, col_id_name)
+            else:
+                rows_written = self._stream_blocks(
+                    session, mapped_blocks, output_table, target_cols,
+                    block_start, block_start + num_blocks, blocks_to_buffer,
+                    use_copy, cached_columns=cached_columns
+                )
 
             self.logger.info(
                 f"finished streaming\n"
-                f"\tblocks written: {blocks_written}/{num_blocks}\n"
+                f"\tblocks written: {num_blocks}/{num_blocks}\n"
                 f"\trows written: {rows_written}/{expected_rows}\n"
             )
+
+
+def _copy_block_range(
+        session_config: KwargsDict,
+        config_name: str,
+        file_path: str,
+        output_table: Table,
+        target_cols: List[str],
+        col_id_name: str,
+        block_range: Tuple[int, int],
+        blocks_to_buffer: int,
+        byte_order: str,
+        cache: Optional[ColumnCache]
+) -> int:
+    """
+    Worker process task of `AsirasLoader._stream_blocks_parallel`. Copies the
+    blocks in `block_range` with their derived ids over a new connection
+    and commits. Returns the number of rows written.
+    """
+    loader = AsirasLoader(config=import_module(config_name))
+    session = Session(**session_config)
+
+    try:
+        with loader.open_blocks(file_path, byte_order) as mapped_blocks:
+            rows_written = loader._stream_blocks(
+                session, mapped_blocks, output_table, target_cols,
+                *block_range, blocks_to_buffer,
+                col_id_name=col_id_name,
+                cached_columns=cache.load() if cache is not None else None
+            )
+        session.commit()
+    finally:
+        session.close()
+
+    return rows_written
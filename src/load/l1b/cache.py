@@ -0,0 +1,156 @@
+"""
+Local columnar cache of decoded L1B data
+
+Each cache entry is a directory with one `.npy` file per column and an index
+of the column names. Columns are memory-mapped when loaded so that any range
+of rows is read at disk speed without decoding the source file again.
+"""
+
+from typing import Dict, Iterable, Optional, List
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# increment when the layout of cache entries changes
+cache_version = 1
+index_file_name = "columns.json"
+partial_suffix = ".partial"
+digest_chunk_bytes = 2 ** 20
+
+
+def file_digest(file_path: str, chunk_bytes=digest_chunk_bytes) -> str:
+    """
+    Return the hex SHA-1 digest of the contents of the file at `file_path`
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_key(content_digest: str, *params) -> str:
+    """
+    Return a cache key for content with the digest `content_digest` processed
+    with `params`, any values with a stable `repr` that determine the cached
+    columns.
+    """
+    digest = hashlib.sha1(content_digest.encode())
+    digest.update(repr((cache_version,) + params).encode())
+    return digest.hexdigest()
+
+
+def cache_key(file_path: str, *decode_format) -> str:
+    """
+    Return a cache key for the contents of the file at `file_path` decoded
+    with `decode_format`
+    """
+    return content_key(file_digest(file_path), *decode_format)
+
+
+class ColumnCache:
+    """
+    Cache entry `key` in the directory `cache_dir`.
+
+    Write the decoded chunks of a file once:
+
+        cache = ColumnCache(cache_dir, key)
+        if not cache.exists():
+            cache.write(num_rows, chunks)
+        columns = cache.load()
+    """
+
+    def __init__(self, cache_dir: str, key: str):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.path = os.path.join(cache_dir, key)
+
+    def exists(self) -> bool:
+        return os.path.isfile(os.path.join(self.path, index_file_name))
+
+    def write(self, num_rows: int, chunks: Iterable[Dict[str, np.ndarray]]):
+        """
+        Write `chunks`, consecutive `dict`s of column name to array of
+        values, as the columns of an entry of `num_rows` rows. There must be
+        at least one chunk, which has zero rows for an empty entry, so the
+        columns and their types are known.
+
+        The entry is written to a partial directory first so an interrupted
+        write is never loaded.
+        """
+        partial_path = self.path + partial_suffix
+        shutil.rmtree(partial_path, ignore_errors=True)
+        os.makedirs(partial_path)
+
+        arrays: Dict[str, np.memmap] = {}
+        rows_written = 0
+
+        for columns in chunks:
+            if not arrays:
+                arrays = {
+                    name: open_memmap(
+                        os.path.join(partial_path, name + ".npy"), mode='w+',
+                        dtype=values.dtype, shape=(num_rows,) + values.shape[1:]
+                    )
+                    for name, values in columns.items()
+                }
+
+            chunk_rows = len(next(iter(columns.values())))
+            for name, values in columns.items():
+                arrays[name][rows_written:rows_written + chunk_rows] = values
+            rows_written += chunk_rows
+
+        if not arrays:
+            shutil.rmtree(partial_path, ignore_errors=True)
+            raise ValueError(
+                f"Cache entry {self.key} was given no chunks to take its "
+                f"columns from"
+            )
+
+        if rows_written != num_rows:
+            raise ValueError(
+                f"Cache entry {self.key} expected {num_rows} rows but "
+                f"{rows_written} were written"
+            )
+
+        for values in arrays.values():
+            values.flush()
+
+        with open(os.path.join(partial_path, index_file_name), 'w') as file:
+            json.dump(dict(num_rows=num_rows, columns=list(arrays)), file)
+
+        # replace a stale entry left by an earlier interrupted write
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(partial_path, self.path)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """
+        Return a `dict` of column name to read-only memory-mapped array of
+        values, in the order the columns were written.
+        """
+        with open(os.path.join(self.path, index_file_name)) as file:
+            index = json.load(file)
+
+        column_names: List[str] = index['columns']
+
+        return {
+            name: np.load(
+                os.path.join(self.path, name + ".npy"), mmap_mode='r'
+            )
+            for name in column_names
+        }
+
+
+def open_cache(
+        cache_dir: Optional[str], file_path: str, *decode_format
+) -> Optional[ColumnCache]:
+    """
+    Return the cache entry in `cache_dir` of the file at `file_path` decoded
+    with `decode_format`, or `None` if `cache_dir` is `None`
+    """
+    if cache_dir is None:
+        return None
+    return ColumnCache(cache_dir, cache_key(file_path, *decode_format))
@@ -0,0 +1,98 @@
+"""
+Memory-mapped access to the fixed-size records of L1B binary files
+"""
+
+from typing import Optional, List, Tuple
+import mmap
+import numpy as np
+
+# struct format characters (standard sizes) to numpy type codes
+struct_to_numpy = dict(
+    b='i1', B='u1', h='i2', H='u2', i='i4', I='u4', l='i4', L='u4',
+    q='i8', Q='u8', f='f4', d='f8'
+)
+
+
+class MappedRecords:
+    """
+    Read-only memory map of `num_records` consecutive records of `dtype`
+    which start `offset` bytes into the file at `file_path`.
+
+    Record ranges are returned as numpy views of the map, so only the pages
+    of the records that are actually used are read from disk.
+
+    Use a context:
+
+        with MappedRecords(path, dtype, offset, num_records) as records:
+            first_ten = records.records(0, 10)
+    """
+
+    def __init__(
+            self,
+            file_path: str,
+            dtype: np.dtype,
+            offset: int,
+            num_records: int
+    ):
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self.num_records = num_records
+
+        with open(file_path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        available_records = \
+            (len(self._map) - offset) // self.dtype.itemsize
+        if available_records < num_records:
+            self.close()
+            raise ValueError(
+                f"File {file_path} has room for {available_records} of "
+                f"{num_records} expected records"
+            )
+
+    def __len__(self):
+        return self.num_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def records(self, start=0, stop: Optional[int] = None) -> np.ndarray:
+        """
+        Return a zero-copy view of records `start` up to `stop`, with the
+        same bounds behaviour as a slice.
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_records)
+        count = max(stop - start, 0)
+
+        return np.frombuffer(
+            self._map, dtype=self.dtype, count=count,
+            offset=self.offset + start * self.dtype.itemsize
+        )
+
+    def close(self):
+        """
+        Close the memory map. Views that are still referenced keep the map
+        open until they are released.
+        """
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+def split_record_range(start: int, stop: int, parts: int) \
+        -> List[Tuple[int, int]]:
+    """
+    Return up to `parts` contiguous (`start`, `stop`) ranges of nearly equal
+    size that together cover records `start` up to `stop`
+    """
+    bounds = np.linspace(start, stop, max(parts, 1) + 1).round().astype(int)
+    return [
+        (int(lower), int(upper))
+        for lower, upper in zip(bounds[:-1], bounds[1:])
+        if upper > lower
+    ]
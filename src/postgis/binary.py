@@ -0,0 +1,289 @@
+"""
+Decoding of `COPY ... TO STDOUT WITH (FORMAT binary)` output into numpy arrays
+
+Format specification:
+    https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+Array values use the binary send format of `array_send` in
+    src/backend/utils/adt/arrayfuncs.c
+"""
+
+from typing import Dict, List, Optional, Tuple
+from struct import unpack_from
+import numpy as np
+
+copy_signature = b'PGCOPY\n\xff\r\n\x00'
+copy_trailer = b'\xff\xff'
+
+# big-endian numpy types of the scalar type OIDs that are decoded directly
+scalar_types = {
+    16: '?',  # boolean
+    21: '>i2',  # smallint
+    23: '>i4',  # integer
+    20: '>i8',  # bigint
+    26: '>u4',  # oid
+    700: '>f4',  # real
+    701: '>f8'  # double precision
+}
+# array type OIDs to the OIDs of their element types
+array_element_oids = {
+    1000: 16, 1005: 21, 1007: 23, 1016: 20, 1028: 26, 1021: 700, 1022: 701
+}
+# text-like type OIDs decoded as python strings
+text_oids = {25, 1043, 1042, 19}
+# any other type is cast to this type before it is copied
+cast_oid = 25
+cast_type = "text"
+
+decoded_oids = set(scalar_types) | set(array_element_oids) | text_oids
+
+
+def _native(type_code: str) -> np.dtype:
+    return np.dtype(type_code).newbyteorder('=')
+
+
+def _empty_column(oid: int) -> np.ndarray:
+    if oid in scalar_types:
+        return np.empty(0, _native(scalar_types[oid]))
+    elif oid in array_element_oids:
+        return np.empty(
+            (0, 0), _native(scalar_types[array_element_oids[oid]])
+        )
+    else:
+        return np.empty(0, object)
+
+
+def _array_header(data: bytes, offset: int) -> Tuple[int, int, List[int], int]:
+    """
+    Return the (`has_null`, `element_oid`, `dims`, `header_bytes`) of the
+    array value starting at `offset` of `data`
+    """
+    ndim, has_null, element_oid = unpack_from('>iii', data, offset)
+    dims = list(unpack_from(f'>{2 * ndim}i', data, offset + 12)[::2])
+    return has_null, element_oid, dims, 12 + 8 * ndim
+
+
+def _first_row_field_lengths(data: bytes, offset: int) -> List[int]:
+    (num_fields,) = unpack_from('>h', data, offset)
+    offset += 2
+    lengths = []
+    for _ in range(num_fields):
+        (length,) = unpack_from('>i', data, offset)
+        lengths.append(length)
+        offset += 4 + max(length, 0)
+    return lengths
+
+
+def _decode_fixed_rows(
+        body: bytes,
+        col_names: List[str],
+        oids: List[int]
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Decode `body` in a single pass as a record array if every row has the
+    same layout as its first row, i.e. there are no NULLs, no text values and
+    every array has the same dimensions. Returns `None` otherwise.
+    """
+    # rows without fields are left to `_decode_variable_rows`
+    if not oids:
+        return None
+    if any(oid not in scalar_types and oid not in array_element_oids
+           for oid in oids):
+        return None
+
+    lengths = _first_row_field_lengths(body, 0)
+    if len(lengths) != len(oids) or min(lengths) < 0:
+        return None
+
+    fields = [('num_fields', '>i2')]
+    array_dims: Dict[int, List[int]] = {}
+    offset = 2
+
+    for i, (oid, length) in enumerate(zip(oids, lengths)):
+        fields.append((f'length_{i}', '>i4'))
+        offset += 4
+
+        if oid in scalar_types:
+            field_type = np.dtype(scalar_types[oid])
+        else:
+            has_null, element_oid, dims, header_bytes = \
+                _array_header(body, offset)
+            if has_null or not dims or \
+                    element_oid != array_element_oids[oid]:
+                return None
+            element_type = np.dtype(scalar_types[element_oid])
+            field_type = np.dtype([
+                ('header', f'V{header_bytes}'),
+                ('elements', [('length', '>i4'), ('value', element_type)],
+                 (int(np.prod(dims)),))
+            ])
+            array_dims[i] = dims
+
+        if field_type.itemsize != length:
+            return None
+
+        fields.append((f'value_{i}', field_type))
+        offset += length
+
+    row_dtype = np.dtype(fields)
+    if len(body) % row_dtype.itemsize:
+        return None
+
+    rows = np.frombuffer(body, row_dtype)
+
+    # every row must match the layout of the first row
+    if (rows['num_fields'] != len(oids)).any():
+        return None
+    for i, length in enumerate(lengths):
+        if (rows[f'length_{i}'] != length).any():
+            return None
+        if i in array_dims:
+            array = rows[f'value_{i}']
+            element_bytes = array.dtype['elements'].base['value'].itemsize
+            if (array['header'] != array['header'][0]).any() or \
+                    (array['elements']['length'] != element_bytes).any():
+                return None
+
+    columns = {}
+    for i, name in enumerate(col_names):
+        values = rows[f'value_{i}']
+        if i in array_dims:
+            values = values['elements']['value'].reshape(
+                (rows.shape[0], *array_dims[i])
+            )
+        columns[name] = values.astype(_native(values.dtype.str))
+
+    return columns
+
+
+def _decode_array(data: bytes, offset: int) -> np.ndarray:
+    has_null, element_oid, dims, header_bytes = _array_header(data, offset)
+    element_type = np.dtype(scalar_types[element_oid])
+    # an empty array has no dimensions
+    count = int(np.prod(dims)) if dims else 0
+    offset += header_bytes
+
+    if not has_null:
+        elements = np.frombuffer(
+            data, [('length', '>i4'), ('value', element_type)], count, offset
+        )
+        return elements['value'].astype(_native(element_type.str)) \
+            .reshape(dims or (0,))
+
+    # NULL elements have no value bytes so the layout has to be walked
+    values = np.full(count, np.nan)
+    for j in range(count):
+        (element_length,) = unpack_from('>i', data, offset)
+        offset += 4
+        if element_length >= 0:
+            values[j] = np.frombuffer(data, element_type, 1, offset)[0]
+            offset += element_length
+    return values.reshape(dims)
+
+
+def _finalize_column(values: List, oid: int) -> np.ndarray:
+    if oid in text_oids:
+        return np.array(values, dtype=object)
+
+    has_null = any(v is None for v in values)
+
+    if oid in scalar_types:
+        native = _native(scalar_types[oid])
+        if has_null:
+            if native.kind == 'b':
+                return np.array(values, dtype=object)
+            return np.array(
+                [np.nan if v is None else v for v in values], dtype=float
+            )
+        return np.array(values, dtype=native)
+
+    # arrays are stacked when they all have the same shape
+    shapes = {v.shape for v in values if v is not None}
+    if not has_null and len(shapes) == 1:
+        return np.stack(values)
+
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def _decode_variable_rows(
+        body: bytes,
+        col_names: List[str],
+        oids: List[int]
+) -> Dict[str, np.ndarray]:
+    """
+    Decode `body` field by field. Arrays are still decoded without creating
+    a python object per element unless they contain NULL elements.
+    """
+    values: List[List] = [[] for _ in oids]
+    offset = 0
+
+    while offset < len(body):
+        (num_fields,) = unpack_from('>h', body, offset)
+        offset += 2
+        if num_fields != len(oids):
+            raise ValueError(
+                f"Expected {len(oids)} fields per row but got {num_fields}"
+            )
+
+        for i, oid in enumerate(oids):
+            (length,) = unpack_from('>i', body, offset)
+            offset += 4
+
+            if length < 0:
+                value = None
+            elif oid in scalar_types:
+                value = np.frombuffer(body, scalar_types[oid], 1, offset)[0]
+            elif oid in array_element_oids:
+                value = _decode_array(body, offset)
+            else:
+                value = body[offset:offset + length].decode()
+
+            values[i].append(value)
+            offset += max(length, 0)
+
+    return {
+        name: _finalize_column(column_values, oid)
+        for name, column_values, oid in zip(col_names, values, oids)
+    }
+
+
+def decode_copy_binary(
+        data: bytes,
+        col_names: List[str],
+        oids: List[int]
+) -> Dict[str, np.ndarray]:
+    """
+    Return a `dict` of the column names `col_names` to numpy arrays of the
+    rows in `data`, the output of a binary `COPY ... TO STDOUT` whose columns
+    have the type OIDs `oids`, which must all be in `decoded_oids`.
+
+    Numeric columns are arrays of their native type. Array columns are
+    arrays with an extra dimension per array dimension if all of their values
+    have the same shape and are not NULL, otherwise they are object arrays
+    of arrays. NULL numeric values are NaN, which turns integer columns into
+    floats. Text columns are object arrays of strings.
+    """
+    unsupported = [
+        name for name, oid in zip(col_names, oids) if oid not in decoded_oids
+    ]
+    if unsupported:
+        raise ValueError(f"Columns {unsupported} have unsupported types")
+
+    if not data.startswith(copy_signature):
+        raise ValueError("Data does not start with the binary COPY signature")
+    if not data.endswith(copy_trailer):
+        raise ValueError("Data does not end with the binary COPY trailer")
+
+    # flags field followed by the header extension length
+    (extension_bytes,) = unpack_from('>i', data, len(copy_signature) + 4)
+    body = data[len(copy_signature) + 8 + extension_bytes:-len(copy_trailer)]
+
+    if not body:
+        return {
+            name: _empty_column(oid) for name, oid in zip(col_names, oids)
+        }
+
+    return _decode_fixed_rows(body, col_names, oids) or \
+        _decode_variable_rows(body, col_names, oids)
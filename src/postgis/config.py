@@ -24,6 +24,7 @@ class DEFAULT:
 
 class PART:
     temp = "TEMP" + SQL.space
+    unlogged = "UNLOGGED" + SQL.space
     if_exists = "IF" + SQL.space + "EXISTS" + SQL.space
     wrap_bracket = SQL.open_bracket + "{}" + SQL.close_bracket
     and_sep = SQL.space + "AND" + SQL.space
@@ -36,6 +37,26 @@ class BLOCK:
     union = SQL.newline + "UNION" + SQL.newline
 
 
+class COPY:
+    null = '\\N'
+    float_format = '%.17g'
+    int_format = '%d'
+    array_null = 'NULL'
+    array_open = '{'
+    array_close = '}'
+    array_quote = '"'
+
+
 class SUFFIX:
     spatial_index = "_sgix"
     simple_index = "_sidx"
+
+
+class PLAN:
+    # sequential scans reading at least this many rows are flagged
+    large_scan_rows = 100000
+    # spatial predicates that a GiST index can answer
+    spatial_predicates = [
+        'st_intersects', 'st_dwithin', 'st_contains', 'st_within',
+        'st_covers', 'st_coveredby', '&&'
+    ]
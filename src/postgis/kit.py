@@ -1,6 +1,8 @@
 from collections import namedtuple
 from typing import Optional, Iterable
 from warnings import warn
+import numpy as np
+import pandas as pd
 
 from . import Session, ResultFormat
 from .xtypes import Table
@@ -15,6 +17,30 @@ DiffResult = namedtuple(
 )
 
 
+def _select_hashable_frame(session: Session, table: Table) -> pd.DataFrame:
+    """
+    Returns all rows of `table` as a `pandas.DataFrame` with array values
+    flattened to tuples so that rows can be merged
+    """
+    columns = session.select(
+        table, auto_order_by_first_n_cols=-1,
+        result_format=ResultFormat.NUMPY
+    )
+
+    frame_columns = {}
+    for name, values in columns.items():
+        if values.ndim > 1:
+            values = list(map(tuple, values.reshape(len(values), -1).tolist()))
+        elif values.dtype == object:
+            values = [
+                tuple(v.ravel().tolist()) if isinstance(v, np.ndarray) else v
+                for v in values
+            ]
+        frame_columns[name] = values
+
+    return pd.DataFrame(frame_columns, columns=list(columns))
+
+
 def diff_tables(
         table_left: Table,
         table_right: Table,
@@ -29,17 +55,8 @@ def diff_tables(
     if session_right is None:
         session_right = session_left
 
-    df_left = session_left.select(
-        table_left, auto_order_by_first_n_cols=-1,
-        result_format=ResultFormat.DATAFRAME,
-        convert_array_to_tuple=True
-    )
-
-    df_right = session_right.select(
-        table_right, auto_order_by_first_n_cols=-1,
-        result_format=ResultFormat.DATAFRAME,
-        convert_array_to_tuple=True
-    )
+    df_left = _select_hashable_frame(session_left, table_left)
+    df_right = _select_hashable_frame(session_right, table_right)
 
     unique_cols_left = [
         c for c in df_left.columns
@@ -0,0 +1,78 @@
+"""
+Diagnostics of the plans output by `EXPLAIN (ANALYZE, FORMAT JSON)`
+
+Format specification:
+    https://www.postgresql.org/docs/current/using-explain.html
+"""
+
+from typing import Dict, Iterator, List
+
+from .config import PLAN
+
+# nodes that read through an index, where a spatial filter is the recheck of
+# an index condition
+index_scan_nodes = {'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+
+
+def iter_plan_nodes(node: Dict) -> Iterator[Dict]:
+    """
+    Iterate over plan `node` and every node below it, depth first
+    """
+    yield node
+    for child in node.get('Plans', []):
+        yield from iter_plan_nodes(child)
+
+
+def _node_relation(node: Dict) -> str:
+    relation = node.get('Relation Name', '')
+    alias = node.get('Alias')
+    if alias and alias != relation:
+        relation += f" {alias}"
+    return relation
+
+
+def plan_warnings(
+        plan: Dict,
+        large_scan_rows=PLAN.large_scan_rows,
+        spatial_predicates=PLAN.spatial_predicates
+) -> List[str]:
+    """
+    Return warnings of the nodes of `plan`, one element of the JSON output
+    of `EXPLAIN (ANALYZE, FORMAT JSON)`:
+        sequential scans that read at least `large_scan_rows` rows over all
+            of their loops, including the rows removed by their filter
+        `spatial_predicates` in a filter or join filter of a node that does
+            not read through an index, i.e. without a GiST index
+    """
+    warnings = []
+
+    for node in iter_plan_nodes(plan['Plan']):
+        node_type = node['Node Type']
+        relation = _node_relation(node)
+        on_relation = f" on {relation}" if relation else ""
+
+        if node_type == 'Seq Scan':
+            loops = node.get('Actual Loops', 1)
+            rows = loops * (
+                node.get('Actual Rows', node.get('Plan Rows', 0))
+                + node.get('Rows Removed by Filter', 0)
+            )
+            if rows >= large_scan_rows:
+                warnings.append(
+                    f"Seq Scan{on_relation} read {rows} rows"
+                    + (f" over {loops} loops" if loops > 1 else "")
+                )
+
+        if node_type in index_scan_nodes:
+            continue
+
+        for key in ['Filter', 'Join Filter']:
+            condition = node.get(key, '').lower()
+            found = [p for p in spatial_predicates if p in condition]
+            if found:
+                warnings.append(
+                    f"{node_type}{on_relation} evaluates {found} in its "
+                    f"{key.lower()} without a GiST index"
+                )
+
+    return warnings
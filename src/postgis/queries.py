@@ -21,6 +21,15 @@ add_primary_key = \
 ALTER TABLE {T@table} ADD PRIMARY KEY ({I@col_names})\
 """
 
+sync_serial_sequence = \
+"""\
+SELECT setval(
+    pg_get_serial_sequence(format('%I.%I', {L@schema}, {L@name}), {L@col}),
+    max({I@col})
+)
+FROM {T@table}\
+"""
+
 drop_table = \
 """\
 DROP TABLE {S@exists}{T@table}\
@@ -47,6 +56,31 @@ insert = \
 INSERT INTO {T@table} {cols_block} VALUES %s\
 """
 
+copy_from_stdin = \
+"""\
+COPY {T@table} {cols_block} FROM STDIN WITH (FORMAT csv, NULL {L@null})\
+"""
+
+copy_to_stdout_binary = \
+"""\
+COPY ({S@query}) TO STDOUT WITH (FORMAT binary)\
+"""
+
+explain_analyze = \
+"""\
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {S@query}\
+"""
+
+describe_query = \
+"""\
+SELECT * FROM ({S@query}) {I@alias} LIMIT 0\
+"""
+
+select_from_query = \
+"""\
+SELECT {columns} FROM ({S@query}) {I@alias}\
+"""
+
 add_geom_col = \
 """\
 SELECT AddGeometryColumn(
@@ -1,11 +1,15 @@
 from typing import Iterable, Tuple, Optional, List, ContextManager, \
-    Union, IO
+    Union, IO, Dict, Iterator
+from io import StringIO, BytesIO
 from ..xtypes import KwargsDict
 from .xtypes import Query, Table, Columns, IndexColumn, OmniColumns, \
     ColumnConfigDict
 
 from enum import Enum
 from contextlib import contextmanager
+from time import perf_counter
+from datetime import datetime
+import json
 import psycopg2 as pg
 from psycopg2 import sql as pgs, extras as pgx, extensions as pge
 import pandas as pd
@@ -29,10 +33,18 @@ from .tools import \
     sql_block_where, \
     sql_block_order_by, \
     stack_sql_lines, \
-    column_config_dict_to_list
-from .config import SQL, DEFAULT, PART, SUFFIX, BLOCK
+    column_config_dict_to_list, \
+    write_copy_csv_rows, \
+    write_copy_csv_array, \
+    iter_chunks
+from .config import SQL, DEFAULT, PART, SUFFIX, BLOCK, COPY
+from .binary import decode_copy_binary, decoded_oids, cast_oid, cast_type
+from .plans import plan_warnings
 
 default_page_size = 1000
+default_copy_page_size = 100000
+default_batch_size = 10000
+default_batch_cursor_name = "select_batches"
 default_temp = False
 
 
@@ -41,6 +53,7 @@ class ResultFormat(Enum):
     DATAFRAME = 'dataframe'
     LIST = 'list'
     CURSOR = 'cursor'
+    NUMPY = 'numpy'
 
 
 # NOTE: Enum not used to allow for custom join types if necessary
@@ -52,7 +65,9 @@ class TableJoin:
     FULL_OUTER_JOIN = "FULL OUTER JOIN"
 
 
-QueryResult = Union[None, pge.cursor, pd.DataFrame, List[List]]
+QueryResult = Union[
+    None, pge.cursor, pd.DataFrame, List[List], Dict[str, np.ndarray]
+]
 
 
 class Session:
@@ -74,7 +89,8 @@ class Session:
             default_schema=DEFAULT.schema,
             default_geom_col=DEFAULT.col_geom,
             default_cursor_kwargs: Optional[KwargsDict] = None,
-            sql_alchemy_engine_kwargs: Optional[KwargsDict] = None
+            sql_alchemy_engine_kwargs: Optional[KwargsDict] = None,
+            capture_plans=False
     ):
 
         # establish connection
@@ -105,13 +121,68 @@ class Session:
         self.default_geom_col = default_geom_col
         self.default_cursor_kwargs = default_cursor_kwargs or {}
 
+        # seconds spent waiting on the database, see `_timed`
+        self.query_seconds = 0.0
+
+        # diagnostic mode that runs labelled queries through
+        # `EXPLAIN ANALYZE` and keeps their plans, see `_explain_analyze`
+        self.capture_plans = capture_plans
+        self.captured_plans: List[Dict] = []
+
+    def connection_config(self) -> KwargsDict:
+        """
+        Return the keyword arguments that create a new `Session` with the same
+        connection and defaults, e.g. in a worker process.
+        """
+        return dict(
+            **self._connection_parameters,
+            ensure_table_schema=self.ensure_table_schema,
+            connection_kwargs=self._connection_kwargs,
+            default_schema=self.default_schema,
+            default_geom_col=self.default_geom_col,
+            default_cursor_kwargs=self.default_cursor_kwargs,
+            capture_plans=self.capture_plans
+        )
+
+    def clone(self) -> 'Session':
+        """
+        Return a new `Session` with its own connection and the same
+        configuration and logging, e.g. for another thread. Captured plans
+        are added to the plans of this session.
+        """
+        session = Session(log_func=self.log, **self.connection_config())
+        session.captured_plans = self.captured_plans
+        return session
+
     def commit(self):
         """Commit changes to database"""
-        self.connection.commit()
+        with self._timed():
+            self.connection.commit()
+
+    def rollback(self):
+        """Roll back uncommitted changes to database"""
+        self.connection.rollback()
+
+    @contextmanager
+    def drop_tables_on_error(self, *tables: Table):
+        """
+        Context that rolls back, drops `tables` and commits if it raises, for
+        tables that are committed before they are filled, e.g. so other
+        connections can write to them, and would otherwise look complete
+        """
+        try:
+            yield
+        except Exception:
+            self.rollback()
+            for table in tables:
+                self.drop_table(table)
+            self.commit()
+            raise
 
     def close(self):
         """Close PostGIS connection"""
         self.connection.close()  # closes connection again with no issue
+        self._sql_alchemy_engine.dispose()
         self.__connected = False
 
     def check_connected(self):
@@ -119,6 +190,17 @@ class Session:
         if not self.__connected:
             raise pg.InterfaceError("Session connection already closed")
 
+    @contextmanager
+    def _timed(self):
+        """
+        Add the time spent in the context to `query_seconds`
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.query_seconds += perf_counter() - start
+
     def _cursor(self, **kwargs) -> pge.cursor:
         """
         Return a PostGIS cursor object for manipulating the database.
@@ -188,6 +270,23 @@ class Session:
         else:
             return table
 
+    def qualified_table(self, table: Table) -> Table:
+        """
+        Returns `table` as `schema.table` with the default schema if none is
+        provided
+        """
+        return ".".join(self._split_table_identifier(table))
+
+    def query_tables(self, query: str, kwargs) -> List[Table]:
+        """
+        Returns the qualified tables given by `kwargs` to the `T` placeholders
+        of the template `query`
+        """
+        return [
+            self.qualified_table(table)
+            for table in TemplateQuery(query).table_args(kwargs or {})
+        ]
+
     def format_query(self, query: Query, args, kwargs):
         """
         Formats the query through TemplateQuery but applies a schema to
@@ -210,13 +309,20 @@ class Session:
         else:
             return query.strip()
 
+    def query_string(self, query: Query) -> str:
+        """
+        Returns `query` as it would be executed
+        """
+        return self._process_query(query)
+
     def execute_query(
             self, query: Query, fetch=False,
             result_format=ResultFormat.DATAFRAME, as_cols=False,
             single_response=False,
             cursor_kwargs: Optional[KwargsDict] = None,
             convert_array_to_tuple=False,
-            log_query_string=False
+            log_query_string=False,
+            plan_label: Optional[str] = None
     ) -> QueryResult:
 
         """
@@ -233,7 +339,12 @@ class Session:
                 objects is returned
             CURSOR: the cursor as a `psycopg2.extras.cursor object` is
                 returned
+            NUMPY: A `dict` of column names to `numpy.ndarray` columns
+                fetched with binary `COPY`, see `_copy_binary_to_numpy`
 
+        If `capture_plans` is `True` then a query that is not fetched and has
+        a `plan_label` is executed through `EXPLAIN ANALYZE` and its plan is
+        captured, see `_explain_analyze`.
         """
 
         self.check_connected()
@@ -247,14 +358,27 @@ class Session:
             # BREAKPOINT HERE \/
             if log_query_string:
                 self.log(wrap_query_debug(query_string))
-            cursor.execute(query_string)
+
+            if self.capture_plans and plan_label is not None and not fetch:
+                self._explain_analyze(cursor, query_string, plan_label)
+                return
+
+            if fetch and result_format == ResultFormat.NUMPY:
+                columns = self._copy_binary_to_numpy(cursor, query_string)
+                if single_response:
+                    return next(iter(columns.values()))[0]
+                return columns
+
+            with self._timed():
+                cursor.execute(query_string)
 
             if fetch:
 
                 if result_format == ResultFormat.CURSOR:
                     return cursor
 
-                rows = cursor.fetchall()
+                with self._timed():
+                    rows = cursor.fetchall()
 
                 if convert_array_to_tuple:
                     # get indices of columns that have list values
@@ -288,6 +412,90 @@ class Session:
                         "result_type must be a valid QueryResultFormat"
                     )
 
+    def _explain_analyze(
+            self, cursor: pge.cursor, query_string: str, label: str
+    ):
+        """
+        Execute `query_string` through `EXPLAIN (ANALYZE, BUFFERS, FORMAT
+        JSON)`, which runs the statement, and add its plan and the warnings
+        of `plans.plan_warnings` to `captured_plans` as a `dict` with
+        `label`, e.g. the name of the step.
+        """
+        with self._timed():
+            cursor.execute(self._process_query(self.format_query(
+                queries.explain_analyze, None, dict(query=query_string)
+            ), cursor))
+            plan = cursor.fetchone()[0]
+
+        # json values are decoded unless the json type caster was replaced
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan = plan[0]
+
+        warnings = plan_warnings(plan)
+        for warning in warnings:
+            self.log(f"query plan of {label}: {warning}")
+
+        self.captured_plans.append(dict(
+            label=label, query=query_string, plan=plan, warnings=warnings,
+            execution_ms=plan.get('Execution Time'),
+            captured_at=datetime.now()
+        ))
+
+    def _copy_binary_to_numpy(
+            self, cursor: pge.cursor, query_string: str
+    ) -> Dict[str, np.ndarray]:
+        """
+        Return the result of `query_string` as a `dict` of column names to
+        `numpy.ndarray` columns decoded from binary `COPY ... TO STDOUT`
+        output, so that numeric and array values are never parsed from text
+        or converted to python objects.
+
+        Array columns are arrays with an extra dimension per array dimension.
+        Columns of types without a binary decoder (e.g. geometry) are cast to
+        text. See `binary.decode_copy_binary` for NULL handling.
+        """
+        query_string = query_string.rstrip(';')
+        alias = "_result"
+
+        # column names and types without running the query
+        with self._timed():
+            cursor.execute(self._process_query(self.format_query(
+                queries.describe_query, None,
+                dict(query=query_string, alias=alias)
+            ), cursor))
+        col_names = [col.name for col in cursor.description]
+        oids = [col.type_code for col in cursor.description]
+
+        if len(set(col_names)) < len(col_names):
+            raise ValueError(
+                f"Result has duplicate column names {col_names}"
+            )
+
+        if not all(oid in decoded_oids for oid in oids):
+            columns = [
+                pgs.Identifier(name) if oid in decoded_oids
+                else pgs.SQL("{}::{}").format(
+                    pgs.Identifier(name), pgs.SQL(cast_type)
+                )
+                for name, oid in zip(col_names, oids)
+            ]
+            query_string = self._process_query(self.format_query(
+                queries.select_from_query, None, dict(
+                    columns=pgs.SQL(", ").join(columns),
+                    query=query_string, alias=alias
+                )
+            ), cursor)
+            oids = [oid if oid in decoded_oids else cast_oid for oid in oids]
+
+        buffer = BytesIO()
+        with self._timed():
+            cursor.copy_expert(self._process_query(self.format_query(
+                queries.copy_to_stdout_binary, None, dict(query=query_string)
+            ), cursor), buffer)
+
+        return decode_copy_binary(buffer.getvalue(), col_names, oids)
+
     def table_exists(self, table: Table):
         schema, table = self._split_table_identifier(table)
         query = self.format_query(
@@ -400,14 +608,15 @@ class Session:
 
     def create_table(
             self, table: Table, column_config: Iterable[Tuple[str, str]],
-            temp=default_temp, log_query_string=True
+            temp=default_temp, log_query_string=True, unlogged=False
     ):
         """
         Create a table with name `table`. `column_configs` is a list of
         tuples (`name`,`config`) where `name` is a column name and `config`
         is a SQL expression describing the column configuration.
 
-        A temporary table is created if `temp` is `True`.
+        A temporary table is created if `temp` is `True`, otherwise an
+        unlogged table is created if `unlogged` is `True`.
         """
         table = self._table_with_schema(table)
 
@@ -415,7 +624,12 @@ class Session:
             self.check_table_not_exists(table)
 
         parsed_config = parse_create_table_cols_config(column_config)
-        temp_fragment = PART.temp if temp else ""
+        if temp:
+            temp_fragment = PART.temp
+        elif unlogged:
+            temp_fragment = PART.unlogged
+        else:
+            temp_fragment = ""
         query = self.format_query(
             queries.create_table, None,
             dict(table=table, config=parsed_config, temp=temp_fragment)
@@ -424,12 +638,13 @@ class Session:
 
     def create_table_as(
             self, table: Table, query: Query, temp=default_temp,
-            log_query_string=True
+            log_query_string=True, plan_label: Optional[str] = None
     ):
         """
         Wrap `query` with a CREATE TABLE `table` AS statement.
 
-        A temporary table is created if `temp` is `True`.
+        A temporary table is created if `temp` is `True`. The plan is
+        captured with `plan_label` if `capture_plans` is `True`.
         """
         table = self._table_with_schema(table)
 
@@ -444,7 +659,10 @@ class Session:
             queries.create_table_as, None,
             dict(table=table, query=query, temp=temp_fragment)
         )
-        self.execute_query(full_query, log_query_string=log_query_string)
+        self.execute_query(
+            full_query, log_query_string=log_query_string,
+            plan_label=plan_label
+        )
 
     def create_table_from_rows(
             self,
@@ -585,7 +803,8 @@ class Session:
             **(to_sql_kwargs or {})
         }
 
-        with self.sqlalchemy_connection(connection_kwargs) as conn:
+        with self.sqlalchemy_connection(connection_kwargs) as conn, \
+                self._timed():
             gdf.to_sql(table, conn, schema, **to_sql_kwargs)
 
     def drop_table(self, table: Table, if_exists=True):
@@ -601,6 +820,18 @@ class Session:
         )
         self.execute_query(query)
 
+    def _target_cols_block(self, target_cols: Optional[Iterable[str]]):
+        """
+        Returns the bracketed column list of an INSERT or COPY statement,
+        which is empty if `target_cols` is `None`
+        """
+        if target_cols is None:
+            return pgs.SQL("")
+        else:
+            return self.format_query(
+                "({I@c})", None, {'c': target_cols}
+            )
+
     def insert(
             self,
             table: Table,
@@ -609,11 +840,25 @@ class Session:
             template: Union[pgs.Composable, str, None] = None,
             page_size=100,
             cursor_kwargs: Optional[KwargsDict] = None,
-            log_query_string=False
+            log_query_string=False,
+            use_copy=False
     ):
         """
         Insert `rows` into `target_cols` of `table` using `template`.
+
+        If `use_copy` is `True` the rows are streamed with `copy_insert`
+        instead, which does not support a `template`.
         """
+        if use_copy:
+            if template is not None:
+                raise ValueError("`template` cannot be used with `use_copy`")
+            self.copy_insert(
+                table, rows, target_cols,
+                cursor_kwargs=cursor_kwargs,
+                log_query_string=log_query_string
+            )
+            return
+
         table = self._table_with_schema(table)
 
         self.check_table_exists(table)
@@ -621,12 +866,7 @@ class Session:
 
         with self._cursor(**cursor_kwargs) as cursor:
 
-            if target_cols is None:
-                cols_block = pgs.SQL("")
-            else:
-                cols_block = self.format_query(
-                    "({I@c})", None, {'c': target_cols}
-                )
+            cols_block = self._target_cols_block(target_cols)
 
             if template and isinstance(template, pgs.Composable):
                 template = template.as_string(cursor)
@@ -639,7 +879,64 @@ class Session:
             if log_query_string:
                 self.log(wrap_query_debug(query_string))
 
-            pgx.execute_values(cursor, query_string, rows, template, page_size)
+            with self._timed():
+                pgx.execute_values(
+                    cursor, query_string, rows, template, page_size
+                )
+
+    def copy_insert(
+            self,
+            table: Table,
+            rows: Union[Iterable[Iterable], np.ndarray],
+            target_cols: Iterable[str] = None,
+            page_size=default_copy_page_size,
+            cursor_kwargs: Optional[KwargsDict] = None,
+            log_query_string=False
+    ):
+        """
+        Insert `rows` into `target_cols` of `table` by streaming them through
+        `COPY ... FROM STDIN` in CSV format, `page_size` rows at a time.
+
+        `rows` is either an iterable of rows, where list values are written
+        as arrays (e.g. `ml_power_echo`), or a numeric 2d or structured
+        `numpy.ndarray` which is serialized without converting it to python
+        objects.
+        """
+        table = self._table_with_schema(table)
+
+        self.check_table_exists(table)
+        cursor_kwargs = cursor_kwargs or self.default_cursor_kwargs
+
+        with self._cursor(**cursor_kwargs) as cursor:
+
+            query = self.format_query(
+                queries.copy_from_stdin, None,
+                dict(
+                    table=table,
+                    cols_block=self._target_cols_block(target_cols),
+                    null=COPY.null
+                )
+            )
+            query_string = self._process_query(query, cursor)
+            if log_query_string:
+                self.log(wrap_query_debug(query_string))
+
+            if isinstance(rows, np.ndarray):
+                pages = (
+                    rows[i:i + page_size]
+                    for i in range(0, rows.shape[0], page_size)
+                )
+                write_page = write_copy_csv_array
+            else:
+                pages = iter_chunks(rows, page_size)
+                write_page = write_copy_csv_rows
+
+            for page in pages:
+                buffer = StringIO()
+                write_page(page, buffer)
+                buffer.seek(0)
+                with self._timed():
+                    cursor.copy_expert(query_string, buffer)
 
     def select(
             self,
@@ -670,6 +967,68 @@ class Session:
         Other arguments passed to `execute_query`.
         """
 
+        combined_query = self._build_select_query(
+            table, cols, where, order_by, exclude_cols,
+            auto_order_by_first_n_cols
+        )
+
+        return self.execute_query(
+            combined_query, True, result_format, as_cols, single_response,
+            cursor_kwargs, convert_array_to_tuple, log_query_string
+        )
+
+    def select_batches(
+            self,
+            table: Table,
+            cols: Optional[OmniColumns] = None,
+            batch_size=default_batch_size,
+            where: Optional[Iterable[str]] = None,
+            order_by: Optional[Iterable[str]] = None,
+            exclude_cols: Optional[OmniColumns] = None,
+            auto_order_by_first_n_cols: Optional[int] = 1,
+            cursor_name=default_batch_cursor_name,
+            log_query_string=True
+    ) -> Iterator[List[Tuple]]:
+        """
+        Select from `table` like `select` but yield the rows as lists of up to
+        `batch_size` row tuples fetched through a server-side cursor named
+        `cursor_name`, so that only a single batch is held in memory.
+
+        The cursor is closed if the transaction is committed, so the
+        batches have to be consumed before the next commit.
+        """
+        query = self._build_select_query(
+            table, cols, where, order_by, exclude_cols,
+            auto_order_by_first_n_cols
+        )
+
+        with self._cursor(name=cursor_name) as cursor:
+            cursor.itersize = batch_size
+            query_string = self._process_query(query, cursor)
+            if log_query_string:
+                self.log(wrap_query_debug(query_string))
+            with self._timed():
+                cursor.execute(query_string)
+
+            while True:
+                with self._timed():
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def _build_select_query(
+            self,
+            table: Table,
+            cols: Optional[OmniColumns],
+            where: Optional[Iterable[str]],
+            order_by: Optional[Iterable[str]],
+            exclude_cols: Optional[OmniColumns],
+            auto_order_by_first_n_cols: Optional[int]
+    ) -> pgs.Composable:
+        """
+        Return the SELECT query of `select`
+        """
         table = self._table_with_schema(table)
 
         # get names of columns to be selected except those excluded
@@ -722,12 +1081,7 @@ class Session:
                     ))
                 )
 
-        combined_query = stack_sql_lines(*lines)
-
-        return self.execute_query(
-            combined_query, True, result_format, as_cols, single_response,
-            cursor_kwargs, convert_array_to_tuple, log_query_string
-        )
+        return stack_sql_lines(*lines)
 
     def _make_table_cols_sets(self, table: Table, cols: Iterable[str]):
         table = self._table_with_schema(table)
@@ -822,6 +1176,29 @@ class Session:
         )
         self.execute_query(query, log_query_string=log_query_string)
 
+    def sync_serial_sequence(
+            self, table: Table, col: str, log_query_string=True
+    ):
+        """
+        Advance the sequence of serial column `col` of `table` to the largest
+        value of `col`, so rows inserted without a value after rows that
+        were given explicit values get new ones.
+
+        Does nothing if `table` is empty or `col` is not a serial column.
+        """
+        self.check_table_exists(table)
+        self.check_table_has_all_of_cols(table, col)
+
+        table = self._table_with_schema(table)
+        schema, name = self._split_table_identifier(table)
+
+        query = self.format_query(
+            queries.sync_serial_sequence, None, dict(
+                table=table, schema=schema, name=name, col=col
+            )
+        )
+        self.execute_query(query, log_query_string=log_query_string)
+
     def calc_geom_from_xy(
             self, table: Table, col_x: IndexColumn, col_y: IndexColumn,
             srid_input,
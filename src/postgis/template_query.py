@@ -1,10 +1,11 @@
-from typing import Dict
+from typing import Dict, List
 
 import re
 from psycopg2 import sql as pgs
 from .tools import \
     identifier_from_table_path, \
-    parse_iter_or_value
+    parse_iter_or_value, \
+    is_non_string_iterable
 
 
 class TemplateQuery:
@@ -129,6 +130,24 @@ class TemplateQuery:
         self._query_string = query_string
         self._default_schema = default_schema
 
+    def table_args(self, kwargs: Dict[str, any]) -> List[str]:
+        """
+        Return the values of `kwargs` given to the `T` placeholders of the
+        query in order of appearance, i.e. the tables it references
+        """
+        tables = []
+        for match in self._rx_query_forms.finditer(self._query_string):
+            form = match['form']
+            if form is None or form.upper() != 'T' or match['tag'] is None:
+                continue
+
+            value = kwargs[match['subkey']]
+            for table in value if is_non_string_iterable(value) else [value]:
+                if table not in tables:
+                    tables.append(table)
+
+        return tables
+
     def format(self, *args, **kwargs) -> pgs.Composable:
         new_kwargs = self._convert_query_kwargs(kwargs)
         formatted_query = pgs.SQL(self._query_string).format(*args,
@@ -2,11 +2,13 @@
 Helper functions used by PostGIS tools
 """
 
-from typing import Callable, Iterable, Tuple, Union, List
+from typing import Callable, Iterable, Tuple, Union, List, IO, Iterator
+from itertools import islice
+import csv
 import numpy as np
 from psycopg2 import sql as pgs
 
-from .config import SQL, DEFAULT, PART, BLOCK
+from .config import SQL, DEFAULT, PART, BLOCK, COPY
 from .xtypes import ColumnConfigDict, ColumnConfigList
 
 wrap_debug_width = 10
@@ -246,3 +248,107 @@ def column_config_dict_to_list(
         column_config: ColumnConfigDict
 ) -> ColumnConfigList:
     return [tuple(p) for p in column_config.items()]
+
+
+def iter_chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    """
+    Yields lists of up to `size` consecutive items of `iterable`
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_copy_float(value: float) -> str:
+    """
+    Returns float `value` as text that PostgreSQL reads back to the exact
+    same double
+    """
+    if np.isnan(value):
+        return 'NaN'
+    elif np.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    else:
+        return COPY.float_format % value
+
+
+def format_copy_array(values: Iterable) -> str:
+    """
+    Returns `values` as a PostgreSQL array literal, e.g. `{1,2,3}`.
+    Nested iterables become nested arrays.
+    """
+    items = []
+    for value in values:
+        if value is None:
+            items.append(COPY.array_null)
+        elif isinstance(value, str):
+            escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+            items.append(COPY.array_quote + escaped + COPY.array_quote)
+        else:
+            items.append(format_copy_value(value))
+    return COPY.array_open + SQL.sep.join(items) + COPY.array_close
+
+
+def format_copy_value(value) -> str:
+    """
+    Returns `value` as the text of a single field of a CSV COPY
+    """
+    if value is None:
+        return COPY.null
+    elif isinstance(value, (bool, np.bool_)):
+        return 't' if value else 'f'
+    elif isinstance(value, (float, np.floating)):
+        return format_copy_float(value)
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        return format_copy_array(value)
+    else:
+        return str(value)
+
+
+def write_copy_csv_rows(rows: Iterable[Iterable], buffer: IO) -> int:
+    """
+    Write `rows` into text `buffer` in the CSV format read by
+    `COPY ... FROM STDIN`. Iterable values such as python lists are written
+    as array literals. Returns the number of rows written.
+    """
+    writer = csv.writer(buffer, lineterminator=SQL.newline)
+    num_rows = 0
+    for row in rows:
+        writer.writerow([format_copy_value(value) for value in row])
+        num_rows += 1
+    return num_rows
+
+
+def write_copy_csv_array(array: np.ndarray, buffer: IO) -> int:
+    """
+    Write the rows of numeric 2d `array` into text `buffer` in the CSV
+    format read by `COPY ... FROM STDIN`. Float values that are whole numbers
+    are written without a decimal so they can be copied to integer columns.
+    `array` can also be a 1d structured array with a numeric field per
+    column, e.g. integer ids next to float values. Returns the number of
+    rows written.
+    """
+    if array.dtype.names is not None:
+        if array.ndim != 1:
+            raise ValueError("structured `array` must be 1-dimensional")
+        value_format = [
+            COPY.int_format
+            if np.issubdtype(array.dtype[name], np.integer)
+            else COPY.float_format
+            for name in array.dtype.names
+        ]
+    elif array.ndim != 2:
+        raise ValueError("`array` must be 2-dimensional")
+    else:
+        value_format = COPY.int_format \
+            if np.issubdtype(array.dtype, np.integer) else COPY.float_format
+
+    if array.shape[0] > 0:
+        np.savetxt(
+            buffer, array, fmt=value_format, delimiter=SQL.sep,
+            newline=SQL.newline
+        )
+    return array.shape[0]
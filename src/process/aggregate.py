@@ -0,0 +1,171 @@
+"""
+Aggregation of observation points to circular ASIRAS footprints on the client
+
+Footprints of every radius are answered by a single k-d tree query at the
+largest radius. scipy is not part of the environment so it is optional and
+only required by `aggregate_to_radii`.
+
+The `KDTREE` engine is a hybrid: the radar footprints are not circular, so
+they are still aggregated in PostGIS by `queries.aggregate_observations_radar`
+and only the circular footprints are aggregated on the client.
+"""
+
+from typing import Dict, Iterable
+from enum import Enum
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class AggregationEngine(Enum):
+    # join observations to the footprint polygons in PostGIS
+    POLYGON = 'polygon'
+    # k-d tree queries and NumPy aggregates on the client
+    KDTREE = 'kdtree'
+
+
+def require_scipy():
+    """
+    Raise `ImportError` if scipy, which the `KDTREE` engine needs, is not
+    installed
+    """
+    if cKDTree is None:
+        raise ImportError(
+            "the 'kdtree' aggregation engine requires scipy, which is not "
+            "part of cveureka.yml: install it with "
+            "`conda install -n cveureka scipy` or set "
+            "`PARAM.fp_aggregation` to 'polygon'"
+        )
+
+
+def percentile_cont_sorted(
+        values: np.ndarray,
+        starts: np.ndarray,
+        counts: np.ndarray,
+        fraction: float
+) -> np.ndarray:
+    """
+    Return the `PERCENTILE_CONT(fraction)` of each group of `counts` values
+    starting at `starts` of `values`, which must be sorted in the order of
+    the `WITHIN GROUP` clause. Groups must not be empty.
+    """
+    position = fraction * (counts - 1)
+    first = np.floor(position).astype(int)
+    second = np.ceil(position).astype(int)
+
+    first_value = values[starts + first]
+    second_value = values[starts + second]
+
+    # interpolated the same way as PostgreSQL
+    return first_value + (second_value - first_value) * (position - first)
+
+
+def aggregate_to_radii(
+        nadir_xy: np.ndarray,
+        observation_xy: np.ndarray,
+        observation_values: np.ndarray,
+        radii: Iterable[float],
+        rough_margin: float,
+        nadirs_per_chunk=1000
+) -> Dict[str, np.ndarray]:
+    """
+    Return the aggregates of `observation_values` within each of `radii`
+    (exclusive) of each nadir in the same way as the query
+    `aggregate_observations`, as a `dict` of the columns:
+        nadir (index of `nadir_xy`), radius, min, max, mean, count, rough
+
+    There is a row for each nadir and radius with at least one observation.
+    NaN values are counted but otherwise ignored like NULLs, which are
+    selected as NaN, so the other aggregates are NaN if every value is NaN.
+    PostgreSQL instead sorts NaN above every number, so a NaN value is the
+    max and mean of the query. Nadirs are queried
+    `nadirs_per_chunk` at a time to limit the number of (nadir, observation)
+    pairs in memory.
+    """
+    require_scipy()
+
+    radii = sorted(radii)
+    tree = cKDTree(observation_xy)
+
+    chunks = []
+
+    for start in range(0, nadir_xy.shape[0], nadirs_per_chunk):
+        chunk_xy = nadir_xy[start:start + nadirs_per_chunk]
+        num_nadirs = chunk_xy.shape[0]
+
+        # every observation within the largest radius
+        neighbours = tree.query_ball_point(chunk_xy, radii[-1])
+        counts = np.array([len(n) for n in neighbours], dtype=int)
+        if not counts.any():
+            continue
+        nadir = np.repeat(np.arange(num_nadirs), counts)
+        observation = np.concatenate(
+            [n for n in neighbours if n]
+        ).astype(int)
+
+        distance = np.hypot(
+            *(observation_xy[observation] - chunk_xy[nadir]).T
+        )
+        values = observation_values[observation]
+
+        # group by nadir with values in descending order like
+        # `PERCENTILE_CONT ... WITHIN GROUP (ORDER BY val DESC)`
+        # NaN values are sorted last
+        order = np.lexsort((-values, nadir))
+        nadir, distance, values = nadir[order], distance[order], values[order]
+        is_value = ~np.isnan(values)
+
+        for radius in radii:
+            inside = distance < radius
+            count = np.bincount(nadir[inside], minlength=num_nadirs)
+
+            valid = inside & is_value
+            valid_nadir = nadir[valid]
+            valid_values = values[valid]
+            valid_count = np.bincount(valid_nadir, minlength=num_nadirs)
+            valid_starts = np.cumsum(valid_count) - valid_count
+
+            has_rows = count > 0
+            has_values = valid_count[has_rows] > 0
+            starts = valid_starts[has_rows][has_values]
+            num_values = valid_count[has_rows][has_values]
+
+            columns = {
+                name: np.full(has_rows.sum(), np.nan)
+                for name in ['min', 'max', 'mean', 'rough']
+            }
+            columns['max'][has_values] = valid_values[starts]
+            columns['min'][has_values] = valid_values[starts + num_values - 1]
+            columns['mean'][has_values] = np.bincount(
+                valid_nadir, valid_values, minlength=num_nadirs
+            )[has_rows][has_values] / num_values
+            columns['rough'][has_values] = percentile_cont_sorted(
+                valid_values, starts, num_values, rough_margin
+            ) - percentile_cont_sorted(
+                valid_values, starts, num_values, 1 - rough_margin
+            )
+
+            columns['nadir'] = np.flatnonzero(has_rows) + start
+            columns['radius'] = np.full(has_rows.sum(), radius)
+            columns['count'] = count[has_rows]
+            chunks.append(columns)
+
+    names = ['nadir', 'radius', 'min', 'max', 'mean', 'count', 'rough']
+
+    if not chunks:
+        return {
+            name: np.empty(0, int if name in ['nadir', 'count'] else float)
+            for name in names
+        }
+
+    aggregates = {
+        name: np.concatenate([chunk[name] for chunk in chunks])
+        for name in names
+    }
+
+    # same row order as the query
+    order = np.lexsort((aggregates['radius'], aggregates['nadir']))
+    return {name: values[order] for name, values in aggregates.items()}
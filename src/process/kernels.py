@@ -0,0 +1,100 @@
+"""
+Compiled kernels of the waveform processing tools
+
+Kernels are compiled with numba when it is installed. Numba is optional, so
+`compiled` is `False` without it and callers use their NumPy implementations
+instead.
+"""
+
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+compiled = numba is not None
+
+
+def _jit(func):
+    if numba is None:
+        return func
+    # numpy error model so a zero division gives inf or NaN like NumPy does
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(func)
+
+
+@_jit
+def _first_max_index(array):
+    # same as `argmax`, the first NaN is the maximum if there is one
+    index_max = 0
+    value_max = array[0]
+    if math.isnan(value_max):
+        return index_max
+    for i in range(1, array.shape[0]):
+        value = array[i]
+        if math.isnan(value):
+            return i
+        if value > value_max:
+            index_max = i
+            value_max = value
+    return index_max
+
+
+@_jit
+def lin_interp_from_first_max_rows(arrays, thresholds, left, out):
+    """
+    `lin_interp_from_first_max` for every row of the 2d float `arrays` and
+    every decimal threshold in the 1d float `thresholds`, written to the
+    (rows, thresholds) float `out` with NaN where it returns `None`. The
+    direction is left if `left` is `True`, otherwise right.
+    """
+    num_rows, num_bins = arrays.shape
+
+    for row in range(num_rows):
+        array = arrays[row]
+        index_peak = _first_max_index(array)
+
+        for t in range(thresholds.shape[0]):
+            threshold = thresholds[t]
+            target_value = array[index_peak] * threshold
+
+            if threshold == 1:
+                out[row, t] = index_peak
+                continue
+
+            if left:
+                if index_peak == 0:
+                    out[row, t] = index_peak
+                    continue
+                index_found = -1
+                for i in range(index_peak - 1, -1, -1):
+                    if array[i] <= target_value:
+                        index_found = i
+                        break
+            else:
+                index_found = -1
+                for i in range(index_peak, num_bins):
+                    if array[i] <= target_value:
+                        index_found = i
+                        break
+
+            if index_found < 0:
+                out[row, t] = np.nan
+                continue
+
+            value_found = array[index_found]
+            if value_found == target_value:
+                out[row, t] = index_found
+                continue
+
+            # negative indices wrap around like they do in NumPy
+            index_prev = index_found + 1 if left else index_found - 1
+            value_prev = array[index_prev]
+            index_gap = (value_prev - target_value) / (
+                    value_prev - value_found)
+
+            if left:
+                out[row, t] = index_prev - index_gap
+            else:
+                out[row, t] = index_prev + index_gap
@@ -0,0 +1,228 @@
+"""
+Parallel processing of waveforms by row shards
+
+Arrays are handed to worker processes through shared memory instead of being
+pickled. Python versions before 3.8 have no `multiprocessing.shared_memory`,
+so temporary memory-mapped files are used instead.
+"""
+
+from typing import Dict, Tuple, Iterator, List
+from concurrent.futures import Executor
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python < 3.8
+    shared_memory = None
+
+from ..load.l1b.mapped import split_record_range
+from ..xtypes import KwargsDict
+from ..logger import empty_logger
+from .tools import calc_waveform_outputs
+
+# shared memory block name or file path, shape, dtype string
+ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+# inputs of `calc_waveform_outputs` in argument order
+waveform_input_keys = [
+    'lin_factor', 'pow2_factor', 'rwc_delay', 'sensor_elvtn', 'waveform'
+]
+
+
+class SharedArrays:
+    """
+    Arrays in memory that other processes can attach to by the `specs` of
+    the arrays.
+
+    Use a context so the memory is released:
+
+        with SharedArrays() as shared:
+            shared.share('values', values)
+            executor.submit(func, shared.specs)
+    """
+
+    def __init__(self):
+        self.specs: Dict[str, ArraySpec] = {}
+        self.arrays: Dict[str, np.ndarray] = {}
+        self._blocks = []
+        self._temp_dir = None
+        if shared_memory is None:
+            self._temp_dir = tempfile.mkdtemp(prefix="shared_arrays_")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def create(self, key: str, shape: Tuple[int, ...], dtype=float) \
+            -> np.ndarray:
+        """
+        Return a new shared array named `key` of `shape` and `dtype`
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(shape)
+
+        if shared_memory is not None:
+            block = shared_memory.SharedMemory(
+                create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1)
+            )
+            self._blocks.append(block)
+            location = block.name
+            array = np.ndarray(shape, dtype, buffer=block.buf)
+        else:
+            location = os.path.join(self._temp_dir, key + ".dat")
+            array = np.memmap(location, dtype, 'w+', shape=shape)
+
+        self.specs[key] = (location, shape, dtype.str)
+        self.arrays[key] = array
+        return array
+
+    def share(self, key: str, array: np.ndarray) -> np.ndarray:
+        """
+        Return a shared copy of `array` named `key`
+        """
+        shared = self.create(key, array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    def close(self):
+        """
+        Release the shared arrays. Views of them must not be used afterwards.
+        """
+        self.arrays.clear()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+
+@contextmanager
+def attach_shared_arrays(specs: Dict[str, ArraySpec]) \
+        -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Context of the arrays of `specs` from `SharedArrays` in another process.
+    Views of the arrays must be released before the context exits.
+    """
+    blocks = []
+    arrays = {}
+
+    for key, (location, shape, dtype) in specs.items():
+        if shared_memory is not None:
+            block = shared_memory.SharedMemory(name=location)
+            blocks.append(block)
+            arrays[key] = np.ndarray(shape, dtype, buffer=block.buf)
+        else:
+            arrays[key] = np.memmap(location, dtype, 'r+', shape=shape)
+
+    try:
+        yield arrays
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def _calc_waveform_rows(
+        arrays: Dict[str, np.ndarray],
+        row_range: Tuple[int, int],
+        calc_kwargs: KwargsDict
+):
+    start, stop = row_range
+    calc_waveform_outputs(
+        *(arrays[key][start:stop] for key in waveform_input_keys),
+        out={
+            key: values[start:stop] for key, values in arrays.items()
+            if key not in waveform_input_keys
+        },
+        **calc_kwargs
+    )
+
+
+def _calc_waveform_shard(
+        specs: Dict[str, ArraySpec],
+        row_range: Tuple[int, int],
+        calc_kwargs: KwargsDict
+):
+    """
+    Worker process task of `calc_waveform_outputs_parallel`
+    """
+    with attach_shared_arrays(specs) as arrays:
+        _calc_waveform_rows(arrays, row_range, calc_kwargs)
+
+
+def calc_waveform_outputs_parallel(
+        executor: Executor,
+        workers: int,
+        lin_factor: np.ndarray,
+        pow2_factor: np.ndarray,
+        rwc_delay: np.ndarray,
+        sensor_elvtn: np.ndarray,
+        waveform: np.ndarray,
+        bin_size: float,
+        retracker_thresholds: List[float],
+        ppeak_indices_left: List[int],
+        ppeak_indices_right: List[int],
+        signal_threshold: float,
+        with_tfmra=True,
+        with_wshape=True,
+        logger=empty_logger()
+) -> Dict[str, np.ndarray]:
+    """
+    `calc_waveform_outputs` with the rows split into `workers` shards that
+    are processed by the process pool `executor`. Inputs and outputs are
+    passed through shared memory and the outputs keep the row order of the
+    inputs.
+    """
+    num_rows, num_bins = waveform.shape
+    row_ranges = split_record_range(0, num_rows, workers)
+
+    calc_kwargs = dict(
+        bin_size=bin_size, retracker_thresholds=list(retracker_thresholds),
+        ppeak_indices_left=list(ppeak_indices_left),
+        ppeak_indices_right=list(ppeak_indices_right),
+        signal_threshold=signal_threshold,
+        with_tfmra=with_tfmra, with_wshape=with_wshape
+    )
+
+    output_shapes = dict(
+        scaled_waveform=(num_rows, num_bins),
+        first_bin_elvtn=(num_rows,)
+    )
+    if with_tfmra:
+        output_shapes['tfmra_elvtns'] = (num_rows, len(retracker_thresholds))
+    if with_wshape:
+        output_shapes['wshape'] = (num_rows, 6)
+
+    if not row_ranges:
+        return calc_waveform_outputs(
+            lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform,
+            **calc_kwargs
+        )
+
+    logger.info(f"processing row ranges {row_ranges} with {workers} workers")
+
+    with SharedArrays() as shared:
+        inputs = [lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform]
+        for key, values in zip(waveform_input_keys, inputs):
+            shared.share(key, np.asarray(values, dtype=float))
+        for key, shape in output_shapes.items():
+            shared.create(key, shape)
+
+        futures = [
+            executor.submit(
+                _calc_waveform_shard, shared.specs, row_range, calc_kwargs
+            )
+            for row_range in row_ranges
+        ]
+        for future in futures:
+            future.result()
+
+        # copy out of shared memory before it is released
+        return {key: np.array(shared.arrays[key]) for key in output_shapes}
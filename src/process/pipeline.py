@@ -0,0 +1,237 @@
+"""
+Processing steps as a graph of the tables they read and create
+
+Steps declare their input and output tables, so the order they run in and
+which of them can run at the same time follow from the tables instead of the
+order they are written in.
+"""
+
+from typing import Optional, Iterable, Callable, Any, List, Dict, Set
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ..postgis.xtypes import Table
+from .process import Process
+
+
+class Step:
+    """
+    Processing step `name` that calls `run` with a `Process` to create the
+    `outputs` tables from the `inputs` tables
+    """
+
+    def __init__(
+            self,
+            name: str,
+            run: Callable[[Process], Any],
+            inputs: Iterable[Table] = (),
+            outputs: Iterable[Table] = ()
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __repr__(self):
+        return f"Step({self.name!r}, {self.inputs} -> {self.outputs})"
+
+
+class Pipeline:
+    """
+    Graph of `Step` objects connected by their tables. Inputs that no step
+    creates are tables that already exist, such as from an earlier run.
+
+        pipeline = Pipeline()
+        pipeline.add(
+            "Refine ASIRAS", lambda p: p.create_table_from_query(...),
+            inputs=[TABLE.asr_src, TABLE.mgn_src],
+            outputs=[TABLE.asr_refined]
+        )
+        pipeline.run(process, targets=[TABLE.asr_refined], workers=4)
+    """
+
+    def __init__(self):
+        self.steps: List[Step] = []
+        # step creating each table
+        self._producers: Dict[Table, Step] = {}
+
+    def add(
+            self,
+            name: str,
+            run: Callable[[Process], Any],
+            inputs: Iterable[Table] = (),
+            outputs: Iterable[Table] = ()
+    ) -> Step:
+        """
+        Add and return the step `name`, see `Step`
+        """
+        step = Step(name, run, inputs, outputs)
+
+        for table in step.outputs:
+            if table in self._producers:
+                raise ValueError(
+                    f"Table {table} is created by both "
+                    f"'{self._producers[table].name}' and '{name}'"
+                )
+            self._producers[table] = step
+
+        self.steps.append(step)
+        return step
+
+    def dependencies(self, step: Step) -> List[Step]:
+        """
+        Return the steps that create the inputs of `step`
+        """
+        dependencies = []
+        for table in step.inputs:
+            producer = self._producers.get(table)
+            if producer is not None and producer not in dependencies:
+                dependencies.append(producer)
+        return dependencies
+
+    def select(
+            self,
+            targets: Optional[Iterable[Table]] = None,
+            table_exists: Optional[Callable[[Table], bool]] = None
+    ) -> List[Step]:
+        """
+        Return the steps needed to create the `targets` tables in the order
+        they were added, which are the steps creating them and their
+        ancestors. By default the targets are the tables no step reads and
+        steps without outputs.
+
+        If `table_exists` is given then the ancestors of a step whose outputs
+        all exist are not needed for it, like steps skip themselves when
+        their tables exist.
+        """
+        if targets is None:
+            read = {table for step in self.steps for table in step.inputs}
+            pending = [
+                step for step in self.steps
+                if not step.outputs or
+                any(table not in read for table in step.outputs)
+            ]
+        else:
+            pending = []
+            for table in targets:
+                if table not in self._producers:
+                    raise ValueError(f"No step creates table {table}")
+                pending.append(self._producers[table])
+
+        selected: Set[int] = set()
+
+        while pending:
+            step = pending.pop()
+            if id(step) in selected:
+                continue
+            selected.add(id(step))
+
+            if table_exists is not None and \
+                    all(table_exists(table) for table in step.outputs):
+                continue
+            pending.extend(self.dependencies(step))
+
+        return [step for step in self.steps if id(step) in selected]
+
+    def order(self, steps: Optional[List[Step]] = None) -> List[Step]:
+        """
+        Return `steps` (default every step) sorted so that each step comes
+        after the steps creating its inputs. Steps that do not depend on each
+        other keep the order they were added.
+        """
+        steps = self.steps if steps is None else steps
+        included = {id(step) for step in steps}
+        ordered = []
+        visiting: Set[int] = set()
+        done: Set[int] = set()
+
+        def visit(step: Step):
+            if id(step) in done:
+                return
+            if id(step) in visiting:
+                raise ValueError(f"Steps depend on each other at {step}")
+            visiting.add(id(step))
+            for dependency in self.dependencies(step):
+                if id(dependency) in included:
+                    visit(dependency)
+            visiting.remove(id(step))
+            done.add(id(step))
+            ordered.append(step)
+
+        for step in steps:
+            visit(step)
+
+        return ordered
+
+    def run(
+            self,
+            process: Process,
+            targets: Optional[Iterable[Table]] = None,
+            workers=1
+    ):
+        """
+        Run the steps needed for `targets` (default every step) with
+        `process`. With more than one worker, steps run as soon as the steps
+        they depend on have finished, on up to `workers` threads with
+        separate connections, see `Process.run_on_new_session`.
+
+        Steps that have not started when a step fails are not run and the
+        error is raised once the running steps have finished. Their tables
+        are skipped on the next run if they exist.
+        """
+        logger = process.context_logger("Pipeline")
+
+        # with lineage tracked every step checks if its table is current
+        table_exists = None if process.track_lineage else \
+            process.session.table_exists
+        steps = self.order(self.select(targets, table_exists))
+
+        logger.info(
+            f"running {len(steps)} steps with {workers} workers: "
+            f"{[step.name for step in steps]}"
+        )
+
+        if workers <= 1:
+            for step in steps:
+                logger.info(f"running step '{step.name}'")
+                step.run(process)
+            return
+
+        process.prepare_concurrent_steps()
+
+        waiting = {
+            id(step): {
+                id(dependency) for dependency in self.dependencies(step)
+                if dependency in steps
+            }
+            for step in steps
+        }
+        remaining = list(steps)
+        running = {}
+
+        with ThreadPoolExecutor(workers) as executor:
+            while remaining or running:
+                # submit every step whose dependencies have finished
+                for step in [s for s in remaining if not waiting[id(s)]]:
+                    logger.info(f"running step '{step.name}'")
+                    future = executor.submit(
+                        process.run_on_new_session, step.run
+                    )
+                    running[future] = step
+                    remaining.remove(step)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    step = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.error(
+                            f"step '{step.name}' failed, waiting for "
+                            f"{[s.name for s in running.values()]}"
+                        )
+                        wait(running)
+                        raise error
+
+                    logger.info(f"finished step '{step.name}'")
+                    for dependencies in waiting.values():
+                        dependencies.discard(id(step))
@@ -1,6 +1,10 @@
-from typing import Optional, ContextManager, List, Iterable, Dict
-from contextlib import contextmanager
+from typing import Optional, ContextManager, List, Iterable, Dict, \
+    Iterator, Tuple, Callable, Any
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+import hashlib
+import json
 import numpy as np
 import pandas as pd
 import logging
@@ -10,7 +14,7 @@ from . import queries
 from ..xtypes import KwargsDict
 from ..postgis.xtypes import Table, IndexColumns, OmniColumns, Query, \
     ColumnConfigDict
-from ..config import DEFAULT, COL, PARAM
+from ..config import DEFAULT, TABLE, COL, PARAM
 from ..logger import ContextLoggable, empty_logger_hub
 from ..postgis import Session, ResultFormat
 from ..postgis.tools import \
@@ -20,13 +24,18 @@ from ..postgis.tools import \
     union_sql_blocks, \
     column_config_dict_to_list
 from ..load.l1b import AsirasLoader, AlsLoader
+from ..load.l1b.cache import ColumnCache, content_key, file_digest
 from .tools import \
-    lin_interp_from_first_max, \
-    InterpolateDirection, \
+    WaveformStorage, \
+    compact_waveforms, \
     calc_scaled_waveform, \
-    calc_tfmra_elevation, \
     calc_first_bin_elvtn, \
-    aggregate_relative_indices
+    calc_tfmra_elevation, \
+    calc_waveform_shape, \
+    calc_waveform_outputs
+from .parallel import calc_waveform_outputs_parallel
+from .aggregate import AggregationEngine, aggregate_to_radii, require_scipy
+from .profiling import StepProfiler, profiled_step, report_columns
 
 
 class Process:
@@ -36,10 +45,25 @@ class Process:
             name: str,
             session: Session,
             logger_hub=empty_logger_hub(),
+            track_lineage=False,
+            lineage_table=TABLE.table_lineage,
+            profiler: Optional[StepProfiler] = None
     ):
         self.name = name
         self.session = session
         self.logger_hub = logger_hub
+        # rebuild existing tables whose inputs or parameters changed, see
+        # `_lineage`
+        self.track_lineage = track_lineage
+        self.lineage_table = lineage_table
+        # records the steps decorated by `profiled_step` if given
+        self.profiler = profiler
+        self._profile_depth = 0
+        # (waveform_id, scaled_waveform, first_bin_elvtn) by the arguments of
+        # `scaled_waveforms` that determine them
+        self._scaled_waveform_cache: Dict[
+            Tuple, Tuple[np.ndarray, np.ndarray, np.ndarray]
+        ] = {}
 
     def context_logger(self, context_name: str) -> logging.Logger:
         return self.logger_hub.context(context_name)
@@ -71,6 +95,244 @@ class Process:
             logger.info(f"creating index on columns{columns}")
             self.session.create_simple_index(table_name, columns)
 
+    def _create_lineage_table(self):
+        self.session.execute_query(self.session.format_query(
+            queries.create_lineage_table, None,
+            dict(lineage=self.lineage_table)
+        ))
+
+    def _lineage(
+            self,
+            query: Optional[Query],
+            input_tables: Iterable[Table],
+            **options
+    ) -> Optional[str]:
+        """
+        Return a hash of how a table is built from the formatted `query`, the
+        fingerprints of `input_tables` and the other build `options`, or
+        `None` if lineage is not tracked. The query text includes its
+        arguments and parameters.
+
+        The fingerprint of a table is its own lineage hash if it has one, so a
+        rebuilt table changes the lineage of the tables built from it only if
+        it was built differently. Tables without one, such as the loaded
+        inputs, are fingerprinted by their OID, which changes when they are
+        recreated.
+        """
+        if not self.track_lineage:
+            return None
+
+        self._create_lineage_table()
+
+        tables = sorted({
+            self.session.qualified_table(table) for table in input_tables
+        })
+        fingerprints = []
+        if tables:
+            fingerprints = self.session.execute_query(
+                self.session.format_query(
+                    queries.table_fingerprints, None,
+                    dict(lineage=self.lineage_table, tables=tables)
+                ),
+                fetch=True, result_format=ResultFormat.LIST
+            )
+
+        lineage = dict(
+            query=self.session.query_string(query) if query else None,
+            inputs=[list(row) for row in fingerprints],
+            options=options
+        )
+        return hashlib.sha256(
+            json.dumps(lineage, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _build_required(
+            self,
+            logger: ContextLoggable,
+            output_table: Table,
+            lineage: Optional[str]
+    ) -> bool:
+        """
+        Return whether `output_table` has to be built. An existing table is
+        dropped to be rebuilt if `lineage` differs from its recorded lineage,
+        which includes tables without a record.
+        """
+        if not self.session.table_exists(output_table):
+            return True
+
+        if lineage is None or \
+                lineage == self._recorded_lineage(output_table):
+            self._log_table_exists(logger, output_table)
+            return False
+
+        logger.info(
+            f"Inputs or parameters of table {output_table} changed. "
+            f"Rebuilding it."
+        )
+        self.session.drop_table(output_table)
+        return True
+
+    def _recorded_lineage(self, output_table: Table) -> Optional[str]:
+        return self.session.execute_query(
+            self.session.format_query(
+                queries.recorded_lineage, None,
+                dict(
+                    lineage=self.lineage_table,
+                    table_name=self.session.qualified_table(output_table)
+                )
+            ),
+            fetch=True, single_response=True
+        )
+
+    def _record_lineage(self, output_table: Table, lineage: Optional[str]):
+        if lineage is None:
+            return
+        self.session.execute_query(self.session.format_query(
+            queries.record_lineage, None,
+            dict(
+                lineage=self.lineage_table,
+                table_name=self.session.qualified_table(output_table),
+                lineage_hash=lineage
+            )
+        ))
+
+    def run_concurrently(
+            self,
+            *steps: Callable[['Process'], Any],
+            workers: Optional[int] = None
+    ) -> List[Any]:
+        """
+        Run independent `steps` at the same time on up to `workers` threads
+        (default one per step) and return their results in order. Each step
+        is called with a new `Process` whose session has its own connection,
+        which is committed when the step finishes and then closed.
+
+        Steps must not depend on each other's tables. The session of this
+        process is committed first so that the steps see its changes:
+
+            process.run_concurrently(
+                lambda p: p.load_csv("A", path_a, table_a, col_config_a),
+                lambda p: p.load_csv("B", path_b, table_b, col_config_b)
+            )
+        """
+        logger = self.context_logger("Concurrent Steps")
+
+        if not steps:
+            return []
+
+        self.prepare_concurrent_steps()
+
+        workers = workers or len(steps)
+        logger.info(f"running {len(steps)} steps on {workers} connections")
+
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(self.run_on_new_session, step)
+                for step in steps
+            ]
+            return [future.result() for future in futures]
+
+    def prepare_concurrent_steps(self):
+        """
+        Commit the session of this process so that steps run by
+        `run_on_new_session` see its changes
+        """
+        # created once so that the steps do not race to create it
+        if self.track_lineage:
+            self._create_lineage_table()
+        self.session.commit()
+
+    def run_on_new_session(self, step: Callable[['Process'], Any]) -> Any:
+        """
+        Return the result of calling `step` with a new `Process` whose
+        session has its own connection, which is committed when the step
+        finishes and then closed. Safe to call from another thread.
+        """
+        session = self.session.clone()
+        try:
+            result = step(Process(
+                self.name, session, self.logger_hub,
+                self.track_lineage, self.lineage_table, self.profiler
+            ))
+            session.commit()
+            return result
+        finally:
+            session.close()
+
+    def write_profile(
+            self,
+            report_dir: Optional[str] = None,
+            history_table: Table = TABLE.run_history
+    ):
+        """
+        Append the step records of `profiler` to `history_table` and write
+        them to JSON and CSV reports in `report_dir` if it is given. The
+        records are written on a new connection in case the transaction of
+        this session failed.
+        """
+        logger = self.context_logger("Profile")
+
+        if self.profiler is None:
+            raise ValueError("process has no profiler")
+
+        if report_dir:
+            paths = self.profiler.write_reports(report_dir)
+            logger.info(f"wrote step profile reports {paths}")
+
+        session = self.session.clone()
+        try:
+            session.execute_query(session.format_query(
+                queries.create_run_history_table, None,
+                dict(history=history_table)
+            ))
+            session.insert(history_table, self.profiler.rows(), report_columns)
+            session.commit()
+        finally:
+            session.close()
+
+        logger.info(
+            f"recorded {len(self.profiler.records)} steps of run "
+            f"{self.profiler.run_id} in {history_table}"
+        )
+
+    def write_query_plans(self, plan_table: Table = TABLE.query_plans):
+        """
+        Log the warnings of the plans captured by the session and append the
+        plans to `plan_table` with the step that ran them, on a new
+        connection in case the transaction of this session failed
+        """
+        logger = self.context_logger("Query Plans")
+        plans = list(self.session.captured_plans)
+
+        for plan in plans:
+            for warning in plan['warnings']:
+                logger.warning(f"{plan['label']}: {warning}")
+
+        rows = [
+            [
+                plan['captured_at'], self.name, plan['label'], plan['query'],
+                json.dumps(plan['plan']), plan['execution_ms'],
+                plan['warnings']
+            ]
+            for plan in plans
+        ]
+
+        session = self.session.clone()
+        try:
+            session.execute_query(session.format_query(
+                queries.create_query_plans_table, None,
+                dict(plans=plan_table)
+            ))
+            session.insert(plan_table, rows, [
+                'captured_at', 'process', 'step', 'query', 'plan',
+                'execution_ms', 'warnings'
+            ])
+            session.commit()
+        finally:
+            session.close()
+
+        logger.info(f"recorded {len(rows)} query plans in {plan_table}")
+
     def drop_table_if_exist(
             self,
             *tables: Table
@@ -128,6 +390,19 @@ class Process:
         }
         return self.session.format_query(query, None, format_kwargs)
 
+    def _query_tables(
+            self,
+            query: str,
+            main_kwargs: Optional[KwargsDict] = None,
+            base_query_kwargs: Optional[KwargsDict] = None,
+            fallback_base_query_kwargs=DEFAULT.base_query_kwargs
+    ) -> List[Table]:
+        return self.session.query_tables(query, {
+            **(base_query_kwargs or fallback_base_query_kwargs),
+            **(main_kwargs or {})
+        })
+
+    @profiled_step('output_table', context_arg='context_name')
     def create_table_from_query(
             self,
             context_name: str,
@@ -146,14 +421,22 @@ class Process:
         if msg:
             logger.info(msg)
 
-        if not self.session.table_exists(output_table):
+        formatted_query = self.format_query_with_base_args(
+            query, kwargs, base_query_kwargs
+        )
+        lineage = self._lineage(
+            formatted_query,
+            self._query_tables(query, kwargs, base_query_kwargs),
+            spatial_index=spatial_index, primary_key_cols=primary_key_cols,
+            simple_index_cols=simple_index_cols, temp=temp
+        )
 
-            formatted_query = self.format_query_with_base_args(
-                query, kwargs, base_query_kwargs
-            )
+        if self._build_required(logger, output_table, lineage):
 
             logger.info(f"Creating table {output_table}")
-            self.session.create_table_as(output_table, formatted_query, temp)
+            self.session.create_table_as(
+                output_table, formatted_query, temp, plan_label=context_name
+            )
 
             if spatial_index:
                 logger.info(
@@ -176,11 +459,12 @@ class Process:
                     simple_index_cols
                 )
 
+            self._record_lineage(output_table, lineage)
+
             if autocommit:
                 self.session.commit()
-        else:
-            self._log_table_exists(logger, output_table)
 
+    @profiled_step(context_arg='context_name')
     def execute_query(
             self,
             context_name: str,
@@ -204,6 +488,7 @@ class Process:
         if autocommit:
             self.session.commit()
 
+    @profiled_step('output_table')
     def load_asiras(
             self,
             file_path: str, output_table: Table,
@@ -214,7 +499,8 @@ class Process:
             srid_output: int,
             col_geom_name=COL.geom,
             loader_kwargs: Optional[KwargsDict] = None,
-            extract_kwargs: Optional[KwargsDict] = None
+            extract_kwargs: Optional[KwargsDict] = None,
+            workers=1
     ):
         logger = self.context_logger('Load ASIRAS')
 
@@ -229,7 +515,7 @@ class Process:
             )
             loader.extract_to_database(
                 self.session, file_path, output_table, col_id_name,
-                **(extract_kwargs or {})
+                workers=workers, **(extract_kwargs or {})
             )
             self.session.commit()
         else:
@@ -241,6 +527,7 @@ class Process:
             srid_input, srid_output, col_geom_name
         )
 
+    @profiled_step('output_table')
     def load_als(
             self,
             file_path: str, output_table: Table,
@@ -248,7 +535,8 @@ class Process:
             col_elvtn_name: str,
             output_srid: int,
             col_geom_name=COL.geom,
-            extract_kwargs: Optional[KwargsDict] = None
+            extract_kwargs: Optional[KwargsDict] = None,
+            workers=1
     ):
         logger = self.context_logger('Load ALS')
 
@@ -261,7 +549,7 @@ class Process:
             loader.extract_to_database(
                 self.session, file_path, output_table,
                 col_id_name, col_elvtn_name, col_geom_name, output_srid,
-                **(extract_kwargs or {})
+                workers=workers, **(extract_kwargs or {})
             )
             logger.info(
                 f"Creating spatial index on columns {col_geom_name}"
@@ -271,6 +559,7 @@ class Process:
         else:
             self._log_table_exists(logger, output_table)
 
+    @profiled_step('output_table', context_arg='dataset_name')
     def load_csv(
             self,
             dataset_name: str,
@@ -301,6 +590,7 @@ class Process:
         else:
             self._log_table_exists(logger, output_table)
 
+    @profiled_step('output_table', context_arg='dataset_name')
     def load_csv_with_xy(
             self,
             dataset_name: str,
@@ -329,6 +619,7 @@ class Process:
             srid_input, srid_output, col_geom_name
         )
 
+    @profiled_step('output_table', context_arg='dataset_name')
     def load_shp(
             self,
             dataset_name: str,
@@ -359,6 +650,7 @@ class Process:
         else:
             self._log_table_exists(logger, output_table)
 
+    @profiled_step('output_table')
     def create_asiras_footprints(
             self,
             output_table: Table,
@@ -386,6 +678,118 @@ class Process:
             simple_index_cols=simple_index_columns
         )
 
+    @profiled_step('output_table', context_arg='context_name')
+    def aggregate_observations(
+            self,
+            context_name: str,
+            output_table: Table,
+            kwargs: KwargsDict,
+            engine=AggregationEngine.POLYGON,
+            simple_index_cols=(COL.id_asr, COL.fp_size),
+            footprint_radii=PARAM.fp_radii,
+            rough_margin=PARAM.rough_margin,
+            nadirs_per_chunk=1000
+    ):
+        """
+        Create table `output_table` of the observations aggregated to each
+        ASIRAS footprint, formatting the query of `engine` with `kwargs`.
+        See `queries.aggregate_observations` for `kwargs`; the `KDTREE`
+        engine also needs the table of ASIRAS nadirs `nadir`.
+
+        The `KDTREE` engine aggregates circular footprints of
+        `footprint_radii` on the client with `aggregate_to_radii` and needs
+        scipy. The radar footprints are still aggregated in PostGIS by
+        `queries.aggregate_observations_radar`. NaN observation values are
+        ignored like NULLs on the client, whereas the queries use them as
+        numbers. The tables of every engine have the same columns.
+        """
+        if engine == AggregationEngine.POLYGON:
+            query = queries.aggregate_observations
+        elif engine == AggregationEngine.KDTREE:
+            require_scipy()
+            query = queries.aggregate_observations_radar
+        else:
+            raise ValueError("invalid `engine`")
+
+        if engine != AggregationEngine.KDTREE:
+            self.create_table_from_query(
+                context_name, output_table, query, kwargs,
+                simple_index_cols=simple_index_cols
+            )
+            return
+
+        logger = self.context_logger(context_name)
+
+        client_queries = [
+            query, queries.nadir_coordinates, queries.observation_values
+        ]
+        lineage = self._lineage(
+            pgs.Composed([
+                self.format_query_with_base_args(q, kwargs)
+                for q in client_queries
+            ]),
+            [
+                table for q in client_queries
+                for table in self._query_tables(q, kwargs)
+            ],
+            engine=engine.value, footprint_radii=list(footprint_radii),
+            rough_margin=rough_margin, simple_index_cols=simple_index_cols
+        )
+
+        if not self._build_required(logger, output_table, lineage):
+            return
+
+        # radar footprints are not circular so they are still aggregated in
+        # PostGIS, which also gives the table the columns of the query
+        self.create_table_from_query(
+            context_name, output_table, query, kwargs, autocommit=False
+        )
+
+        nadirs = self.session.execute_query(
+            self.format_query_with_base_args(
+                queries.nadir_coordinates, kwargs
+            ),
+            True, ResultFormat.NUMPY
+        )
+        observations = self.session.execute_query(
+            self.format_query_with_base_args(
+                queries.observation_values, kwargs
+            ),
+            True, ResultFormat.NUMPY
+        )
+
+        logger.info(
+            f"aggregating {len(observations['val'])} observations to "
+            f"{len(nadirs['x'])} nadirs"
+        )
+        aggregates = aggregate_to_radii(
+            np.column_stack([nadirs['x'], nadirs['y']]),
+            np.column_stack([observations['x'], observations['y']]),
+            observations['val'], footprint_radii, rough_margin,
+            nadirs_per_chunk
+        )
+
+        # aggregates of only NaN values are NULL
+        value_cols = [
+            [None if np.isnan(v) else v for v in aggregates[name].tolist()]
+            for name in ['min', 'max', 'mean']
+        ]
+        rows = zip(
+            nadirs[COL.id_asr][aggregates['nadir']].tolist(),
+            aggregates['radius'].tolist(),
+            *value_cols,
+            aggregates['count'].tolist(),
+            [None if np.isnan(v) else v for v in aggregates['rough'].tolist()]
+        )
+
+        logger.info(f"writing to output table {output_table}")
+        self.session.insert(output_table, rows, use_copy=True)
+
+        self._simple_index_on_cols(logger, output_table, simple_index_cols)
+        self._record_lineage(output_table, lineage)
+        self.session.commit()
+
+    @profiled_step('out_table')
     def combine_aggregated_measurements(
             self,
             out_table: Table,
@@ -395,8 +799,13 @@ class Process:
     ):
         logger = self.context_logger("Combine Aggr.")
 
-        if self.session.table_exists(out_table):
-            self._log_table_exists(logger, out_table)
+        lineage = self._lineage(
+            None, join_tables, join_tables=list(join_tables),
+            join_columns=list(join_columns),
+            simple_index_columns=list(simple_index_columns)
+        )
+
+        if not self._build_required(logger, out_table, lineage):
             return
 
         logger.info(f"Creating table {out_table}")
@@ -405,7 +814,9 @@ class Process:
         )
 
         self._simple_index_on_cols(logger, out_table, simple_index_columns)
+        self._record_lineage(out_table, lineage)
 
+    @profiled_step('tfmra_table', 'wshape_table', 'wscaled_table')
     def waveform_processing(
             self,
             tfmra_table: Table,
@@ -428,8 +839,44 @@ class Process:
             waveform_col=COL.ml_power_echo,
             tfmra_simple_index_cols=(COL.id_asr, COL.tfmra_threshold),
             wshape_simple_index_cols=(COL.id_asr,),
-            wscaled_simple_index_cols=(COL.id_asr,)
+            wscaled_simple_index_cols=(COL.id_asr,),
+            source_file: Optional[str] = None,
+            loader_kwargs: Optional[KwargsDict] = None,
+            read_kwargs: Optional[KwargsDict] = None,
+            chunk_size: Optional[int] = None,
+            workers=1,
+            scaled_cache_dir: Optional[str] = None,
+            wscaled_storage=WaveformStorage.FULL,
+            wscaled_window_bins=PARAM.wscaled_window_bins
     ):
+        """
+        Create the TFMRA, waveform shape and scaled waveform tables from the
+        ASIRAS waveforms in `waveform_table`. See `create_wscaled_table` for
+        `wscaled_storage` and `wscaled_window_bins`.
+
+        If `source_file` is given, the waveform columns are decoded from that
+        ASIRAS file instead of being selected from `waveform_table`, and ids
+        are matched by row order. `waveform_table` must have been loaded
+        from the whole file.
+
+        If `chunk_size` is given, waveforms are read, processed and written
+        to the output tables `chunk_size` at a time, so memory use is bound
+        by the chunk size instead of the number of waveforms. Chunks of
+        `source_file` are rounded down to whole blocks of the file.
+
+        If `workers` is more than 1, the waveforms (of each chunk) are split
+        by row across that many processes, which share the arrays through
+        shared memory.
+
+        If `scaled_cache_dir` is given and `chunk_size` is not, the scaled
+        waveforms and first bin elevations are read from or written to an
+        on-disk cache in that folder, see `scaled_waveforms`. TFMRA and
+        waveform shape are then calculated from the cache in this process.
+
+        With lineage tracked, each output table is rebuilt when
+        `waveform_table` or the parameters that table is calculated from have
+        changed, see `_lineage`.
+        """
         logger = self.context_logger("Waveform Processing")
 
         output_tables = [
@@ -438,65 +885,697 @@ class Process:
             wscaled_table
         ]
 
+        cols_to_read = [
+            waveform_id_col, linear_scale_factor_col, power2_scale_factor_col,
+            rwc_delay_col, sensor_elvtn_col, waveform_col
+        ]
+
+        # every table depends on the waveforms and how they are read
+        read_options = dict(
+            cols_to_read=cols_to_read, source_file=source_file,
+            loader_kwargs=loader_kwargs
+        )
+        lineages = [
+            self._lineage(
+                None, [waveform_table], col_config=tfmra_col_config,
+                retracker_thresholds=list(retracker_thresholds),
+                bin_size=bin_size, **read_options
+            ),
+            self._lineage(
+                None, [waveform_table], col_config=wshape_col_config,
+                ppeak_indices_left=list(ppeak_indices_left),
+                ppeak_indices_right=list(ppeak_indices_right),
+                signal_threshold=signal_threshold, bin_size=bin_size,
+                **read_options
+            ),
+            self._lineage(
+                None, [waveform_table], col_config=wscaled_col_config,
+                wscaled_storage=wscaled_storage,
+                wscaled_window_bins=wscaled_window_bins, **read_options
+            )
+        ]
+
+        # tables that are out of date are dropped
         output_tables_exist = [
-            self.session.table_exists(t) for t in output_tables
+            not self._build_required(logger, table, lineage)
+            for table, lineage in zip(output_tables, lineages)
         ]
 
         # skip if all tables exist
-        if not output_tables_exist or all(output_tables_exist):
+        if all(output_tables_exist):
             logger.debug(f"all output table exist: {output_tables}")
             return
 
-        logger.info(f"reading data from {waveform_table}")
+        calc_kwargs = dict(
+            bin_size=bin_size, retracker_thresholds=retracker_thresholds,
+            ppeak_indices_left=ppeak_indices_left,
+            ppeak_indices_right=ppeak_indices_right,
+            signal_threshold=signal_threshold,
+            with_tfmra=not output_tables_exist[0],
+            with_wshape=not output_tables_exist[1]
+        )
 
-        cols_to_read = [
-            waveform_id_col, linear_scale_factor_col, power2_scale_factor_col,
-            rwc_delay_col, sensor_elvtn_col, waveform_col
-        ]
+        executor_context = ProcessPoolExecutor(workers) if workers > 1 \
+            else nullcontext()
+
+        with executor_context as executor:
+            self._waveform_processing(
+                logger, output_tables, output_tables_exist,
+                tfmra_col_config, wshape_col_config, wscaled_col_config,
+                tfmra_simple_index_cols, wshape_simple_index_cols,
+                wscaled_simple_index_cols, waveform_table, cols_to_read,
+                retracker_thresholds, bin_size, calc_kwargs,
+                source_file, loader_kwargs, read_kwargs, chunk_size,
+                executor, workers, scaled_cache_dir, wscaled_storage,
+                wscaled_window_bins
+            )
 
-        read_cols = self.session.select(
-            waveform_table, cols_to_read, result_format=ResultFormat.LIST,
-            as_cols=True
-        )
+        for table, lineage, exists in zip(
+                output_tables, lineages, output_tables_exist
+        ):
+            if not exists:
+                self._record_lineage(table, lineage)
+        self.session.commit()
 
-        # read the waveform_id column as integer and the rest as numpy floats
-        waveform_id = np.array(read_cols[0], dtype=int)
+    def _calc_waveform_outputs(
+            self,
+            logger: ContextLoggable,
+            read_cols: List,
+            calc_kwargs: KwargsDict,
+            executor: Optional[ProcessPoolExecutor] = None,
+            workers=1
+    ) -> Dict[str, np.ndarray]:
+        """
+        Return the `calc_waveform_outputs` of the columns `read_cols`, split
+        across `executor` if given
+        """
+        # read as numpy floats
         # each row (item) in attribute is a single ASIRAS observation
         # each column in waveform is a range bin
         lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform = \
-            [np.array(col, dtype=float) for col in read_cols[1:]]
-
-        # number of range bins in waveform
-        num_bins = waveform.shape[1]
+            [np.asarray(col, dtype=float) for col in read_cols]
 
-        # scale waveform to remove effects of gains and attenuations
-        scaled_waveform = calc_scaled_waveform(
-            waveform, lin_factor, pow2_factor, logger
+        if executor is None:
+            return calc_waveform_outputs(
+                lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform,
+                logger=logger, **calc_kwargs
+            )
+        return calc_waveform_outputs_parallel(
+            executor, workers,
+            lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform,
+            logger=logger, **calc_kwargs
         )
 
-        # elevation of first range bin
-        first_bin_elvtn = calc_first_bin_elvtn(
-            bin_size, rwc_delay, sensor_elvtn, num_bins, logger
-        )
+    def _waveform_processing(
+            self,
+            logger: ContextLoggable,
+            output_tables: List[Table],
+            output_tables_exist: List[bool],
+            tfmra_col_config: ColumnConfigDict,
+            wshape_col_config: ColumnConfigDict,
+            wscaled_col_config: ColumnConfigDict,
+            tfmra_simple_index_cols: List[str],
+            wshape_simple_index_cols: List[str],
+            wscaled_simple_index_cols: List[str],
+            waveform_table: Table,
+            cols_to_read: List[str],
+            retracker_thresholds: List[float],
+            bin_size: float,
+            calc_kwargs: KwargsDict,
+            source_file: Optional[str],
+            loader_kwargs: Optional[KwargsDict],
+            read_kwargs: Optional[KwargsDict],
+            chunk_size: Optional[int],
+            executor: Optional[ProcessPoolExecutor],
+            workers: int,
+            scaled_cache_dir: Optional[str] = None,
+            wscaled_storage=WaveformStorage.FULL,
+            wscaled_window_bins=PARAM.wscaled_window_bins
+    ):
+        """
+        Body of `waveform_processing` once the output tables to create and
+        the process pool are known
+        """
+        tfmra_table, wshape_table, wscaled_table = output_tables
+
+        if chunk_size is not None:
+            # build rows of each missing output table from the waveform ids
+            # and `calc_waveform_outputs` of a chunk
+            outputs = [
+                (table, col_config, index_cols, build_rows)
+                for table, col_config, index_cols, build_rows, exists in zip(
+                    output_tables,
+                    [tfmra_col_config, wshape_col_config, wscaled_col_config],
+                    [tfmra_simple_index_cols, wshape_simple_index_cols,
+                     wscaled_simple_index_cols],
+                    [
+                        lambda ids, results: self._tfmra_rows(
+                            ids, retracker_thresholds, results['tfmra_elvtns']
+                        ),
+                        lambda ids, results: self._wshape_rows(
+                            ids, results['wshape']
+                        ),
+                        lambda ids, results: self._wscaled_rows(
+                            ids, results['scaled_waveform'], wscaled_storage,
+                            wscaled_window_bins
+                        )
+                    ],
+                    output_tables_exist
+                )
+                if not exists
+            ]
+            self._waveform_processing_chunked(
+                logger, outputs,
+                self._waveform_chunks(
+                    logger, waveform_table, cols_to_read, chunk_size,
+                    source_file, loader_kwargs, read_kwargs
+                ),
+                lambda read_cols: self._calc_waveform_outputs(
+                    logger, read_cols, calc_kwargs, executor, workers
+                )
+            )
+            return
+
+        if scaled_cache_dir is not None:
+            # the remaining outputs are calculated by each `create_*_table`
+            results = {}
+            waveform_id, scaled_waveform, first_bin_elvtn = \
+                self.scaled_waveforms(
+                    waveform_table, bin_size, *cols_to_read,
+                    source_file=source_file, loader_kwargs=loader_kwargs,
+                    read_kwargs=read_kwargs, cache_dir=scaled_cache_dir
+                )
+        else:
+            waveform_id, read_cols = self._read_waveform_columns(
+                logger, waveform_table, cols_to_read, source_file,
+                loader_kwargs, read_kwargs
+            )
+
+            results = self._calc_waveform_outputs(
+                logger, read_cols, calc_kwargs, executor, workers
+            )
+            scaled_waveform = results['scaled_waveform']
+            first_bin_elvtn = results['first_bin_elvtn']
 
         self.create_tfmra_table(
             tfmra_table, tfmra_col_config,
             scaled_waveform, first_bin_elvtn, waveform_id,
             retracker_thresholds, bin_size,
-            tfmra_simple_index_cols
+            tfmra_simple_index_cols,
+            tfmra_elvtns=results.get('tfmra_elvtns')
         )
 
         self.create_wshape_table(
             wshape_table, wshape_col_config,
             scaled_waveform, waveform_id,
-            ppeak_indices_left, ppeak_indices_right, bin_size, signal_threshold,
-            wshape_simple_index_cols
+            calc_kwargs['ppeak_indices_left'],
+            calc_kwargs['ppeak_indices_right'], bin_size,
+            calc_kwargs['signal_threshold'],
+            wshape_simple_index_cols,
+            wshape=results.get('wshape')
         )
 
         self.create_wscaled_table(
             wscaled_table, wscaled_col_config,
             waveform_id, scaled_waveform,
-            wscaled_simple_index_cols
+            wscaled_simple_index_cols,
+            wscaled_storage, wscaled_window_bins
+        )
+
+    @profiled_step('tfmra_table')
+    def sweep_tfmra_thresholds(
+            self,
+            tfmra_table: Table,
+            tfmra_col_config: ColumnConfigDict,
+            waveform_table: Table,
+            retracker_thresholds: Iterable[float],
+            bin_size=PARAM.bin_size,
+            threshold_col=COL.tfmra_threshold,
+            tfmra_simple_index_cols=(COL.id_asr, COL.tfmra_threshold),
+            threshold_decimals=6,
+            **scaled_waveform_kwargs
+    ) -> List[float]:
+        """
+        Add the TFMRA retracked elevations of each threshold in
+        `retracker_thresholds` that is not already in `threshold_col` of
+        `tfmra_table` to that table, creating it if it does not exist.
+        Thresholds are compared after rounding to `threshold_decimals`.
+
+        Waveforms are only read and scaled on the first sweep of
+        `waveform_table`, see `scaled_waveforms` for its arguments
+        `scaled_waveform_kwargs`. Returns the thresholds that were added.
+
+        With lineage tracked, the lineage of the table covers every threshold
+        it has. A table whose waveforms or parameters have changed is rebuilt
+        with its thresholds and the new ones.
+        """
+        logger = self.context_logger("TFMRA Sweep")
+
+        def sweep_lineage(swept: Iterable[float]) -> Optional[str]:
+            return self._lineage(
+                None, [waveform_table], col_config=tfmra_col_config,
+                retracker_thresholds=sorted(swept), bin_size=bin_size,
+                **scaled_waveform_kwargs
+            )
+
+        thresholds = list(dict.fromkeys(
+            round(float(t), threshold_decimals) for t in retracker_thresholds
+        ))
+
+        table_exists = self.session.table_exists(tfmra_table)
+        existing = set()
+
+        if table_exists:
+            existing = {
+                round(float(t), threshold_decimals)
+                for (t,) in self.session.execute_query(
+                    self.format_query_with_base_args(
+                        queries.distinct_values,
+                        dict(src=tfmra_table, col=threshold_col)
+                    ),
+                    True, ResultFormat.LIST
+                )
+            }
+
+            lineage = sweep_lineage(existing)
+            if lineage is not None and \
+                    lineage != self._recorded_lineage(tfmra_table):
+                logger.info(
+                    f"Inputs or parameters of table {tfmra_table} changed. "
+                    f"Rebuilding it."
+                )
+                self.session.drop_table(tfmra_table)
+                table_exists = False
+                thresholds = list(dict.fromkeys(sorted(existing) + thresholds))
+                existing = set()
+
+            thresholds = [t for t in thresholds if t not in existing]
+
+        if not thresholds:
+            logger.debug(
+                f"all thresholds already exist in {tfmra_table}. "
+                f"Skipping step."
+            )
+            return thresholds
+
+        waveform_id, scaled_waveform, first_bin_elvtn = \
+            self.scaled_waveforms(
+                waveform_table, bin_size, **scaled_waveform_kwargs
+            )
+
+        tfmra_elvtns = calc_tfmra_elevation(
+            thresholds, scaled_waveform, first_bin_elvtn, bin_size, logger
+        )
+        out_data = self._tfmra_rows(waveform_id, thresholds, tfmra_elvtns)
+
+        if not table_exists:
+            logger.info(f"creating retracked elevation table {tfmra_table}")
+            self.session.create_table(
+                tfmra_table, column_config_dict_to_list(tfmra_col_config)
+            )
+
+        logger.info(f"appending thresholds {thresholds} to {tfmra_table}")
+        self.session.insert(tfmra_table, out_data, use_copy=True)
+
+        if not table_exists:
+            self._simple_index_on_cols(
+                logger, tfmra_table, tfmra_simple_index_cols
+            )
+        self._record_lineage(
+            tfmra_table, sweep_lineage(existing | set(thresholds))
+        )
+        self.session.commit()
+
+        return thresholds
+
+    def scaled_waveforms(
+            self,
+            waveform_table: Table,
+            bin_size=PARAM.bin_size,
+            waveform_id_col=COL.id_asr,
+            linear_scale_factor_col=COL.linear_scale_factor,
+            power2_scale_factor_col=COL.power2_scale_factor,
+            rwc_delay_col=COL.window_delay,
+            sensor_elvtn_col=COL.altitude,
+            waveform_col=COL.ml_power_echo,
+            source_file: Optional[str] = None,
+            loader_kwargs: Optional[KwargsDict] = None,
+            read_kwargs: Optional[KwargsDict] = None,
+            cache_dir: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the (`waveform_id`, `scaled_waveform`, `first_bin_elvtn`) of
+        the ASIRAS waveforms in `waveform_table`, read as in
+        `waveform_processing`.
+
+        Results are kept for the lifetime of the process and are only read
+        and scaled again when called with different arguments or after
+        `clear_scaled_waveforms`.
+
+        If `cache_dir` is given, results are also cached there as `.npy`
+        files keyed by a checksum of the source and the arguments, and are
+        returned as read-only memory maps of those files.
+        """
+        logger = self.context_logger("Scaled Waveforms")
+
+        cols_to_read = [
+            waveform_id_col, linear_scale_factor_col, power2_scale_factor_col,
+            rwc_delay_col, sensor_elvtn_col, waveform_col
+        ]
+
+        key = (
+            waveform_table, bin_size, tuple(cols_to_read), source_file,
+            repr(loader_kwargs), repr(read_kwargs)
+        )
+
+        if key in self._scaled_waveform_cache:
+            logger.debug(f"reusing scaled waveforms of {waveform_table}")
+            return self._scaled_waveform_cache[key]
+
+        cache = None
+        if cache_dir is not None:
+            cache = ColumnCache(cache_dir, content_key(
+                self._waveform_source_digest(
+                    logger, waveform_table, cols_to_read, source_file
+                ),
+                "scaled_waveforms", *key
+            ))
+
+        if cache is None or not cache.exists():
+            waveform_id, read_cols = self._read_waveform_columns(
+                logger, waveform_table, cols_to_read, source_file,
+                loader_kwargs, read_kwargs
+            )
+            lin_factor, pow2_factor, rwc_delay, sensor_elvtn, waveform = \
+                [np.asarray(col, dtype=float) for col in read_cols]
+
+            columns = dict(
+                waveform_id=waveform_id,
+                scaled_waveform=calc_scaled_waveform(
+                    waveform, lin_factor, pow2_factor, logger
+                ),
+                first_bin_elvtn=calc_first_bin_elvtn(
+                    bin_size, rwc_delay, sensor_elvtn, waveform.shape[1],
+                    logger
+                )
+            )
+
+            if cache is not None:
+                logger.info(f"caching scaled waveforms in {cache.path}")
+                cache.write(len(waveform_id), [columns])
+        else:
+            logger.info(f"reading scaled waveforms from {cache.path}")
+
+        if cache is not None:
+            columns = cache.load()
+
+        cached = self._scaled_waveform_cache[key] = (
+            columns['waveform_id'], columns['scaled_waveform'],
+            columns['first_bin_elvtn']
+        )
+        return cached
+
+    def _waveform_source_digest(
+            self,
+            logger: ContextLoggable,
+            waveform_table: Table,
+            cols_to_read: List[str],
+            source_file: Optional[str] = None
+    ) -> str:
+        """
+        Return a digest of the waveforms read by `_read_waveform_columns`.
+        The digest of a `source_file` also covers the id range of
+        `waveform_table` that it is checked against.
+        """
+        if source_file is not None:
+            return f"{file_digest(source_file)}:" + ",".join(
+                str(value) for value in
+                self._id_range(waveform_table, cols_to_read[0])
+            )
+
+        logger.info(f"calculating checksum of {waveform_table}")
+        return self.session.execute_query(
+            self.format_query_with_base_args(
+                queries.table_checksum,
+                dict(src=waveform_table, cols=cols_to_read, id=cols_to_read[0])
+            ),
+            True, ResultFormat.LIST
+        )[0][0] or ""
+
+    def _id_range(self, table: Table, id_col: str) -> Tuple[int, int, int]:
+        """
+        Return the (row count, min id, max id) of `id_col` in `table`
+        """
+        return tuple(self.session.execute_query(
+            self.format_query_with_base_args(
+                queries.id_range, dict(src=table, id=id_col)
+            ),
+            True, ResultFormat.LIST
+        )[0])
+
+    def clear_scaled_waveforms(self):
+        """
+        Release the results kept by `scaled_waveforms`
+        """
+        self._scaled_waveform_cache.clear()
+
+    def _read_waveform_columns(
+            self,
+            logger: ContextLoggable,
+            waveform_table: Table,
+            cols_to_read: List[str],
+            source_file: Optional[str] = None,
+            loader_kwargs: Optional[KwargsDict] = None,
+            read_kwargs: Optional[KwargsDict] = None
+    ) -> Tuple[np.ndarray, List]:
+        """
+        Return the ids and the columns after the id column of `cols_to_read`
+        of every waveform in `waveform_table` or, if given, `source_file`
+        """
+        if source_file is not None:
+            return self._read_waveforms_from_file(
+                logger, source_file, waveform_table, cols_to_read[0],
+                cols_to_read[1:], loader_kwargs, read_kwargs
+            )
+
+        logger.info(f"reading data from {waveform_table}")
+
+        # arrays are decoded from binary COPY instead of text
+        columns = self.session.select(
+            waveform_table, cols_to_read, result_format=ResultFormat.NUMPY
+        )
+
+        # read the waveform_id column as integer
+        waveform_id = columns[cols_to_read[0]].astype(int)
+        return waveform_id, [columns[name] for name in cols_to_read[1:]]
+
+    def _read_waveforms_from_file(
+            self,
+            logger: ContextLoggable,
+            source_file: str,
+            waveform_table: Table,
+            waveform_id_col: str,
+            cols_to_read: List[str],
+            loader_kwargs: Optional[KwargsDict] = None,
+            read_kwargs: Optional[KwargsDict] = None
+    ):
+        """
+        Return the ids and the decoded columns `cols_to_read` of the ASIRAS
+        file `source_file`. Ids are the row numbers of the file, which are
+        checked against the ids of `waveform_table`.
+        """
+        logger.info(f"reading data from {source_file}")
+
+        loader = AsirasLoader(logger, **(loader_kwargs or {}))
+        columns = loader.read_columns(
+            source_file, cols_to_read, **(read_kwargs or {})
+        )
+
+        # ids of a full load are the row numbers of the file
+        num_rows = len(columns[cols_to_read[0]])
+        waveform_id = np.arange(1, num_rows + 1)
+
+        self._check_file_ids(
+            source_file, num_rows, waveform_table, waveform_id_col
+        )
+
+        return waveform_id, [columns[name] for name in cols_to_read]
+
+    def _check_file_ids(
+            self,
+            source_file: str,
+            num_rows: int,
+            waveform_table: Table,
+            waveform_id_col: str
+    ):
+        """
+        Raise a `ValueError` unless the ids of `waveform_table` are the row
+        numbers 1 to `num_rows` of `source_file`
+        """
+        table_rows, min_id, max_id = self._id_range(
+            waveform_table, waveform_id_col
+        )
+        if (table_rows, min_id, max_id) != (num_rows, 1, num_rows):
+            raise ValueError(
+                f"Table {waveform_table} has {table_rows} rows with ids "
+                f"{min_id} to {max_id} but {source_file} has {num_rows} rows"
+            )
+
+    def _waveform_chunks(
+            self,
+            logger: ContextLoggable,
+            waveform_table: Table,
+            cols_to_read: List[str],
+            chunk_size: int,
+            source_file: Optional[str] = None,
+            loader_kwargs: Optional[KwargsDict] = None,
+            read_kwargs: Optional[KwargsDict] = None
+    ) -> Iterator[Tuple[np.ndarray, List]]:
+        """
+        Yield the (`waveform_id`, `read_cols`) of `chunk_size` waveforms at a
+        time, where `read_cols` are the columns `cols_to_read` after the id
+        column. Rows are read through a server-side cursor on
+        `waveform_table` unless `source_file` is given.
+
+        Chunks of `source_file` are decoded one at a time and are the whole
+        blocks of at most `chunk_size` rows, or a single block if it is
+        larger.
+        """
+        if source_file is not None:
+            loader = AsirasLoader(logger, **(loader_kwargs or {}))
+            rows_per_block = loader.config.rows_per_block
+            with open(source_file, 'rb') as file:
+                _, num_blocks = loader._read_dataset_header(file)
+
+            # ids of a full load are the row numbers of the file
+            self._check_file_ids(
+                source_file, num_blocks * rows_per_block, waveform_table,
+                cols_to_read[0]
+            )
+
+            blocks_per_chunk = max(chunk_size // rows_per_block, 1)
+            logger.info(
+                f"reading data from {source_file} in chunks of "
+                f"{blocks_per_chunk} blocks"
+            )
+            for start in range(0, num_blocks, blocks_per_chunk):
+                stop = min(start + blocks_per_chunk, num_blocks)
+                columns = loader.read_columns(
+                    source_file, cols_to_read[1:], block_range=(start, stop),
+                    **(read_kwargs or {})
+                )
+                yield np.arange(
+                    start * rows_per_block + 1, stop * rows_per_block + 1
+                ), [columns[name] for name in cols_to_read[1:]]
+        else:
+            logger.info(
+                f"reading data from {waveform_table} in chunks of {chunk_size}"
+            )
+            for rows in self.session.select_batches(
+                    waveform_table, cols_to_read, chunk_size
+            ):
+                read_cols = list(zip(*rows))
+                yield np.array(read_cols[0], dtype=int), read_cols[1:]
+
+    def _waveform_processing_chunked(
+            self,
+            logger: ContextLoggable,
+            outputs: List[Tuple[Table, ColumnConfigDict, List[str], Callable]],
+            chunks: Iterable[Tuple[np.ndarray, List]],
+            calc_outputs: Callable
+    ):
+        """
+        Create each (`table`, `col_config`, `simple_index_cols`,
+        `build_rows`) in `outputs` and insert the rows that `build_rows`
+        returns for the ids and `calc_outputs` results of each chunk of
+        `chunks` from `_waveform_chunks`.
+        """
+        for table, col_config, _, _ in outputs:
+            logger.info(f"creating output table {table}")
+            self.session.create_table(
+                table, column_config_dict_to_list(col_config)
+            )
+
+        rows_processed = 0
+
+        for waveform_id, read_cols in chunks:
+            results = calc_outputs(read_cols)
+
+            for table, _, _, build_rows in outputs:
+                self.session.insert(
+                    table, build_rows(waveform_id, results), use_copy=True
+                )
+
+            rows_processed += waveform_id.shape[0]
+            logger.info(f"{rows_processed} waveforms processed")
+
+        for table, _, simple_index_cols, _ in outputs:
+            self._simple_index_on_cols(logger, table, simple_index_cols)
+
+        self.session.commit()
+
+    @staticmethod
+    def _tfmra_rows(
+            waveform_id: np.ndarray,
+            retracker_thresholds: List[float],
+            tfmra_elvtns: np.ndarray
+    ) -> np.ndarray:
+        """
+        Return the (id, threshold, elevation) rows of the TFMRA table from
+        the result of `calc_tfmra_elevation`
+        """
+        # reshape TFMRA elevations into rows
+        tfmra_elvtns = tfmra_elvtns.T.reshape(-1, 1)
+
+        #
+        tfmra_labels = np.tile(
+            retracker_thresholds, (waveform_id.shape[0], 1)
+        ).T.reshape(-1, 1)
+
+        id_labels = np.tile(
+            waveform_id, len(retracker_thresholds)
+        ).reshape(-1, 1)
+
+        return np.hstack(
+            [id_labels, tfmra_labels, tfmra_elvtns]
+        )
+
+    @staticmethod
+    def _wshape_rows(
+            waveform_id: np.ndarray,
+            wshape: np.ndarray
+    ) -> np.ndarray:
+        """
+        Return the rows of the waveform shape table, the waveform id followed
+        by the columns of `calc_waveform_shape` result `wshape`
+        """
+        return np.column_stack([waveform_id, wshape])
+
+    @staticmethod
+    def _wscaled_rows(
+            waveform_id: np.ndarray,
+            scaled_waveform: np.ndarray,
+            storage=WaveformStorage.FULL,
+            window_bins=PARAM.wscaled_window_bins
+    ) -> Iterable[Tuple]:
+        """
+        Return the rows of the scaled waveform table, with the waveform of
+        each row as a single array value. Compact `storage` rows are the
+        waveform id followed by the window start, number of bins, value
+        offset, value scale and window of `compact_waveforms`.
+        """
+        if storage == WaveformStorage.FULL:
+            return zip(
+                waveform_id.tolist(), list(iter(scaled_waveform.tolist()))
+            )
+
+        window_start, value_offset, value_scale, windows = \
+            compact_waveforms(scaled_waveform, window_bins, storage)
+
+        return zip(
+            waveform_id.tolist(), window_start.tolist(),
+            [scaled_waveform.shape[1]] * len(window_start),
+            value_offset.tolist(), value_scale.tolist(), windows.tolist()
         )
 
     def create_tfmra_table(
@@ -508,11 +1587,13 @@ class Process:
             waveform_id: np.ndarray,
             retracker_thresholds: List[float],
             bin_size: float,
-            simple_index_cols: List[str]
+            simple_index_cols: List[str],
+            tfmra_elvtns: Optional[np.ndarray] = None
     ):
         """
         Create table `out_table` of TFMRA retracked elevations estimating
-        ice surface elevation from the dominant scattering interface
+        ice surface elevation from the dominant scattering interface.
+        Elevations are only calculated if `tfmra_elvtns` is not given.
         """
 
         logger = self.context_logger("TFMRA")
@@ -521,23 +1602,14 @@ class Process:
             self._log_table_exists(logger, out_table)
             return
 
-        # reshape TFMRA elevations into rows
-        tfmra_elvtns = calc_tfmra_elevation(
-            retracker_thresholds, scaled_waveform, first_bin_elvtn, bin_size,
-            logger
-        ).T.reshape(-1, 1)
-
-        #
-        tfmra_labels = np.tile(
-            retracker_thresholds, (scaled_waveform.shape[0], 1)
-        ).T.reshape(-1, 1)
-
-        id_labels = np.tile(
-            waveform_id, len(retracker_thresholds)
-        ).reshape(-1, 1)
+        if tfmra_elvtns is None:
+            tfmra_elvtns = calc_tfmra_elevation(
+                retracker_thresholds, scaled_waveform, first_bin_elvtn,
+                bin_size, logger
+            )
 
-        out_data = np.hstack(
-            [id_labels, tfmra_labels, tfmra_elvtns]
+        out_data = self._tfmra_rows(
+            waveform_id, retracker_thresholds, tfmra_elvtns
         )
 
         logger.info(f"creating retracked elevation table")
@@ -559,8 +1631,7 @@ class Process:
 
         col_config_create = column_config_dict_to_list(col_config)
         self.session.create_table(out_table, col_config_create)
-        # ignore rows object warning
-        self.session.insert(out_table, out_data.tolist())
+        self.session.insert(out_table, out_data, use_copy=True)
 
         self._simple_index_on_cols(logger, out_table, simple_index_cols)
         self.session.commit()
@@ -575,11 +1646,14 @@ class Process:
             ppeak_indices_right: Iterable[int],
             bin_size: float,
             signal_threshold: float,
-            simple_index_cols: List[str]
+            simple_index_cols: List[str],
+            rows_per_chunk=10000,
+            wshape: Optional[np.ndarray] = None
     ):
         """
         Create table `out_table` with pulse peakiness and return width
-        calculated from `scaled_waveform`.
+        calculated from `scaled_waveform`, `rows_per_chunk` rows at a time,
+        unless the `calc_waveform_shape` result `wshape` is given.
         """
 
         logger = self.context_logger("Waveform Shape")
@@ -588,89 +1662,25 @@ class Process:
             self._log_table_exists(logger, out_table)
             return
 
-        peak_value = np.amax(scaled_waveform, 1)
-        peak_index = np.argmax(scaled_waveform, 1)
-
-        # Pulse Peakiness
-        logger.info("calculating pulse peakiness")
-        # first peak value over sum of all other values
-        sum_full = np.sum(scaled_waveform, 1)
-        sum_full[sum_full == 0] = np.nan  # prevent divide by zero
-        ppeak_full = peak_value / np.sum(scaled_waveform, 1)
-
-        # pulse peakiness of bins left of peak
-        sum_left = np.apply_along_axis(
-            lambda a: aggregate_relative_indices(
-                a, ppeak_indices_left, np.argmax, np.sum
-            ),
-            1, scaled_waveform
-        )
-        sum_left[sum_left == 0] = np.nan
-        ppeak_left = peak_value / sum_left
-
-        # pulse peakiness of bins right of peak
-        sum_right = np.apply_along_axis(
-            lambda a: aggregate_relative_indices(
-                a, ppeak_indices_right, np.argmax, np.sum
-            ),
-            1, scaled_waveform
-        )
-        sum_right[sum_right == 0] = np.nan
-        ppeak_right = peak_value / sum_right
-
-        # Return Width
-        logger.info("calculating return width")
-        # get left and right indices that mark the boundaries of the signal
-        # for each scaled waveform
-        return_bound_left = np.ndarray.astype(
-            np.apply_along_axis(
-                lambda a: lin_interp_from_first_max(
-                    a, signal_threshold, InterpolateDirection.LEFT
-                ),
-                1, scaled_waveform
-            ),
-            dtype=float
-        )
-        return_bound_right = np.ndarray.astype(
-            np.apply_along_axis(
-                lambda a: lin_interp_from_first_max(
-                    a, signal_threshold, InterpolateDirection.RIGHT
-                ),
-                1, scaled_waveform
-            ),
-            dtype=float
-        )
-
-        rwidth_left = (peak_index - return_bound_left) * bin_size
-        rwidth_right = (peak_index + return_bound_right) * bin_size
-        rwidth_full = rwidth_left + rwidth_right
-
-        # df = pd.DataFrame(
-        #     np.vstack([
-        #         waveform_id,
-        #         ppeak_full, ppeak_left, ppeak_right,
-        #         rwidth_full, rwidth_left, rwidth_right
-        #     ]).T,
-        #     columns=[
-        #         waveform_id_col,
-        #         ppeak_col, ppeak_left_col, ppeak_right_col,
-        #         rwidth_col, rwidth_left_col, rwidth_right_col
-        #     ]
-        # )
-        #
-        # logger.info(f"writing to output table {out_table}")
-        # self.session.create_table_from_dataframe(out_table, df)
+        if wshape is None:
+            num_rows = scaled_waveform.shape[0]
+            wshape = np.empty((num_rows, 6))
+
+            for start in range(0, num_rows, rows_per_chunk):
+                stop = min(start + rows_per_chunk, num_rows)
+                logger.info(f"waveform shape of rows {start}-{stop - 1}")
+                calc_waveform_shape(
+                    scaled_waveform[start:stop],
+                    ppeak_indices_left, ppeak_indices_right, bin_size,
+                    signal_threshold,
+                    out=wshape[start:stop]
+                )
 
-        out_data = np.vstack([
-            waveform_id,
-            ppeak_full, ppeak_left, ppeak_right,
-            rwidth_full, rwidth_left, rwidth_right
-        ]).T
+        out_data = self._wshape_rows(waveform_id, wshape)
 
         col_config_create = column_config_dict_to_list(col_config)
         self.session.create_table(out_table, col_config_create)
-        # ignore rows object warning
-        self.session.insert(out_table, out_data.tolist())
+        self.session.insert(out_table, out_data, use_copy=True)
 
         self._simple_index_on_cols(logger, out_table, simple_index_cols)
 
@@ -682,11 +1692,20 @@ class Process:
             col_config: ColumnConfigDict,
             waveform_id: np.ndarray,
             scaled_waveform: np.ndarray,
-            simple_index_cols: List[str]
+            simple_index_cols: List[str],
+            storage=WaveformStorage.FULL,
+            window_bins=PARAM.wscaled_window_bins
     ):
         """
         Create a table `out_table` with the `scaled_waveform` and their
         associated `waveform_id`.
+
+        With `WaveformStorage.FULL` every bin is stored. Otherwise only a
+        window of `window_bins` around the peak is stored in the compact
+        form of `compact_waveforms`, and `col_config` should be the matching
+        `COLCONFIG.asr_wscaled_float32` or `COLCONFIG.asr_wscaled_uint16`.
+        The SQL function `FUNC.expand_waveform` or `tools.expand_waveforms`
+        restores every bin, with 0 outside of the window.
         """
 
         logger = self.context_logger("Scaled Waveform")
@@ -707,19 +1726,20 @@ class Process:
         #     out_table, df
         # )
 
-        out_data = zip(
-            waveform_id.tolist(), list(iter(scaled_waveform.tolist()))
+        out_data = self._wscaled_rows(
+            waveform_id, scaled_waveform, storage, window_bins
         )
 
         col_config_create = column_config_dict_to_list(col_config)
         self.session.create_table(out_table, col_config_create)
         # ignore rows object warning
-        self.session.insert(out_table, out_data)
+        self.session.insert(out_table, out_data, use_copy=True)
 
         self._simple_index_on_cols(logger, out_table, simple_index_cols)
 
         self.session.commit()
 
+    @profiled_step('out_table')
     def offset_calibration(
             self,
             out_table: Table,
@@ -728,39 +1748,46 @@ class Process:
             simple_index_cols=(COL.offset_calib, COL.tfmra_threshold),
             query=queries.sensor_offset_samples
     ):
-        logger = self.context_logger('Offset Calibration Samples')
-        if not self.session.table_exists(out_table):
+        context_name = 'Offset Calibration Samples'
+        logger = self.context_logger(context_name)
 
-            # format the parameters for each offset calibration
-            calib_queries = []
-            for name, where_statements in offset_calib_params.items():
-                main_kwargs = {**query_kwargs, 'calib_name': name}
+        # format the parameters for each offset calibration
+        calib_queries = []
+        for name, where_statements in offset_calib_params.items():
+            main_kwargs = {**query_kwargs, 'calib_name': name}
 
-                main_query = self.format_query_with_base_args(
-                    query, main_kwargs
-                )
+            main_query = self.format_query_with_base_args(
+                query, main_kwargs
+            )
 
-                where_block = sql_block_where(
-                    (pgs.SQL(statement) for statement in where_statements)
-                )
+            where_block = sql_block_where(
+                (pgs.SQL(statement) for statement in where_statements)
+            )
 
-                final_query = stack_sql_lines(main_query, where_block)
+            final_query = stack_sql_lines(main_query, where_block)
 
-                calib_queries.append(final_query)
+            calib_queries.append(final_query)
 
-            combined_query = union_sql_blocks(
-                *calib_queries
-            )
+        combined_query = union_sql_blocks(
+            *calib_queries
+        )
+
+        lineage = self._lineage(
+            combined_query, self._query_tables(query, query_kwargs),
+            simple_index_cols=simple_index_cols
+        )
+
+        if self._build_required(logger, out_table, lineage):
 
             logger.info(f"creating table {out_table}")
-            self.session.create_table_as(out_table, combined_query)
+            self.session.create_table_as(
+                out_table, combined_query, plan_label=context_name
+            )
 
             self._simple_index_on_cols(logger, out_table, simple_index_cols)
+            self._record_lineage(out_table, lineage)
             self.session.commit()
 
-        else:
-            self._log_table_exists(logger, out_table)
-
 
 def _process_msg(
         title: str,
@@ -783,16 +1810,28 @@ def _process_msg(
 def new_process(
         name: str,
         session: Session,
-        logger_hub=empty_logger_hub()
+        logger_hub=empty_logger_hub(),
+        track_lineage=False,
+        profile=False,
+        profile_dir: Optional[str] = None
 ) -> ContextManager[Process]:
+    """
+    Context of a new `Process`. If `profile` is `True` then its steps are
+    profiled and written with `Process.write_profile` when it exits, as are
+    the plans captured by `session` with `Process.write_query_plans`.
+    """
     logger = logger_hub.context("Process Manager")
     time_start = datetime.now()
+    process = Process(
+        name, session, logger_hub, track_lineage,
+        profiler=StepProfiler(name) if profile else None
+    )
 
     try:
         logger.info(_process_msg(
             "STARTED", name, str(time_start),
         ))
-        yield Process(name, session, logger_hub)
+        yield process
 
     except Exception as e:
         time_end = datetime.now()
@@ -803,6 +1842,18 @@ def new_process(
         raise e
 
     finally:
+        # failed diagnostics must not hide the error of a failed process
+        if process.profiler is not None:
+            try:
+                process.write_profile(profile_dir)
+            except Exception as e:
+                logger.exception(e)
+        if session.capture_plans:
+            try:
+                process.write_query_plans()
+            except Exception as e:
+                logger.exception(e)
+
         time_end = datetime.now()
         logger.info(_process_msg(
             "COMPLETED", name, str(time_end), str(time_end - time_start)
@@ -0,0 +1,211 @@
+"""
+Timing and resource use of processing steps
+
+The peak memory of the client is read from `resource`, which is not
+available on Windows, so it is left empty there. It is the peak of the
+whole process up to the end of each step, so it only grows between steps.
+"""
+
+from typing import Optional, List, Dict, Any, Callable, Tuple
+from datetime import datetime
+from functools import wraps
+from time import perf_counter
+import csv
+import inspect
+import json
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from ..postgis import ResultFormat
+from . import queries
+
+# columns of the run history table and reports in order
+report_columns = [
+    'run_id', 'process', 'step', 'context', 'output_tables', 'started_at',
+    'wall_seconds', 'db_seconds', 'built', 'rows', 'size_bytes',
+    'process_peak_rss_bytes'
+]
+
+
+def process_peak_rss_bytes() -> Optional[int]:
+    """
+    Return the peak resident memory of this process so far in bytes, which
+    includes the steps run before and alongside the current one
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS and kilobytes otherwise
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StepProfiler:
+    """
+    Records of the steps of the process `process_name`, shared by the
+    processes running its steps on other threads
+    """
+
+    def __init__(self, process_name: str):
+        self.process_name = process_name
+        self.run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, **record):
+        record = dict(run_id=self.run_id, process=self.process_name, **record)
+        with self._lock:
+            self.records.append(record)
+
+    def rows(self) -> List[List]:
+        """
+        Return the records as rows of `report_columns`
+        """
+        with self._lock:
+            return [
+                [record.get(col) for col in report_columns]
+                for record in self.records
+            ]
+
+    def write_reports(self, report_dir: str) -> List[str]:
+        """
+        Write the records to a JSON and a CSV file named by the run id in
+        `report_dir` and return their paths
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        base_path = os.path.join(report_dir, f"{self.run_id}_profile")
+
+        rows = [
+            [value.isoformat() if isinstance(value, datetime) else value
+             for value in row]
+            for row in self.rows()
+        ]
+
+        json_path = base_path + ".json"
+        with open(json_path, 'w') as file:
+            json.dump(
+                [dict(zip(report_columns, row)) for row in rows], file,
+                indent=2
+            )
+
+        csv_path = base_path + ".csv"
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(report_columns)
+            writer.writerows(
+                [
+                    ";".join(value) if isinstance(value, list) else value
+                    for value in row
+                ]
+                for row in rows
+            )
+
+        return [json_path, csv_path]
+
+
+def _table_oid(session, table: str) -> Optional[int]:
+    schema, table = session.qualified_table(table).split(".", 1)
+    return session.execute_query(
+        session.format_query(
+            queries.table_oid, None, dict(schema=schema, table=table)
+        ),
+        fetch=True, single_response=True
+    )
+
+
+def _table_stats(session, table: str, oid: int) -> Tuple[int, int]:
+    return session.execute_query(
+        session.format_query(
+            queries.table_stats, None, dict(table=table, oid=oid)
+        ),
+        fetch=True, result_format=ResultFormat.LIST
+    )[0]
+
+
+def profiled_step(
+        *output_args: str,
+        context_arg: Optional[str] = None
+) -> Callable:
+    """
+    Decorate a `Process` method to record a profile of each call with the
+    `profiler` of the process, where `output_args` are the names of the
+    arguments of its output tables and `context_arg` the name of the
+    argument naming the step. Steps called by another step are part of its
+    profile. Steps that fail are not recorded.
+
+    Outputs are built when their OID changed during the step or their row
+    count grew, as when a step appends to an existing table. The rows and
+    total size recorded are those the outputs gained during the step.
+    """
+
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.profiler is None or self._profile_depth:
+                return method(self, *args, **kwargs)
+
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            tables = [arguments.arguments[arg] for arg in output_args]
+            oids = [_table_oid(self.session, table) for table in tables]
+            stats = [
+                _table_stats(self.session, table, oid)
+                if oid is not None else None
+                for table, oid in zip(tables, oids)
+            ]
+
+            started_at = datetime.now()
+            start = perf_counter()
+            query_seconds = self.session.query_seconds
+            self._profile_depth += 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self._profile_depth -= 1
+            wall_seconds = perf_counter() - start
+            db_seconds = self.session.query_seconds - query_seconds
+
+            built = False
+            rows = size_bytes = None
+            for table, oid, table_stats in zip(tables, oids, stats):
+                new_oid = _table_oid(self.session, table)
+                if new_oid is None:
+                    continue
+                table_rows, table_bytes = _table_stats(
+                    self.session, table, new_oid
+                )
+                if new_oid == oid:
+                    # only the rows appended to the existing table
+                    table_rows -= table_stats[0]
+                    table_bytes -= table_stats[1]
+                    if table_rows <= 0:
+                        continue
+                built = True
+                rows = (rows or 0) + table_rows
+                size_bytes = (size_bytes or 0) + table_bytes
+
+            self.profiler.add(
+                step=method.__name__,
+                context=arguments.arguments[context_arg]
+                if context_arg else None,
+                output_tables=list(tables),
+                started_at=started_at,
+                wall_seconds=wall_seconds,
+                db_seconds=db_seconds,
+                built=built,
+                rows=rows,
+                size_bytes=size_bytes,
+                process_peak_rss_bytes=process_peak_rss_bytes()
+            )
+            return result
+
+        return wrapper
+
+    return decorator
@@ -40,6 +40,33 @@ CREATE OR REPLACE FUNCTION
     END;
 $$ LANGUAGE plpgsql;
 
+-- Returns the scaled waveform of `num_bins` bins from the compact window
+-- `window_values` whose first value is bin `window_start` (from 0).
+-- Each window bin is `value_offset` + `value_scale` * value and bins
+-- outside of the window are 0
+CREATE OR REPLACE FUNCTION
+    {T@expand_waveform}(
+        window_start INTEGER,
+        num_bins INTEGER,
+        value_offset FLOAT8,
+        value_scale FLOAT8,
+        window_values FLOAT8[]
+    ) RETURNS FLOAT8[] AS $$
+    BEGIN
+        RETURN ARRAY(
+            SELECT CASE
+                WHEN i > window_start
+                    AND i <= window_start + cardinality(window_values)
+                THEN value_offset
+                    + value_scale * window_values[i - window_start]
+                ELSE 0
+            END
+            FROM generate_series(1, num_bins) i
+            ORDER BY i
+        );
+    END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
 """
 
 label_grid_zones = \
@@ -52,6 +79,112 @@ ORDER BY {I@src_id}
 """
 
 
+id_range = \
+"""
+SELECT count(*), min({I@id}), max({I@id})
+FROM {T@src}
+"""
+
+table_checksum = \
+"""
+SELECT md5(string_agg(md5(ROW({I@cols})::text), '' ORDER BY {I@id}))
+FROM {T@src}
+"""
+
+distinct_values = \
+"""
+SELECT DISTINCT {I@col}
+FROM {T@src}
+"""
+
+create_lineage_table = \
+"""
+CREATE TABLE IF NOT EXISTS {T@lineage} (
+    table_name text PRIMARY KEY,
+    lineage_hash text NOT NULL,
+    built_at timestamp NOT NULL DEFAULT now()
+)
+"""
+
+# the recorded lineage hash of each existing table or its relation OID if it
+# has none, which changes whenever the table is recreated
+table_fingerprints = \
+"""
+SELECT t.table_name,
+    CASE WHEN c.oid IS NOT NULL
+        THEN coalesce(l.lineage_hash, c.oid::text)
+    END
+FROM unnest(ARRAY[{L@tables}]::text[]) t(table_name)
+LEFT JOIN {T@lineage} l USING (table_name)
+LEFT JOIN LATERAL (
+    SELECT to_regclass(format(
+        '%I.%I', split_part(t.table_name, '.', 1),
+        split_part(t.table_name, '.', 2)
+    ))::oid AS oid
+) c ON TRUE
+ORDER BY t.table_name
+"""
+
+recorded_lineage = \
+"""
+SELECT (
+    SELECT lineage_hash
+    FROM {T@lineage}
+    WHERE table_name = {L@table_name}
+)
+"""
+
+record_lineage = \
+"""
+INSERT INTO {T@lineage} (table_name, lineage_hash)
+VALUES ({L@table_name}, {L@lineage_hash})
+ON CONFLICT (table_name) DO UPDATE
+SET lineage_hash = EXCLUDED.lineage_hash, built_at = now()
+"""
+
+table_oid = \
+"""
+SELECT to_regclass(format('%I.%I', {L@schema}, {L@table}))::oid
+"""
+
+table_stats = \
+"""
+SELECT count(*), pg_total_relation_size({L@oid}::oid::regclass)
+FROM {T@table}
+"""
+
+create_run_history_table = \
+"""
+CREATE TABLE IF NOT EXISTS {T@history} (
+    run_id text NOT NULL,
+    process text NOT NULL,
+    step text NOT NULL,
+    context text,
+    output_tables text[],
+    started_at timestamp NOT NULL,
+    wall_seconds float8 NOT NULL,
+    db_seconds float8 NOT NULL,
+    built boolean NOT NULL,
+    rows bigint,
+    size_bytes bigint,
+    process_peak_rss_bytes bigint
+)
+"""
+
+create_query_plans_table = \
+"""
+CREATE TABLE IF NOT EXISTS {T@plans} (
+    captured_at timestamp NOT NULL,
+    process text NOT NULL,
+    step text NOT NULL,
+    query text NOT NULL,
+    plan jsonb NOT NULL,
+    execution_ms float8,
+    warnings text[]
+)
+"""
+
+
 summarize_pits = \
 """
 WITH
@@ -394,6 +527,41 @@ GROUP BY f.{I@id_asr}, f.{I@fp_size}
 ORDER BY f.{I@id_asr}, f.{I@fp_size}
 """
 
+# aggregate_observations of only the radar footprints
+aggregate_observations_radar = \
+"""\
+SELECT
+    f.{I@id_asr} {I@id_asr},
+    f.{I@fp_size} {I@fp_size},
+    MIN(p.{I@val}) {I@val_min},
+    MAX(p.{I@val}) {I@val_max},
+    AVG(p.{I@val}) {I@val_mean},
+    COUNT(*) {I@val_count},
+    (   PERCENTILE_CONT({L@rough_margin}) WITHIN GROUP
+            (ORDER BY p.{I@val} DESC) -
+        PERCENTILE_CONT(1-{L@rough_margin}) WITHIN GROUP
+            (ORDER BY p.{I@val} DESC)
+    ) {I@val_rough}
+FROM {T@obsv} p
+JOIN {T@ftpr} f ON st_contains(f.{I@geom}, p.{I@geom})
+WHERE f.{I@fp_size} = {L@pdlf_key}
+GROUP BY f.{I@id_asr}, f.{I@fp_size}
+ORDER BY f.{I@id_asr}, f.{I@fp_size}
+"""
+
+nadir_coordinates = \
+"""\
+SELECT {I@id_asr}, st_x({I@geom}) x, st_y({I@geom}) y
+FROM {T@nadir}
+ORDER BY {I@id_asr}
+"""
+
+observation_values = \
+"""\
+SELECT st_x({I@geom}) x, st_y({I@geom}) y, {I@val}::float8 val
+FROM {T@obsv}
+"""
+
 interpolate_snow_density = \
 """\
 WITH
@@ -1,9 +1,10 @@
-from typing import Union, Iterable, List, Callable
+from typing import Union, Iterable, List, Callable, Optional, Dict, Tuple
 from enum import Enum
 import numpy as np
 
 from ..config import CONST
 from ..logger import empty_logger
+from . import kernels
 
 
 class InterpolateDirection(Enum):
@@ -11,6 +12,12 @@ class InterpolateDirection(Enum):
     RIGHT = 'right'
 
 
+class WaveformStorage(Enum):
+    FULL = 'full'  # every bin as double precision
+    FLOAT32 = 'float32'  # window around the peak as single precision
+    UINT16 = 'uint16'  # window around the peak quantized to 16 bits
+
+
 def lin_interp_from_first_max(
         array: np.ndarray,
         threshold: float,
@@ -64,6 +71,91 @@ def lin_interp_from_first_max(
         raise ValueError("invalid `direction`")
 
 
+def lin_interp_from_first_max_2d(
+        arrays: np.ndarray,
+        thresholds: Iterable[float],
+        direction: InterpolateDirection,
+        rows_per_chunk=10000,
+        use_compiled=True
+) -> np.ndarray:
+    """
+    Vectorized `lin_interp_from_first_max` for every row of the 2d `arrays`
+    and every decimal threshold in `thresholds`.
+
+    Returns a 2d float array of the interpolated indices with a row for each
+    row of `arrays` and a column for each threshold. Indices are NaN where
+    `lin_interp_from_first_max` returns `None`. Rows are processed
+    `rows_per_chunk` at a time to limit the size of the intermediate
+    (rows, thresholds, bins) mask.
+
+    If `use_compiled` is `True` and numba is installed, the compiled kernel
+    `kernels.lin_interp_from_first_max_rows` is used instead, which gives the
+    same results without the intermediate mask.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    num_rows, num_bins = arrays.shape
+    bins = np.arange(num_bins)
+
+    indices = np.empty((num_rows, thresholds.size))
+
+    if direction not in tuple(InterpolateDirection):
+        raise ValueError("invalid `direction`")
+
+    if use_compiled and kernels.compiled and num_bins:
+        kernels.lin_interp_from_first_max_rows(
+            np.ascontiguousarray(arrays, dtype=float), thresholds,
+            direction == InterpolateDirection.LEFT, indices
+        )
+        return indices
+
+    for start in range(0, num_rows, rows_per_chunk):
+        chunk = arrays[start:start + rows_per_chunk]
+        rows = np.arange(chunk.shape[0])[:, np.newaxis]
+
+        index_peak = chunk.argmax(axis=1)[:, np.newaxis]
+        target_value = chunk[rows, index_peak] * thresholds
+
+        # (rows, thresholds, bins) mask of bins at or below each target
+        below = chunk[:, np.newaxis, :] <= target_value[:, :, np.newaxis]
+
+        if direction == InterpolateDirection.RIGHT:
+            below &= (bins >= index_peak)[:, np.newaxis, :]
+            index_found = below.argmax(axis=2)
+            index_prev = index_found - 1
+        elif direction == InterpolateDirection.LEFT:
+            below &= (bins < index_peak)[:, np.newaxis, :]
+            index_found = num_bins - 1 - below[:, :, ::-1].argmax(axis=2)
+            # out of range where no bin qualifies but masked below
+            index_prev = np.minimum(index_found + 1, num_bins - 1)
+        else:
+            raise ValueError("invalid `direction`")
+
+        value_found = chunk[rows, index_found]
+        value_prev = chunk[rows, index_prev]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index_gap = (value_prev - target_value) / (
+                    value_prev - value_found)
+
+        if direction == InterpolateDirection.RIGHT:
+            interpolated = index_prev + index_gap
+        else:
+            interpolated = index_prev - index_gap
+
+        # same order of cases as `lin_interp_from_first_max`
+        result = np.where(
+            value_found == target_value, index_found, interpolated
+        )
+        result[~below.any(axis=2)] = np.nan
+        if direction == InterpolateDirection.LEFT:
+            result = np.where(index_peak == 0, index_peak, result)
+        result = np.where(thresholds == 1, index_peak, result)
+
+        indices[start:start + chunk.shape[0]] = result
+
+    return indices
+
+
 def calc_scaled_waveform(
         waveform: np.ndarray,
         lin_factor: np.ndarray,
@@ -88,6 +180,77 @@ def calc_scaled_waveform(
     ).swapaxes(0, 1)
 
 
+def compact_waveforms(
+        waveform: np.ndarray,
+        window_bins: int,
+        storage: WaveformStorage
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the (`window_start`, `value_offset`, `value_scale`, `windows`) of
+    a window of `window_bins` bins centered on the first peak of each row of
+    `waveform` and shifted to stay within the row. Bin `i` of a window is bin
+    `window_start + i` of the waveform with the value
+    `value_offset + value_scale * windows[i]`.
+
+    `WaveformStorage.FLOAT32` windows are the values as float32.
+    `WaveformStorage.UINT16` windows are quantized to 65536 steps between
+    the minimum and maximum of each window. They are stored as int16 shifted
+    by -32768, since PostgreSQL has no unsigned types, which is accounted
+    for by `value_offset`.
+    """
+    num_rows, num_bins = waveform.shape
+    window_bins = min(window_bins, num_bins)
+
+    window_start = np.clip(
+        waveform.argmax(axis=1) - window_bins // 2, 0, num_bins - window_bins
+    )
+    windows = np.take_along_axis(
+        waveform, window_start[:, np.newaxis] + np.arange(window_bins), axis=1
+    )
+
+    if storage == WaveformStorage.FLOAT32:
+        return window_start, np.zeros(num_rows), np.ones(num_rows), \
+            windows.astype(np.float32)
+
+    elif storage == WaveformStorage.UINT16:
+        low = windows.min(axis=1)
+        value_scale = (windows.max(axis=1) - low) / 65535
+        # constant windows are all 0 steps
+        value_scale[value_scale == 0] = 1
+        steps = np.rint(
+            (windows - low[:, np.newaxis]) / value_scale[:, np.newaxis]
+        )
+        return window_start, low + 32768 * value_scale, value_scale, \
+            (steps - 32768).astype(np.int16)
+
+    else:
+        raise ValueError("invalid `storage`")
+
+
+def expand_waveforms(
+        window_start: np.ndarray,
+        value_offset: np.ndarray,
+        value_scale: np.ndarray,
+        windows: np.ndarray,
+        num_bins: int
+) -> np.ndarray:
+    """
+    Return the waveforms of `num_bins` bins of the `compact_waveforms`
+    result (`window_start`, `value_offset`, `value_scale`, `windows`). Bins
+    outside of the window are 0.
+    """
+    window_start = np.asarray(window_start, dtype=int)
+    waveform = np.zeros((window_start.shape[0], num_bins))
+    np.put_along_axis(
+        waveform,
+        window_start[:, np.newaxis] + np.arange(windows.shape[1]),
+        np.asarray(value_offset)[:, np.newaxis]
+        + np.asarray(value_scale)[:, np.newaxis] * windows,
+        axis=1
+    )
+    return waveform
+
+
 def calc_first_bin_elvtn(
         bin_size: float,
         rwc_delay: np.ndarray,
@@ -132,20 +295,13 @@ def calc_tfmra_elevation(
     are the thresholds (item of `threshold`)
     """
 
-    elevations = np.empty((waveform.shape[0], len(thresholds)))
+    logger.info(f"retracking thresholds {thresholds}")
 
-    for i, t in enumerate(thresholds):
-        logger.info(f"threshold {t} {i + 1}/{len(thresholds)}")
+    indices = lin_interp_from_first_max_2d(
+        waveform, thresholds, InterpolateDirection.LEFT
+    )
 
-        f = lambda array: lin_interp_from_first_max(
-            array, t, InterpolateDirection.LEFT
-        )
-
-        elevations[:, i] = first_bin_elvtn - (
-                np.apply_along_axis(f, 1, waveform) * bin_size
-        )
-
-    return elevations
+    return first_bin_elvtn[:, np.newaxis] - indices * bin_size
 
 
 def aggregate_relative_indices(
@@ -166,3 +322,141 @@ def aggregate_relative_indices(
         if 0 <= starting_index + i < len(array)
     ]
     return aggregate_func(array[get_indices])
+
+
+def sum_relative_indices_2d(
+        arrays: np.ndarray,
+        indices: Iterable[int],
+        starting_indices: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorized `aggregate_relative_indices` with `np.sum` for every row of
+    the 2d `arrays`, where `starting_indices` holds the starting index of
+    each row. Indices outside of a row are left out of its sum.
+    """
+    num_bins = arrays.shape[1]
+    columns = starting_indices[:, np.newaxis] + np.asarray(list(indices), int)
+    in_range = (columns >= 0) & (columns < num_bins)
+
+    values = np.take_along_axis(
+        arrays, np.clip(columns, 0, num_bins - 1), axis=1
+    )
+    return np.where(in_range, values, 0.).sum(axis=1)
+
+
+def calc_waveform_shape(
+        waveform: np.ndarray,
+        ppeak_indices_left: Iterable[int],
+        ppeak_indices_right: Iterable[int],
+        bin_size: float,
+        signal_threshold: float,
+        out: Optional[np.ndarray] = None,
+        logger=empty_logger()
+) -> np.ndarray:
+    """
+    Returns a 2d array of pulse peakiness and return width with a row for
+    each ASIRAS row (row of `waveform`) and the columns:
+        ppeak, ppeak_left, ppeak_right, rwidth, rwidth_left, rwidth_right
+
+    Values are written into `out` if it is given, which must have that
+    shape. Slices of `waveform` and `out` can be passed to process a large
+    waveform chunk by chunk.
+    """
+    if out is None:
+        out = np.empty((waveform.shape[0], 6))
+
+    peak_index = np.argmax(waveform, 1)
+    peak_value = waveform[np.arange(waveform.shape[0]), peak_index]
+
+    # Pulse Peakiness
+    logger.info("calculating pulse peakiness")
+    # first peak value over sum of all other values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[:, 0] = peak_value / np.sum(waveform, 1)
+
+    # pulse peakiness of bins left and right of peak
+    for column, indices in [(1, ppeak_indices_left), (2, ppeak_indices_right)]:
+        sum_relative = sum_relative_indices_2d(waveform, indices, peak_index)
+        sum_relative[sum_relative == 0] = np.nan  # prevent divide by zero
+        out[:, column] = peak_value / sum_relative
+
+    # Return Width
+    logger.info("calculating return width")
+    # get left and right indices that mark the boundaries of the signal
+    # for each scaled waveform
+    return_bound_left = lin_interp_from_first_max_2d(
+        waveform, [signal_threshold], InterpolateDirection.LEFT
+    )[:, 0]
+    return_bound_right = lin_interp_from_first_max_2d(
+        waveform, [signal_threshold], InterpolateDirection.RIGHT
+    )[:, 0]
+
+    out[:, 4] = (peak_index - return_bound_left) * bin_size
+    out[:, 5] = (peak_index + return_bound_right) * bin_size
+    out[:, 3] = out[:, 4] + out[:, 5]
+
+    return out
+
+
+def _assign_output(
+        out: Dict[str, np.ndarray], key: str, values: np.ndarray
+):
+    if key in out:
+        out[key][...] = values
+    else:
+        out[key] = values
+
+
+def calc_waveform_outputs(
+        lin_factor: np.ndarray,
+        pow2_factor: np.ndarray,
+        rwc_delay: np.ndarray,
+        sensor_elvtn: np.ndarray,
+        waveform: np.ndarray,
+        bin_size: float,
+        retracker_thresholds: List[float],
+        ppeak_indices_left: Iterable[int],
+        ppeak_indices_right: Iterable[int],
+        signal_threshold: float,
+        with_tfmra=True,
+        with_wshape=True,
+        out: Optional[Dict[str, np.ndarray]] = None,
+        logger=empty_logger()
+) -> Dict[str, np.ndarray]:
+    """
+    Returns a `dict` with the waveform processing results of the ASIRAS rows
+    of `waveform`:
+        scaled_waveform: result of `calc_scaled_waveform`
+        first_bin_elvtn: result of `calc_first_bin_elvtn`
+        tfmra_elvtns: result of `calc_tfmra_elevation` if `with_tfmra`
+        wshape: result of `calc_waveform_shape` if `with_wshape`
+
+    Results are written into the arrays of `out` with the same keys if it is
+    given.
+    """
+    out = {} if out is None else out
+
+    # scale waveform to remove effects of gains and attenuations
+    _assign_output(out, 'scaled_waveform', calc_scaled_waveform(
+        waveform, lin_factor, pow2_factor, logger
+    ))
+    scaled_waveform = out['scaled_waveform']
+
+    # elevation of first range bin
+    _assign_output(out, 'first_bin_elvtn', calc_first_bin_elvtn(
+        bin_size, rwc_delay, sensor_elvtn, waveform.shape[1], logger
+    ))
+
+    if with_tfmra:
+        _assign_output(out, 'tfmra_elvtns', calc_tfmra_elevation(
+            retracker_thresholds, scaled_waveform, out['first_bin_elvtn'],
+            bin_size, logger
+        ))
+
+    if with_wshape:
+        _assign_output(out, 'wshape', calc_waveform_shape(
+            scaled_waveform, ppeak_indices_left, ppeak_indices_right,
+            bin_size, signal_threshold, out.get('wshape'), logger
+        ))
+
+    return out
@@ -25,6 +25,13 @@ class RelativeConfigPathGetter:
                 f"'{self.parser_section.name}'"
             )
 
+    def get_optional(self, key: str):
+        # missing or empty keys are features that are turned off
+        if self.parser_section.get(key):
+            return self.get(key)
+        else:
+            return None
+
 
 class _MetaEchoContainer(type):
     def __getattribute__(self, item):
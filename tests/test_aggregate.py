@@ -0,0 +1,105 @@
+"""
+Client footprint aggregates against a direct evaluation of the query
+`aggregate_observations`
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+from src.process.aggregate import aggregate_to_radii, percentile_cont_sorted
+
+radii = [1., 2.5, 4.]
+rough_margin = 0.1
+
+
+def query_aggregates(nadir_xy, observation_xy, observation_values):
+    """
+    Aggregates of every observation within each radius of each nadir, with
+    `PERCENTILE_CONT(f) WITHIN GROUP (ORDER BY val DESC)` as the linear
+    percentile 1 - f of the values in ascending order
+    """
+    rows = []
+    for nadir, xy in enumerate(nadir_xy):
+        distance = np.hypot(*(observation_xy - xy).T)
+        for radius in radii:
+            inside = observation_values[distance < radius]
+            if not inside.size:
+                continue
+            values = inside[~np.isnan(inside)]
+            if values.size:
+                aggregates = [
+                    values.min(), values.max(), values.mean(),
+                    np.percentile(values, 100 * (1 - rough_margin)) -
+                    np.percentile(values, 100 * rough_margin)
+                ]
+            else:
+                aggregates = [np.nan] * 4
+            rows.append([nadir, radius, inside.size] + aggregates)
+
+    return {
+        name: np.array([row[i] for row in rows])
+        for i, name in enumerate(
+            ['nadir', 'radius', 'count', 'min', 'max', 'mean', 'rough']
+        )
+    }
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    nadir_xy = np.column_stack([np.linspace(0, 50, 60), np.zeros(60)])
+    observation_xy = rng.uniform([-2, -5], [52, 5], (2000, 2))
+    observation_values = rng.normal(0, 1, 2000)
+    observation_values[rng.uniform(size=2000) < 0.05] = np.nan
+    # a nadir whose only observation is NaN
+    nadir_xy = np.vstack([nadir_xy, [[100, 100]]])
+    observation_xy = np.vstack([observation_xy, [[100, 100.5]]])
+    observation_values = np.append(observation_values, np.nan)
+    return nadir_xy, observation_xy, observation_values
+
+
+@pytest.mark.parametrize('nadirs_per_chunk', [1000, 7])
+def test_matches_query(points, nadirs_per_chunk):
+    aggregates = aggregate_to_radii(
+        *points, radii[::-1], rough_margin, nadirs_per_chunk
+    )
+    expected = query_aggregates(*points)
+
+    assert aggregates['nadir'].dtype.kind == 'i'
+    assert aggregates['count'].dtype.kind == 'i'
+    for name in ['nadir', 'radius', 'count']:
+        np.testing.assert_array_equal(aggregates[name], expected[name])
+    for name in ['min', 'max']:
+        np.testing.assert_array_equal(aggregates[name], expected[name])
+    for name in ['mean', 'rough']:
+        np.testing.assert_allclose(
+            aggregates[name], expected[name], rtol=1e-12, atol=1e-12
+        )
+    assert np.isnan(aggregates['mean'][-1])
+
+
+def test_percentile_cont_sorted():
+    rng = np.random.RandomState(1)
+    groups = [rng.normal(0, 1, n) for n in [1, 2, 5, 10]]
+    values = np.concatenate([np.sort(group)[::-1] for group in groups])
+    counts = np.array([group.size for group in groups])
+    starts = np.cumsum(counts) - counts
+
+    for fraction in [0., 0.1, 0.5, 0.9, 1.]:
+        np.testing.assert_allclose(
+            percentile_cont_sorted(values, starts, counts, fraction),
+            [np.percentile(group, 100 * (1 - fraction)) for group in groups],
+            rtol=1e-12, atol=1e-12
+        )
+
+
+def test_no_observations_in_range(points):
+    nadir_xy, observation_xy, observation_values = points
+    aggregates = aggregate_to_radii(
+        nadir_xy + 1000, observation_xy, observation_values, radii,
+        rough_margin
+    )
+    assert all(values.size == 0 for values in aggregates.values())
+    assert aggregates['nadir'].dtype.kind == 'i'
@@ -0,0 +1,131 @@
+"""
+ALS line decoding against the struct reader of the original loader
+"""
+
+from struct import unpack, calcsize
+from io import StringIO
+from math import isnan
+import numpy as np
+import pytest
+
+from src.load.l1b import AlsLoader
+from src.load.l1b.cache import ColumnCache
+from src.postgis.tools import write_copy_csv_array
+from src.benchmark.synthetic import write_als
+
+
+def struct_points(file_path: str, theader_line_bytes=4, byte_order=">"):
+    """
+    Return the (elevation, longitude, latitude) points of the file at
+    `file_path` without NaN values, read line by line with `struct` like the
+    original `AlsLoader.extract_to_database`
+    """
+    points = []
+    with open(file_path, 'rb') as file:
+        header_bytes, num_lines, points_per_line = unpack(
+            byte_order + "BLB", file.read(calcsize(byte_order + "BLB"))
+        )
+        field_format = f"{byte_order}{points_per_line}d"
+        field_bytes = calcsize(field_format)
+        file.seek(header_bytes + theader_line_bytes * num_lines)
+
+        for _ in range(num_lines):
+            file.seek(field_bytes, 1)
+            line_lat = unpack(field_format, file.read(field_bytes))
+            line_lon = unpack(field_format, file.read(field_bytes))
+            line_elv = unpack(field_format, file.read(field_bytes))
+            points.extend(
+                row for row in zip(line_elv, line_lon, line_lat)
+                if not any(map(isnan, row))
+            )
+
+    return points
+
+
+@pytest.fixture
+def als_path(tmp_path):
+    path = str(tmp_path / 'als.bin')
+    write_als(
+        path, 23, points_per_line=17, track_length=300., nan_fraction=0.1
+    )
+    return path
+
+
+def test_filter_points_matches_struct_reader(als_path):
+    loader = AlsLoader()
+    with loader.open_lines(als_path) as mapped_lines:
+        points = loader._filter_points(
+            loader._stack_points(mapped_lines.records())
+        )
+
+    assert [tuple(point) for point in points.tolist()] == \
+        struct_points(als_path)
+
+
+def test_filter_points_keeps_integer_ids():
+    points = np.array([
+        [1.5, 2., 3.],
+        [np.nan, 2., 3.],
+        [0.1, 2., np.nan],
+        [4., 5., 6.]
+    ])
+    staged = AlsLoader._filter_points(points, 11)
+
+    assert np.issubdtype(staged.dtype[0], np.integer)
+    assert staged[staged.dtype.names[0]].tolist() == [11, 14]
+    np.testing.assert_array_equal(
+        np.column_stack([staged[name] for name in staged.dtype.names[1:]]),
+        points[[0, 3]]
+    )
+
+    buffer = StringIO()
+    write_copy_csv_array(staged, buffer)
+    assert buffer.getvalue().splitlines() == ['11,1.5,2,3', '14,4,5,6']
+
+
+class InsertSession:
+    """
+    Session that keeps the rows inserted into each table
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def insert(self, table, rows, target_cols=None, template=None, **kwargs):
+        self.rows.setdefault(table, []).extend(rows.tolist())
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_stream_lines_staging_order(als_path, tmp_path, cached):
+    loader = AlsLoader()
+    session = InsertSession()
+
+    with loader.open_lines(als_path) as mapped_lines:
+        cached_points = loader._cached_points(
+            ColumnCache(str(tmp_path / 'cache'), 'als'), mapped_lines, 5
+        ) if cached else None
+
+        # ranges written like parallel workers, in reverse order
+        for line_range in [(15, 23), (4, 15), (0, 4)]:
+            loader._stream_lines(
+                session, mapped_lines, 'staging', [], None, *line_range, 3,
+                write_ids=True, cached_points=cached_points
+            )
+
+    # the output serial follows the staging row order
+    rows = sorted(session.rows['staging'])
+    assert [tuple(row[1:]) for row in rows] == struct_points(als_path)
+
+
+def test_cached_points_of_empty_file(tmp_path):
+    path = str(tmp_path / 'empty.bin')
+    write_als(path, 0)
+    loader = AlsLoader()
+
+    with loader.open_lines(path) as mapped_lines:
+        cache = ColumnCache(str(tmp_path / 'cache'), 'empty')
+        written = loader._cached_points(cache, mapped_lines, 5)
+        loaded = loader._cached_points(cache, mapped_lines, 5)
+
+    assert written.shape == loaded.shape == (0, 3)
+    assert loaded.dtype == np.float64
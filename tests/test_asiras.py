@@ -0,0 +1,184 @@
+"""
+ASIRAS block decoding against the struct reader of the original loader
+"""
+
+from struct import unpack, calcsize
+from itertools import chain
+import numpy as np
+import pytest
+
+from src.load.l1b import AsirasLoader, asiras_config
+from src.load.l1b.cache import ColumnCache
+from src.benchmark.synthetic import write_asiras_dbl, _product_headers
+
+
+def struct_rows(loader: AsirasLoader, file_path: str, byte_order=">"):
+    """
+    Return the rows of the file at `file_path` read field by field with
+    `struct` like the original `AsirasLoader.extract_to_database`
+    """
+    config = loader.config
+
+    groups = []
+    for group in config.fields_format.values():
+        rules = []
+        for name, read_type, write_type, scale, count in group:
+            read_format = byte_order + (
+                str(count) + read_type if count > 1 else read_type)
+            rules.append((
+                calcsize(read_format), name != config.skip_field,
+                read_format, count > 1, scale
+            ))
+        groups.append(rules)
+
+    def read_group(file, rules):
+        group_rows = []
+        for _ in range(config.rows_per_block):
+            row = []
+            for size, save_output, read_format, multi, scale in rules:
+                if not save_output:
+                    file.read(size)
+                    continue
+                value = unpack(read_format, file.read(size))
+                if multi:
+                    row.append(
+                        [v * scale for v in value] if scale != 1
+                        else list(value)
+                    )
+                else:
+                    row.append(value[0] * scale if scale != 1 else value[0])
+            group_rows.append(row)
+        return group_rows
+
+    rows = []
+    with open(file_path, 'rb') as file:
+        start_bytes, num_blocks = loader._read_dataset_header(file)
+        file.seek(start_bytes)
+        tog_rules, mg_rules, mwg_rules = groups
+        for _ in range(num_blocks):
+            tog = read_group(file, tog_rules)
+            mg = read_group(file, mg_rules)
+            file.seek(config.cg_bytes + config.awg_bytes, 1)
+            mwg = read_group(file, mwg_rules)
+            rows.extend(tuple(chain(*row)) for row in zip(tog, mg, mwg))
+
+    return rows
+
+
+def write_random_dbl(file_path: str, num_blocks: int, seed=0):
+    """
+    Write an ASIRAS file of `num_blocks` blocks of random bytes, so every
+    field and gap holds arbitrary values
+    """
+    block_bytes = AsirasLoader()._build_block_dtype(">").itemsize
+    rng = np.random.RandomState(seed)
+    with open(file_path, 'wb') as file:
+        file.write(_product_headers(num_blocks))
+        file.write(
+            rng.randint(0, 256, num_blocks * block_bytes, np.uint8).tobytes()
+        )
+
+
+@pytest.fixture(params=['synthetic', 'random'])
+def dbl_path(request, tmp_path):
+    path = str(tmp_path / 'asiras.DBL')
+    if request.param == 'synthetic':
+        write_asiras_dbl(path, 7, track_length=500.)
+    else:
+        write_random_dbl(path, 7)
+    return path
+
+
+def test_block_dtype_matches_struct_sizes():
+    loader = AsirasLoader()
+    config = asiras_config
+    group_bytes = sum(
+        calcsize(">" + (str(count) + read_type if count > 1 else read_type))
+        for group in config.fields_format.values()
+        for name, read_type, write_type, scale, count in group
+    )
+    assert loader._build_block_dtype(">").itemsize == \
+        group_bytes * config.rows_per_block + config.cg_bytes + \
+        config.awg_bytes
+
+
+def test_decode_blocks_matches_struct_reader(dbl_path):
+    loader = AsirasLoader()
+    with loader.open_blocks(dbl_path) as mapped_blocks:
+        columns = loader._decode_blocks(mapped_blocks.records())
+        rows = loader._columns_to_rows(columns)
+
+    assert list(columns) == [
+        name for name, _ in loader._build_column_config()
+    ]
+    assert rows == struct_rows(loader, dbl_path)
+
+
+def test_read_columns_block_range(dbl_path):
+    loader = AsirasLoader()
+    names = ['latitude', 'window_delay', 'ml_power_echo']
+    full = loader.read_columns(dbl_path, names, blocks_to_buffer=3)
+    rows_per_block = asiras_config.rows_per_block
+
+    for block_range in [(0, 7), (2, 5), (6, 7)]:
+        part = loader.read_columns(
+            dbl_path, names, blocks_to_buffer=2, block_range=block_range
+        )
+        start, stop = [block * rows_per_block for block in block_range]
+        for name in names:
+            np.testing.assert_array_equal(part[name], full[name][start:stop])
+
+
+def test_read_columns_from_cache(dbl_path, tmp_path):
+    loader = AsirasLoader()
+    names = ['days', 'altitude', 'ml_power_echo']
+    cache_dir = str(tmp_path / 'cache')
+    decoded = loader.read_columns(dbl_path, names)
+    start, stop = [block * asiras_config.rows_per_block for block in (1, 6)]
+
+    # the first read writes the cache and the second reads it
+    for _ in range(2):
+        cached = loader.read_columns(
+            dbl_path, names, cache_dir=cache_dir, block_range=(1, 6)
+        )
+        for name in names:
+            np.testing.assert_array_equal(
+                cached[name], decoded[name][start:stop]
+            )
+
+
+class InsertSession:
+    """
+    Session that keeps the rows inserted into each table
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def insert(self, table, rows, target_cols=None, template=None, **kwargs):
+        self.rows.setdefault(table, []).extend(rows)
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_stream_blocks_ids_match_serial_order(dbl_path, tmp_path, cached):
+    loader = AsirasLoader()
+    expected = struct_rows(loader, dbl_path)
+    num_rows = len(expected)
+
+    with loader.open_blocks(dbl_path) as mapped_blocks:
+        cached_columns = loader._cached_columns(
+            ColumnCache(str(tmp_path / 'cache'), 'asiras'), mapped_blocks, 2
+        ) if cached else None
+
+        # two ranges written like parallel workers, in reverse order
+        session = InsertSession()
+        target_cols = [name for name, _ in loader._build_column_config()]
+        for block_range in [(4, 7), (0, 4)]:
+            loader._stream_blocks(
+                session, mapped_blocks, 'asr', target_cols, *block_range, 2,
+                col_id_name='id', cached_columns=cached_columns
+            )
+
+    rows = sorted(session.rows['asr'])
+    assert [row[0] for row in rows] == list(range(1, num_rows + 1))
+    assert [row[1:] for row in rows] == expected
@@ -0,0 +1,129 @@
+"""
+Binary `COPY ... TO STDOUT` decoding against an encoder of the same format
+"""
+
+from struct import pack
+import numpy as np
+import pytest
+
+from src.postgis.binary import copy_signature, copy_trailer, scalar_types, \
+    array_element_oids, decode_copy_binary, _decode_fixed_rows, \
+    _decode_variable_rows
+
+INT4, INT8, FLOAT4, FLOAT8, BOOL, TEXT = 23, 20, 700, 701, 16, 25
+FLOAT8_ARRAY, INT4_ARRAY = 1022, 1007
+
+
+def encode_field(value, oid: int) -> bytes:
+    if value is None:
+        return pack('>i', -1)
+
+    if oid in scalar_types:
+        data = np.array([value], scalar_types[oid]).tobytes()
+    elif oid in array_element_oids:
+        element_oid = array_element_oids[oid]
+        array = np.array(value, dtype=object)
+        elements = array.ravel().tolist()
+        if not elements:
+            data = pack('>iii', 0, 0, element_oid)
+        else:
+            has_null = any(element is None for element in elements)
+            data = pack('>iii', array.ndim, has_null, element_oid) + b''.join(
+                pack('>ii', dim, 1) for dim in array.shape
+            )
+            for element in elements:
+                data += encode_field(element, element_oid)
+    else:
+        data = value.encode()
+
+    return pack('>i', len(data)) + data
+
+
+def encode_rows(rows, oids) -> bytes:
+    """
+    Return `rows` in the binary COPY format of columns of types `oids`
+    """
+    body = b''.join(
+        pack('>h', len(row)) +
+        b''.join(encode_field(value, oid) for value, oid in zip(row, oids))
+        for row in rows
+    )
+    return copy_signature + pack('>ii', 0, 0) + body + copy_trailer
+
+
+def test_fixed_rows():
+    rows = [
+        (i, 10 ** 12 + i, i / 3, np.float32(i / 7), [[i, 0.5], [1., -i]])
+        for i in range(5)
+    ]
+    oids = [INT4, INT8, FLOAT8, FLOAT4, FLOAT8_ARRAY]
+    names = ['a', 'b', 'c', 'd', 'e']
+
+    columns = decode_copy_binary(encode_rows(rows, oids), names, oids)
+
+    assert list(columns) == names
+    np.testing.assert_array_equal(columns['a'], [row[0] for row in rows])
+    assert columns['a'].dtype == np.int32
+    np.testing.assert_array_equal(columns['b'], [row[1] for row in rows])
+    np.testing.assert_array_equal(columns['c'], [row[2] for row in rows])
+    np.testing.assert_array_equal(
+        columns['d'], np.array([row[3] for row in rows], np.float32)
+    )
+    assert columns['e'].shape == (5, 2, 2)
+    np.testing.assert_array_equal(columns['e'], [row[4] for row in rows])
+    assert columns['e'].dtype.isnative
+
+
+def test_fixed_and_variable_rows_agree():
+    rows = [(i, [i, i + 1, i + 2], i * 1.5, True) for i in range(4)]
+    oids = [INT8, INT4_ARRAY, FLOAT8, BOOL]
+    names = ['a', 'b', 'c', 'd']
+    body = encode_rows(rows, oids)[len(copy_signature) + 8:-2]
+
+    fixed = _decode_fixed_rows(body, names, oids)
+    variable = _decode_variable_rows(body, names, oids)
+
+    assert fixed is not None
+    for name in names:
+        np.testing.assert_array_equal(fixed[name], variable[name])
+        assert fixed[name].dtype == variable[name].dtype
+
+
+def test_variable_rows():
+    rows = [
+        (1, None, 'first', [1., None], None),
+        (None, 2.5, 'second, "quoted"', [3.], True),
+    ]
+    oids = [INT4, FLOAT8, TEXT, FLOAT8_ARRAY, BOOL]
+    names = ['a', 'b', 'c', 'd', 'e']
+
+    columns = decode_copy_binary(encode_rows(rows, oids), names, oids)
+
+    # NULL numbers are NaN, which turns integers into floats
+    np.testing.assert_array_equal(columns['a'], [1., np.nan])
+    np.testing.assert_array_equal(columns['b'], [np.nan, 2.5])
+    assert columns['c'].tolist() == ['first', 'second, "quoted"']
+    # arrays of different shapes are an object array of arrays
+    assert columns['d'].dtype == object
+    np.testing.assert_array_equal(columns['d'][0], [1., np.nan])
+    np.testing.assert_array_equal(columns['d'][1], [3.])
+    assert columns['e'].tolist() == [None, True]
+
+
+def test_empty_results():
+    oids = [INT4, FLOAT8_ARRAY, TEXT]
+    columns = decode_copy_binary(encode_rows([], oids), ['a', 'b', 'c'], oids)
+
+    assert columns['a'].shape == (0,) and columns['a'].dtype == np.int32
+    assert columns['b'].shape == (0, 0)
+    assert columns['c'].shape == (0,)
+
+    # rows without columns
+    assert decode_copy_binary(encode_rows([(), ()], []), [], []) == {}
+
+
+def test_invalid_data():
+    with pytest.raises(ValueError):
+        decode_copy_binary(b'not copy data', ['a'], [INT4])
+    with pytest.raises(ValueError):
+        decode_copy_binary(encode_rows([(1,)], [INT4]), ['a'], [1700])
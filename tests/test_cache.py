@@ -0,0 +1,89 @@
+"""
+Columns written to the L1B cache read back to the same values
+"""
+
+import os
+import numpy as np
+import pytest
+
+from src.load.l1b.cache import ColumnCache, content_key, cache_key, \
+    file_digest, open_cache
+
+
+def chunks_of(columns, rows_per_chunk):
+    num_rows = len(next(iter(columns.values())))
+    for start in range(0, max(num_rows, 1), rows_per_chunk):
+        yield {
+            name: values[start:start + rows_per_chunk]
+            for name, values in columns.items()
+        }
+
+
+@pytest.fixture
+def columns():
+    rng = np.random.RandomState(0)
+    return {
+        'time': rng.normal(0, 1, 25),
+        'count': rng.randint(-100, 100, 25).astype(np.int32),
+        'echo': rng.normal(0, 1, (25, 8)).astype(np.float32),
+    }
+
+
+def test_round_trip(tmp_path, columns):
+    cache = ColumnCache(str(tmp_path), 'entry')
+    assert not cache.exists()
+
+    cache.write(25, chunks_of(columns, 7))
+    assert cache.exists()
+    assert os.listdir(str(tmp_path)) == ['entry']
+
+    loaded = cache.load()
+    assert list(loaded) == list(columns)
+    for name, values in columns.items():
+        assert loaded[name].dtype == values.dtype
+        np.testing.assert_array_equal(loaded[name], values)
+        assert not loaded[name].flags.writeable
+
+
+def test_zero_rows_keep_columns(tmp_path, columns):
+    empty = {name: values[:0] for name, values in columns.items()}
+    cache = ColumnCache(str(tmp_path), 'empty')
+    cache.write(0, chunks_of(empty, 7))
+
+    loaded = cache.load()
+    assert list(loaded) == list(columns)
+    for name, values in columns.items():
+        assert loaded[name].dtype == values.dtype
+        assert loaded[name].shape == (0,) + values.shape[1:]
+
+
+def test_write_errors(tmp_path, columns):
+    cache = ColumnCache(str(tmp_path), 'entry')
+
+    with pytest.raises(ValueError):
+        cache.write(0, iter([]))
+    assert os.listdir(str(tmp_path)) == []
+
+    with pytest.raises(ValueError):
+        cache.write(30, chunks_of(columns, 7))
+    assert not cache.exists()
+
+
+def test_keys(tmp_path):
+    path = str(tmp_path / 'file.bin')
+    with open(path, 'wb') as file:
+        file.write(b'\x00' * 100)
+
+    key = cache_key(path, '>', 4)
+    assert key == content_key(file_digest(path), '>', 4)
+    assert key != cache_key(path, '<', 4)
+    assert key != cache_key(path, '>')
+
+    with open(path, 'r+b') as file:
+        file.seek(50)
+        file.write(b'\x01')
+    assert key != cache_key(path, '>', 4)
+
+    assert open_cache(None, path, '>', 4) is None
+    assert open_cache(str(tmp_path), path, '>', 4).key == \
+        cache_key(path, '>', 4)
@@ -0,0 +1,90 @@
+"""
+CSV text written for `COPY ... FROM STDIN` read back to the same values
+"""
+
+from io import StringIO
+import csv
+import numpy as np
+
+from src.postgis.config import COPY
+from src.postgis.tools import format_copy_float, format_copy_value, \
+    write_copy_csv_rows, write_copy_csv_array
+
+
+def read_csv(text: str):
+    return list(csv.reader(StringIO(text)))
+
+
+def test_format_copy_float_round_trips():
+    rng = np.random.RandomState(0)
+    values = np.concatenate([
+        rng.normal(0, 1e3, 1000),
+        rng.uniform(-1, 1, 1000) * 10. ** rng.randint(-300, 300, 1000),
+        [0., -0., 1 / 3, np.finfo(float).max, np.finfo(float).tiny]
+    ])
+    for value in values:
+        assert float(format_copy_float(value)) == value
+
+    assert format_copy_float(np.nan) == 'NaN'
+    assert format_copy_float(np.inf) == 'Infinity'
+    assert format_copy_float(-np.inf) == '-Infinity'
+
+
+def test_format_copy_value():
+    assert format_copy_value(None) == COPY.null
+    assert format_copy_value(True) == 't'
+    assert format_copy_value(np.bool_(False)) == 'f'
+    assert format_copy_value(7) == '7'
+    assert format_copy_value(np.int64(-3)) == '-3'
+    assert format_copy_value(2.) == '2'
+    assert format_copy_value([1, None, 3]) == '{1,NULL,3}'
+    assert format_copy_value([[1., 2.5], [3., 4.]]) == '{{1,2.5},{3,4}}'
+    assert format_copy_value(['a"b', 'c\\d']) == '{"a\\"b","c\\\\d"}'
+
+
+def test_write_copy_csv_rows_quotes_text():
+    rows = [
+        (1, 'plain', None, [0.5, 1.5]),
+        (2, 'comma, "quote"\nnewline', 3.25, []),
+    ]
+    buffer = StringIO()
+    assert write_copy_csv_rows(rows, buffer) == 2
+
+    assert read_csv(buffer.getvalue()) == [
+        ['1', 'plain', COPY.null, '{0.5,1.5}'],
+        ['2', 'comma, "quote"\nnewline', '3.25', '{}']
+    ]
+
+
+def test_write_copy_csv_array_matches_rows():
+    rng = np.random.RandomState(1)
+    array = rng.normal(0, 100, (50, 4))
+    array[:, 0] = np.arange(50)
+
+    array_buffer, rows_buffer = StringIO(), StringIO()
+    assert write_copy_csv_array(array, array_buffer) == 50
+    write_copy_csv_rows(array.tolist(), rows_buffer)
+
+    assert array_buffer.getvalue() == rows_buffer.getvalue()
+    assert np.array_equal(
+        np.array(read_csv(array_buffer.getvalue()), dtype=float), array
+    )
+
+
+def test_write_copy_csv_array_integers_and_records():
+    buffer = StringIO()
+    write_copy_csv_array(np.array([[1, -2], [3, 4]]), buffer)
+    assert read_csv(buffer.getvalue()) == [['1', '-2'], ['3', '4']]
+
+    records = np.rec.fromarrays(
+        [np.array([5, 6], dtype=np.int64), np.array([0.1, 2.])]
+    )
+    buffer = StringIO()
+    write_copy_csv_array(records, buffer)
+    assert [
+        (int(i), float(v)) for i, v in read_csv(buffer.getvalue())
+    ] == [(5, 0.1), (6, 2.)]
+
+    buffer = StringIO()
+    assert write_copy_csv_array(np.empty((0, 3)), buffer) == 0
+    assert buffer.getvalue() == ''
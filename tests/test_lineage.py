@@ -0,0 +1,178 @@
+"""
+Tables skipped or rebuilt from the lineage of their inputs and parameters
+"""
+
+from itertools import count
+import pytest
+
+from src.process import queries
+from src.process.process import Process
+from src.postgis.template_query import TemplateQuery
+
+query = "SELECT * FROM {T@input_table} WHERE value > {L@min_value}"
+
+
+class LineageSession:
+    """
+    Session that keeps the OID of each table and the rows of the lineage
+    table, and records the tables it creates and drops
+    """
+
+    def __init__(self, tables=()):
+        self.oids = count(1000)
+        self.tables = {
+            self.qualified_table(table): next(self.oids) for table in tables
+        }
+        self.lineage = {}
+        self.created = []
+        self.dropped = []
+        self.queries = []
+
+    def qualified_table(self, table):
+        return table if '.' in table else 'public.' + table
+
+    def table_exists(self, table):
+        return self.qualified_table(table) in self.tables
+
+    def format_query(self, query, args, kwargs):
+        return query, dict(kwargs or {})
+
+    def query_string(self, query):
+        template, kwargs = query
+        return repr((template, sorted(kwargs.items())))
+
+    def query_tables(self, query, kwargs):
+        return [
+            self.qualified_table(table)
+            for table in TemplateQuery(query).table_args(kwargs)
+        ]
+
+    def execute_query(self, query, fetch=False, single_response=False,
+                      **kwargs):
+        template, kwargs = query
+        self.queries.append(template)
+        if template is queries.table_fingerprints:
+            return [
+                [table, self.lineage.get(table, str(self.tables[table]))
+                 if table in self.tables else None]
+                for table in kwargs['tables']
+            ]
+        elif template is queries.recorded_lineage:
+            return self.lineage.get(kwargs['table_name'])
+        elif template is queries.record_lineage:
+            self.lineage[kwargs['table_name']] = kwargs['lineage_hash']
+
+    def create_table_as(self, table, query, temp=False, **kwargs):
+        self.created.append(table)
+        self.tables[self.qualified_table(table)] = next(self.oids)
+
+    def drop_table(self, table, if_exists=True):
+        self.dropped.append(table)
+        del self.tables[self.qualified_table(table)]
+
+    def commit(self):
+        pass
+
+
+def create(process, output_table='output', input_table='input',
+           min_value=0, **options):
+    process.create_table_from_query(
+        "Test", output_table, query,
+        dict(input_table=input_table, min_value=min_value), **options
+    )
+
+
+@pytest.fixture
+def session():
+    return LineageSession(tables=['input'])
+
+
+@pytest.fixture
+def process(session):
+    return Process('test', session, track_lineage=True)
+
+
+def test_missing_table_is_built(process, session):
+    create(process)
+    assert session.created == ['output']
+    assert session.dropped == []
+    assert 'public.output' in session.lineage
+
+
+def test_same_lineage_is_skipped(process, session):
+    create(process)
+    create(process)
+    create(Process('other', session, track_lineage=True))
+    assert session.created == ['output']
+    assert session.dropped == []
+
+
+@pytest.mark.parametrize('changes', [
+    dict(min_value=1),
+    dict(input_table='other_input'),
+    dict(temp=True),
+    dict(primary_key_cols=['id']),
+])
+def test_changed_lineage_is_rebuilt(process, session, changes):
+    session.tables['public.other_input'] = 1
+    session.set_primary_key = lambda table, columns: None
+    create(process)
+    recorded = session.lineage['public.output']
+
+    create(process, **changes)
+    assert session.dropped == ['output']
+    assert session.created == ['output', 'output']
+    assert session.lineage['public.output'] != recorded
+
+
+def test_table_without_record_is_rebuilt(process, session):
+    session.tables['public.output'] = 1
+    create(process)
+    assert session.dropped == ['output']
+    assert session.created == ['output']
+
+
+def test_recreated_inputs(process, session):
+    create(process, 'middle', 'input')
+    create(process, 'output', 'middle')
+
+    # an input rebuilt the same way keeps its lineage hash
+    session.tables['public.middle'] = next(session.oids)
+    create(process, 'output', 'middle')
+    assert session.created == ['middle', 'output']
+
+    # an input without a lineage record is fingerprinted by its OID
+    session.tables['public.input'] = next(session.oids)
+    create(process, 'middle', 'input')
+    create(process, 'output', 'middle')
+    assert session.created == ['middle', 'output', 'middle', 'output']
+
+
+def test_without_lineage_existing_tables_are_skipped(session):
+    process = Process('test', session, track_lineage=False)
+    assert process._lineage(
+        (query, dict(input_table='input', min_value=0)), ['input']
+    ) is None
+
+    create(process)
+    create(process, min_value=1)
+    assert session.created == ['output']
+    assert session.dropped == []
+    assert session.queries == []
+    assert session.lineage == {}
+
+
+def test_lineage_hash(process, session):
+    formatted = (query, dict(input_table='input', min_value=0))
+    lineage = process._lineage(formatted, ['input'], temp=False)
+
+    assert lineage == process._lineage(formatted, ['input'], temp=False)
+    assert lineage != process._lineage(formatted, ['input'], temp=True)
+    assert lineage != process._lineage(formatted, [], temp=False)
+    assert lineage != process._lineage(
+        (query, dict(input_table='input', min_value=1)), ['input'],
+        temp=False
+    )
+
+    session.tables['public.input'] = next(session.oids)
+    assert lineage != process._lineage(formatted, ['input'], temp=False)
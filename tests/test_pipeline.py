@@ -0,0 +1,157 @@
+"""
+Order and selection of pipeline steps from the tables they read and create
+"""
+
+from threading import Lock
+import logging
+import time
+import pytest
+
+from src.process.pipeline import Pipeline
+
+
+class FakeSession:
+    def __init__(self, tables=()):
+        self.tables = set(tables)
+
+    def table_exists(self, table):
+        return table in self.tables
+
+
+class FakeProcess:
+    """
+    Process that runs every step on its own session and records their order
+    """
+
+    def __init__(self, tables=(), track_lineage=False):
+        self.session = FakeSession(tables)
+        self.track_lineage = track_lineage
+        # ('start' or 'finish', step name) in the order they happened
+        self.events = []
+        self.lock = Lock()
+
+    def context_logger(self, context_name):
+        return logging.getLogger(context_name)
+
+    def prepare_concurrent_steps(self):
+        pass
+
+    def run_on_new_session(self, step):
+        return step(self)
+
+    @property
+    def finished(self):
+        return [name for event, name in self.events if event == 'finish']
+
+
+def recording_step(name, seconds=0.):
+    def run(process):
+        with process.lock:
+            process.events.append(('start', name))
+        time.sleep(seconds)
+        with process.lock:
+            process.events.append(('finish', name))
+    return run
+
+
+def diamond_pipeline(seconds=0.):
+    """
+    Steps added out of order: d reads b and c, which both read a
+    """
+    pipeline = Pipeline()
+    pipeline.add('d', recording_step('d', seconds), ['b', 'c'], ['d'])
+    pipeline.add('b', recording_step('b', seconds), ['a', 'src'], ['b'])
+    pipeline.add('c', recording_step('c', seconds), ['a'], ['c'])
+    pipeline.add('a', recording_step('a', seconds), ['src'], ['a'])
+    pipeline.add('e', recording_step('e', seconds), ['a'], ['e'])
+    return pipeline
+
+
+def names(steps):
+    return [step.name for step in steps]
+
+
+def test_order():
+    pipeline = diamond_pipeline()
+    assert names(pipeline.order()) == ['a', 'b', 'c', 'd', 'e']
+    assert names(pipeline.dependencies(pipeline.steps[0])) == ['b', 'c']
+
+
+def test_select():
+    pipeline = diamond_pipeline()
+
+    assert names(pipeline.select()) == ['d', 'b', 'c', 'a', 'e']
+    assert names(pipeline.select(['b'])) == ['b', 'a']
+    assert names(pipeline.select(['e', 'c'])) == ['c', 'a', 'e']
+
+    # steps of existing tables skip themselves, so their ancestors are not
+    # needed for them
+    exists = {'b', 'c'}.__contains__
+    assert names(pipeline.select(['d'], exists)) == ['d', 'b', 'c']
+    assert names(pipeline.select(None, exists)) == ['d', 'b', 'c', 'a', 'e']
+    assert names(pipeline.select(['d'], {'d'}.__contains__)) == ['d']
+
+    with pytest.raises(ValueError):
+        pipeline.select(['src'])
+
+
+def test_invalid_graphs():
+    pipeline = Pipeline()
+    pipeline.add('a', recording_step('a'), [], ['a'])
+    with pytest.raises(ValueError):
+        pipeline.add('other a', recording_step('a'), [], ['a'])
+
+    pipeline = Pipeline()
+    pipeline.add('a', recording_step('a'), ['b'], ['a'])
+    pipeline.add('b', recording_step('b'), ['a'], ['b'])
+    with pytest.raises(ValueError):
+        pipeline.order()
+
+
+def test_run_sequential():
+    process = FakeProcess(tables=['c'])
+    diamond_pipeline().run(process, targets=['d', 'e'])
+    assert process.finished == ['a', 'b', 'c', 'd', 'e']
+
+    # without lineage the ancestors of existing tables are not run
+    process = FakeProcess(tables=['b', 'c'])
+    diamond_pipeline().run(process, targets=['d'])
+    assert process.finished == ['b', 'c', 'd']
+
+    # with lineage every step checks if its table is current
+    process = FakeProcess(tables=['b', 'c'], track_lineage=True)
+    diamond_pipeline().run(process, targets=['d'])
+    assert process.finished == ['a', 'b', 'c', 'd']
+
+
+def test_run_concurrent():
+    process = FakeProcess()
+    diamond_pipeline(0.05).run(process, workers=3)
+
+    assert sorted(process.finished) == ['a', 'b', 'c', 'd', 'e']
+    event = process.events.index
+    for step, dependencies in [
+        ('b', ['a']), ('c', ['a']), ('e', ['a']), ('d', ['b', 'c'])
+    ]:
+        for dependency in dependencies:
+            assert event(('finish', dependency)) < event(('start', step))
+    # b, c and e only depend on a so they run at the same time
+    assert {name for _, name in process.events[2:5]} == {'b', 'c', 'e'}
+    assert all(event == 'start' for event, _ in process.events[2:5])
+
+
+def test_run_concurrent_failure():
+    def fail(process):
+        raise RuntimeError("step failed")
+
+    pipeline = Pipeline()
+    pipeline.add('a', recording_step('a'), [], ['a'])
+    pipeline.add('b', fail, ['a'], ['b'])
+    pipeline.add('c', recording_step('c', 0.05), ['a'], ['c'])
+    pipeline.add('d', recording_step('d'), ['b', 'c'], ['d'])
+
+    process = FakeProcess()
+    with pytest.raises(RuntimeError):
+        pipeline.run(process, workers=2)
+    # running steps finish and steps that have not started are not run
+    assert process.finished == ['a', 'c']
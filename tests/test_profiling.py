@@ -0,0 +1,139 @@
+"""
+Step profiles of the tables a step creates or appends to
+"""
+
+import csv
+import json
+import pytest
+
+from src.process import queries
+from src.process.profiling import StepProfiler, profiled_step, \
+    report_columns
+
+
+class TableSession:
+    """
+    Session that keeps the OID and row count of each table, with a total
+    size of 10 bytes per row
+    """
+
+    query_seconds = 0.
+
+    def __init__(self):
+        self.tables = {}
+        self.next_oid = 100
+
+    def qualified_table(self, table):
+        return 'public.' + table
+
+    def format_query(self, query, args, kwargs):
+        return query, kwargs
+
+    def execute_query(self, query, fetch=False, single_response=False,
+                      **kwargs):
+        template, kwargs = query
+        if template is queries.table_oid:
+            table = self.tables.get(kwargs['table'])
+            return table[0] if table else None
+        elif template is queries.table_stats:
+            oid, rows = self.tables[kwargs['table']]
+            assert oid == kwargs['oid']
+            return [(rows, rows * 10)]
+
+    def create(self, table, rows):
+        self.next_oid += 1
+        self.tables[table] = [self.next_oid, rows]
+
+
+class ProfiledProcess:
+    def __init__(self):
+        self.session = TableSession()
+        self.profiler = StepProfiler('test')
+        self._profile_depth = 0
+
+    @profiled_step('table', context_arg='context')
+    def create(self, context, table, rows):
+        self.session.create(table, rows)
+
+    @profiled_step('table')
+    def append(self, table, rows):
+        self.session.tables[table][1] += rows
+
+    @profiled_step('table')
+    def create_if_missing(self, table, rows):
+        if table not in self.session.tables:
+            self.session.create(table, rows)
+
+    @profiled_step('first', 'second')
+    def create_both(self, first, second):
+        self.create("Nested", first, 2)
+        self.create("Nested", second, 3)
+
+    @profiled_step('table')
+    def fail(self, table):
+        self.session.create(table, 1)
+        raise RuntimeError("step failed")
+
+
+def records(process):
+    return [
+        (record['step'], record['built'], record['rows'],
+         record['size_bytes'])
+        for record in process.profiler.records
+    ]
+
+
+def test_built_rows_and_size():
+    process = ProfiledProcess()
+    process.create("Create", 'a', 5)
+    process.append('a', 3)
+    process.append('a', 0)
+    process.create_if_missing('a', 7)
+    process.create("Recreate", 'a', 4)
+    process.create_both('b', 'c')
+
+    assert records(process) == [
+        ('create', True, 5, 50),
+        ('append', True, 3, 30),
+        ('append', False, None, None),
+        ('create_if_missing', False, None, None),
+        ('create', True, 4, 40),
+        ('create_both', True, 5, 50),
+    ]
+    assert [
+        record['context'] for record in process.profiler.records
+    ] == ["Create", None, None, None, "Recreate", None]
+    assert process.profiler.records[-1]['output_tables'] == ['b', 'c']
+
+
+def test_failed_steps_are_not_recorded():
+    process = ProfiledProcess()
+    with pytest.raises(RuntimeError):
+        process.fail('a')
+    assert process.profiler.records == []
+    assert process._profile_depth == 0
+
+
+def test_without_profiler():
+    process = ProfiledProcess()
+    process.profiler = None
+    process.create("Create", 'a', 5)
+    assert process.session.tables['a'][1] == 5
+
+
+def test_reports(tmp_path):
+    process = ProfiledProcess()
+    process.create("Create", 'a', 5)
+    process.create_both('b', 'c')
+
+    json_path, csv_path = process.profiler.write_reports(str(tmp_path))
+
+    with open(json_path) as file:
+        report = json.load(file)
+    assert [list(record) for record in report] == [report_columns] * 2
+    assert [record['rows'] for record in report] == [5, 5]
+
+    with open(csv_path, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == report_columns
+    assert rows[2][report_columns.index('output_tables')] == 'b;c'
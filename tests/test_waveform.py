@@ -0,0 +1,200 @@
+"""
+Batched waveform kernels against the per-row functions of the original
+processing
+"""
+
+import numpy as np
+import pytest
+
+from src.process import kernels
+from src.process.tools import InterpolateDirection, WaveformStorage, \
+    lin_interp_from_first_max, lin_interp_from_first_max_2d, \
+    aggregate_relative_indices, calc_tfmra_elevation, calc_waveform_shape, \
+    calc_waveform_outputs, calc_scaled_waveform, calc_first_bin_elvtn, \
+    compact_waveforms, expand_waveforms
+
+thresholds = [0.1, 0.25, 0.5, 0.8, 1.]
+ppeak_indices_left = range(-3, 0)
+ppeak_indices_right = range(1, 4)
+
+
+def row_indices(waveform, threshold, direction):
+    """
+    `lin_interp_from_first_max` of each row of `waveform`, NaN for `None`
+    """
+    indices = [
+        lin_interp_from_first_max(array, threshold, direction)
+        for array in waveform
+    ]
+    return np.array(
+        [np.nan if index is None else index for index in indices], float
+    )
+
+
+@pytest.fixture
+def waveform():
+    rng = np.random.RandomState(0)
+    smooth = np.exp(-0.5 * ((np.arange(64) - rng.uniform(0, 64, (40, 1)))
+                            / rng.uniform(1, 10, (40, 1))) ** 2)
+    # small integers give ties between bins and with the targets
+    ties = rng.randint(0, 5, (40, 64)).astype(float)
+    edges = np.zeros((4, 64))
+    edges[0, 0] = edges[1, -1] = 1.
+    edges[2] = np.linspace(1, 0, 64)
+    return np.vstack([smooth, ties, edges, np.zeros((1, 64))])
+
+
+compiled_options = [False] + ([True] if kernels.compiled else [])
+
+
+@pytest.mark.parametrize('use_compiled', compiled_options)
+@pytest.mark.parametrize('direction', list(InterpolateDirection))
+def test_lin_interp_2d_matches_rows(waveform, direction, use_compiled):
+    indices = lin_interp_from_first_max_2d(
+        waveform, thresholds, direction, rows_per_chunk=7,
+        use_compiled=use_compiled
+    )
+
+    assert indices.shape == (waveform.shape[0], len(thresholds))
+    for column, threshold in enumerate(thresholds):
+        np.testing.assert_array_equal(
+            indices[:, column], row_indices(waveform, threshold, direction)
+        )
+
+
+def test_tfmra_elevation_matches_rows(waveform):
+    first_bin_elvtn = np.linspace(100, 120, waveform.shape[0])
+    elevations = calc_tfmra_elevation(
+        thresholds, waveform, first_bin_elvtn, 0.1
+    )
+
+    for column, threshold in enumerate(thresholds):
+        np.testing.assert_array_equal(
+            elevations[:, column],
+            first_bin_elvtn - row_indices(
+                waveform, threshold, InterpolateDirection.LEFT
+            ) * 0.1
+        )
+
+
+def row_waveform_shape(waveform, bin_size, signal_threshold):
+    """
+    Waveform shape of each row of `waveform` calculated like the original
+    `Process.create_wshape_table`
+    """
+    peak_value = np.amax(waveform, 1)
+    peak_index = np.argmax(waveform, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ppeak_full = peak_value / np.sum(waveform, 1)
+
+    ppeaks = []
+    for indices in [ppeak_indices_left, ppeak_indices_right]:
+        sums = np.apply_along_axis(
+            lambda a: aggregate_relative_indices(
+                a, indices, np.argmax, np.sum
+            ),
+            1, waveform
+        )
+        sums[sums == 0] = np.nan
+        ppeaks.append(peak_value / sums)
+
+    rwidth_left = (peak_index - row_indices(
+        waveform, signal_threshold, InterpolateDirection.LEFT
+    )) * bin_size
+    rwidth_right = (peak_index + row_indices(
+        waveform, signal_threshold, InterpolateDirection.RIGHT
+    )) * bin_size
+
+    return np.column_stack([
+        ppeak_full, ppeaks[0], ppeaks[1],
+        rwidth_left + rwidth_right, rwidth_left, rwidth_right
+    ])
+
+
+def test_waveform_shape_matches_rows(waveform):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.testing.assert_array_equal(
+            calc_waveform_shape(
+                waveform, ppeak_indices_left, ppeak_indices_right, 0.1, 0.5
+            ),
+            row_waveform_shape(waveform, 0.1, 0.5)
+        )
+
+
+def test_waveform_outputs_in_chunks(waveform):
+    num_rows = waveform.shape[0]
+    rng = np.random.RandomState(1)
+    inputs = dict(
+        lin_factor=rng.uniform(1, 2, num_rows),
+        pow2_factor=rng.randint(0, 4, num_rows).astype(float),
+        rwc_delay=rng.uniform(1e-6, 2e-6, num_rows),
+        sensor_elvtn=rng.uniform(300, 400, num_rows),
+        waveform=waveform
+    )
+    options = dict(
+        bin_size=0.1, retracker_thresholds=thresholds,
+        ppeak_indices_left=ppeak_indices_left,
+        ppeak_indices_right=ppeak_indices_right, signal_threshold=0.5
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full = calc_waveform_outputs(**inputs, **options)
+
+        out = {name: np.empty_like(values) for name, values in full.items()}
+        for start in range(0, num_rows, 9):
+            chunk = slice(start, start + 9)
+            calc_waveform_outputs(
+                **{name: values[chunk] for name, values in inputs.items()},
+                **options,
+                out={name: values[chunk] for name, values in out.items()}
+            )
+
+    for name, values in full.items():
+        np.testing.assert_array_equal(out[name], values)
+
+    scaled = calc_scaled_waveform(
+        waveform, inputs['lin_factor'], inputs['pow2_factor']
+    )
+    first_bin_elvtn = calc_first_bin_elvtn(
+        0.1, inputs['rwc_delay'], inputs['sensor_elvtn'], waveform.shape[1]
+    )
+    np.testing.assert_array_equal(full['scaled_waveform'], scaled)
+    np.testing.assert_array_equal(full['first_bin_elvtn'], first_bin_elvtn)
+    np.testing.assert_array_equal(
+        full['tfmra_elvtns'],
+        calc_tfmra_elevation(thresholds, scaled, first_bin_elvtn, 0.1)
+    )
+
+
+@pytest.mark.parametrize('storage', [
+    WaveformStorage.FLOAT32, WaveformStorage.UINT16
+])
+def test_compact_waveforms_round_trip(waveform, storage):
+    window_bins = 16
+    window_start, value_offset, value_scale, windows = compact_waveforms(
+        waveform, window_bins, storage
+    )
+    expanded = expand_waveforms(
+        window_start, value_offset, value_scale, windows, waveform.shape[1]
+    )
+
+    assert windows.shape == (waveform.shape[0], window_bins)
+    assert np.all(window_start >= 0)
+    assert np.all(window_start + window_bins <= waveform.shape[1])
+    # every peak is inside its window
+    assert np.all(
+        (waveform.argmax(axis=1) >= window_start) &
+        (waveform.argmax(axis=1) < window_start + window_bins)
+    )
+
+    inside = np.zeros(waveform.shape, bool)
+    for row, start in enumerate(window_start):
+        inside[row, start:start + window_bins] = True
+    assert np.all(expanded[~inside] == 0)
+
+    tolerance = np.abs(waveform).max(axis=1, keepdims=True) * (
+        1e-6 if storage == WaveformStorage.FLOAT32 else 1e-4
+    )
+    assert np.all(np.abs(expanded - waveform)[inside] <=
+                  np.broadcast_to(tolerance, waveform.shape)[inside])